@@ -0,0 +1,47 @@
+"""
+Per-message cost of routing a chat stream (about 10% commands) through the
+command table, against the previous per-message regex matching.
+
+    python bench/bench_command_router.py
+"""
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot import COMMAND_ALIASES, command_router
+
+MESSAGES = 200_000
+CHATTER = ["lol nice", "what do you think about this one?", "ok " * 30, "https://example.com/x.png", "thanks!"]
+COMMANDS = ["!c", "!q what color is the car?", "!d cat, dog", "!p person", "!images", "!help", "!md c"]
+
+# The alias lookup the regex matching was paired with
+PREVIOUS_ALIASES = {alias for aliases in COMMAND_ALIASES.values() for alias in aliases}
+
+def previous_route(content):
+    """Routing as on_message did it before the table: two regexes compiled from the cache per message"""
+    match = re.match(r'!moondream\s+(\w+)(?:\s+(.+))?', content.strip()) or re.match(r'!(\w+)(?:\s+(.+))?', content.strip())
+    if match:
+        endpoint = match.group(1).lower()
+        return endpoint in ['caption', 'query', 'detect', 'point'] or endpoint in PREVIOUS_ALIASES
+
+def per_message(route, messages):
+    started = time.perf_counter()
+    for message in messages:
+        route(message)
+    return (time.perf_counter() - started) / len(messages) * 1e9
+
+def main():
+    rng = random.Random(0)
+    stream = [rng.choice(COMMANDS) if rng.random() < 0.1 else rng.choice(CHATTER) for _ in range(MESSAGES)]
+    commands = [message for message in stream if message.startswith('!')]
+    chatter = [message for message in stream if not message.startswith('!')]
+    print(f"{'':10}{'previous':>10}{'table':>10}  (ns per message)")
+    for label, messages in (('all', stream), ('chatter', chatter), ('commands', commands)):
+        print(f"{label:10}{per_message(previous_route, messages):10.0f}{per_message(command_router.route, messages):10.0f}")
+
+if __name__ == '__main__':
+    main()
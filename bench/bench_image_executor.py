@@ -0,0 +1,61 @@
+"""
+Event loop latency while eight large images are decoded and encoded, inline
+on the loop versus in the image worker pool.
+
+    python bench/bench_image_executor.py
+"""
+import asyncio
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+from bot import decode_and_encode
+from image_executor import ImageExecutor
+
+JOBS = 8
+TICK = 0.01  # Seconds the probe sleeps; anything beyond it is loop lag
+
+def sample_image():
+    buffer = io.BytesIO()
+    Image.effect_noise((6000, 4000), 50).convert('RGB').save(buffer, 'JPEG', quality=90)
+    return buffer.getvalue()
+
+async def probe(stop, lags):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(TICK)
+        lags.append(time.perf_counter() - started - TICK)
+
+async def run(data, pooled):
+    executor = ImageExecutor()
+    stop = asyncio.Event()
+    lags = []
+    probe_task = asyncio.create_task(probe(stop, lags))
+
+    async def job():
+        await asyncio.sleep(0)
+        if pooled:
+            return await executor.run(decode_and_encode, io.BytesIO(data))
+        return decode_and_encode(io.BytesIO(data))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(job() for _ in range(JOBS)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await probe_task
+    executor.shutdown()
+    label = f"pool ({executor.max_workers} workers)" if pooled else "inline"
+    print(f"{label:18} total {elapsed:5.2f} s, worst loop lag {max(lags) * 1000:5.0f} ms")
+
+def main():
+    data = sample_image()
+    print(f"{JOBS} x 6000x4000 JPEG ({len(data) / 1024 / 1024:.1f} MB)")
+    asyncio.run(run(data, pooled=False))
+    asyncio.run(run(data, pooled=True))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,36 @@
+"""
+Throughput of split_markdown() on 100 KB of mixed Markdown, against the old
+fixed-offset slicing.
+
+    python bench/bench_message_splitter.py
+"""
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'tests'))
+
+from message_splitter import DISCORD_SAFE_LIMIT, split_markdown
+from test_message_splitter import random_markdown
+
+SIZE = 100_000
+ROUNDS = 50
+
+def timed(function):
+    started = time.perf_counter()
+    for _ in range(ROUNDS):
+        result = function()
+    return (time.perf_counter() - started) / ROUNDS * 1000, result
+
+def main():
+    content = random_markdown(random.Random(2), SIZE)
+    elapsed, chunks = timed(lambda: split_markdown(content))
+    print(f"split_markdown: {elapsed:.2f} ms for {len(content) / 1000:.0f} KB ({len(chunks)} chunks)")
+    elapsed, chunks = timed(lambda: [content[i:i + DISCORD_SAFE_LIMIT] for i in range(0, len(content), DISCORD_SAFE_LIMIT)])
+    print(f"fixed slicing:  {elapsed:.3f} ms ({len(chunks)} chunks)")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+Size, encode time and estimated upload time of API payloads for a corpus of
+typical uploads, under the previous fixed-draft policy and the current
+longest-side policy as JPEG and WebP.
+
+    python bench/bench_payload.py
+"""
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageDraw
+import bot
+
+UPLINK_MBPS = 20  # Assumed upload bandwidth for the upload estimate
+ROUNDS = 3
+
+def photo(width, height):
+    """A synthetic photo: smooth gradients, some shapes and sensor-like noise"""
+    base = Image.effect_noise((width // 8, height // 8), 80).convert('RGB').resize((width, height), Image.BICUBIC)
+    gradient = Image.linear_gradient('L').resize((width, height)).convert('RGB')
+    image = Image.blend(base, gradient, 0.4)
+    draw = ImageDraw.Draw(image)
+    for n in range(40):
+        x = n * width // 40
+        draw.ellipse([x, height // 3, x + width // 30, height // 3 + height // 10], fill=(n * 6, 100, 200 - n * 4))
+    return Image.blend(image, Image.effect_noise((width, height), 30).convert('RGB'), 0.15)
+
+def save(image, image_format, **options):
+    buffer = io.BytesIO()
+    image.save(buffer, image_format, **options)
+    return buffer.getvalue()
+
+def corpus():
+    rotated = Image.Exif()
+    rotated[0x0112] = 6  # Orientation: rotate 90 degrees
+    screenshot = Image.new('RGB', (2560, 1440), 'white')
+    draw = ImageDraw.Draw(screenshot)
+    for y in range(0, 1440, 18):
+        draw.text((20, y), 'Lorem ipsum dolor sit amet consectetur ' * 5, fill='black')
+    transparent = photo(1600, 1200).convert('RGBA')
+    transparent.putalpha(Image.linear_gradient('L').resize((1600, 1200)))
+    return {
+        'phone 4032x3024 jpeg': save(photo(4032, 3024), 'JPEG', quality=92),
+        'phone rotated (exif)': save(photo(4032, 3024), 'JPEG', quality=92, exif=rotated),
+        'panorama 4000x1200 jpeg': save(photo(4000, 1200), 'JPEG', quality=92),
+        'screenshot 2560x1440 png': save(screenshot, 'PNG'),
+        'rgba 1600x1200 png': save(transparent, 'PNG'),
+        'small 800x600 jpeg': save(photo(800, 600), 'JPEG', quality=90),
+    }
+
+def previous_policy(image_bytes):
+    """The payload policy before longest-side sizing: draft by both sides, default JPEG settings"""
+    image = Image.open(image_bytes)
+    width, height = image.size
+    scale = 1
+    if width > 3200 and height > 3200:
+        scale = 4
+    elif width > 2400 and height > 2400:
+        scale = 3
+    elif width > 1600 and height > 1600:
+        scale = 2
+    if scale > 1:
+        image_bytes.seek(0)
+        image = Image.open(image_bytes)
+        image.draft('RGB', (width // scale, height // scale))
+    return save(image.convert('RGB'), 'JPEG')
+
+def current_policy(image_format):
+    def encode(image_bytes):
+        bot.IMAGE_PAYLOAD_FORMAT = image_format
+        return bot.decode_and_encode(image_bytes)[1]
+    return encode
+
+def measure(encode, data):
+    best = None
+    for _ in range(ROUNDS):
+        started = time.perf_counter()
+        payload = encode(io.BytesIO(data))
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    # Base64 inflates the body by a third
+    upload = len(payload) * 4 / 3 * 8 / (UPLINK_MBPS * 1e6)
+    return payload, best, upload
+
+def main():
+    policies = [('previous', previous_policy), ('jpeg', current_policy('jpeg')), ('webp', current_policy('webp'))]
+    header = f"{'image':26}{'source':>8}"
+    for name, _ in policies:
+        header += f" | {name + ' KB':>11}{'ms':>6}{'up ms':>7}"
+    print(header)
+    totals = {name: 0 for name, _ in policies}
+    for label, data in corpus().items():
+        row = f"{label:26}{len(data) / 1024:7.0f}K"
+        for name, encode in policies:
+            payload, elapsed, upload = measure(encode, data)
+            totals[name] += len(payload)
+            row += f" | {len(payload) / 1024:11.0f}{elapsed * 1000:6.0f}{upload * 1000:7.0f}"
+        print(row)
+    print("total KB: " + ", ".join(f"{name} {total / 1024:.0f}" for name, total in totals.items()))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""
+Body size and build time of Moondream API request bodies, for the previous
+path (a base64 data URL string passed through json.dumps on every call)
+against EncodedImage data URLs spliced in by build_request_body.
+
+Each payload is used for a title query plus a three-object detect, the calls
+one image gets when it is posted with "!d cat, dog, person".
+
+    python bench/bench_request_body.py
+"""
+import base64
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from moondream_client import EncodedImage, build_request_body
+
+PAYLOAD_SIZES = [100 * 1024, 400 * 1024, 1500 * 1024]  # Encoded image bytes
+CALLS = [
+    {"stream": False, "question": "return a title for this image"},
+    {"stream": False, "object": "cat"},
+    {"stream": False, "object": "dog"},
+    {"stream": False, "object": "person"},
+]
+ROUNDS = 20
+
+def previous_bodies(data):
+    """As before: one data URL string per image, then json.dumps and encode for each call"""
+    image_url = f"data:image/jpeg;base64,{base64.b64encode(data).decode('utf-8')}"
+    return [json.dumps({"image_url": image_url, **fields}).encode('utf-8') for fields in CALLS]
+
+def spliced_bodies(data):
+    image = EncodedImage(data)
+    return [build_request_body(image, fields) for fields in CALLS]
+
+def measure(build, data):
+    best = None
+    for _ in range(ROUNDS):
+        started = time.perf_counter()
+        bodies = build(data)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return bodies, best
+
+def main():
+    print(f"{'payload':>8} | {'previous KB':>11} {'ms/call':>8} | {'spliced KB':>10} {'ms/call':>8}")
+    for size in PAYLOAD_SIZES:
+        data = os.urandom(size)
+        row = f"{size // 1024:7}K"
+        results = []
+        for build in (previous_bodies, spliced_bodies):
+            bodies, elapsed = measure(build, data)
+            results.append([json.loads(body) for body in bodies])
+            row += f" | {len(bodies[0]) / 1024:11.0f} {elapsed * 1000 / len(CALLS):8.2f}"
+        # Both paths must send the same JSON
+        assert results[0] == results[1]
+        print(row)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Render time and output size of detect/point visualizations with 1, 50 and
+500 shapes on a 1536x1152 frame, for the previous per-shape drawing and the
+current sprite-based renderer.
+
+    python bench/bench_visualization.py
+"""
+import io
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageDraw
+from bot import visualize_bounding_boxes, visualize_points
+
+FRAME_SIZE = (1536, 1152)
+SHAPE_COUNTS = (1, 50, 500)
+COLORS = ['#FF1E1E', '#1E90FF', '#32CD32']
+ROUNDS = 5
+
+def encoded(image):
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG")
+    buffer.seek(0)
+    return buffer
+
+def previous_boxes(image, boxes, width=8):
+    """Boxes as drawn before sprites: a black and a colored rectangle per box"""
+    image = image.copy()
+    draw = ImageDraw.Draw(image)
+    w, h = image.size
+    for box in boxes:
+        rect = [box["x_min"] * w, box["y_min"] * h, box["x_max"] * w, box["y_max"] * h]
+        draw.rectangle(rect, outline="#000000", width=width + 2)
+        draw.rectangle(rect, outline=box["color"], width=width)
+    return encoded(image)
+
+def previous_points(image, points, radius=5):
+    """Points as drawn before sprites: five ellipses per point"""
+    image = image.copy()
+    draw = ImageDraw.Draw(image)
+    w, h = image.size
+
+    def circle(x, y, r, **options):
+        draw.ellipse([x - r, y - r, x + r, y + r], **options)
+
+    for point in points:
+        x, y = point["x"] * w, point["y"] * h
+        circle(x, y, radius * 5 + 2, outline="#000000", width=6)
+        circle(x, y, radius * 5, outline=point["color"], width=4)
+        circle(x, y, radius * 3, outline="#00FF00", width=4)
+        circle(x, y, radius * 1.5, fill=point["color"])
+        circle(x, y, radius * 0.8, fill="#00FF00")
+    return encoded(image)
+
+def random_boxes(rng, count):
+    boxes = []
+    for n in range(count):
+        x, y = rng.random() * 0.9, rng.random() * 0.9
+        boxes.append({'x_min': x, 'y_min': y, 'x_max': x + 0.08, 'y_max': y + 0.1, 'color': COLORS[n % 3]})
+    return boxes
+
+def random_points(rng, count):
+    return [{'x': rng.random(), 'y': rng.random(), 'color': COLORS[n % 3]} for n in range(count)]
+
+def measure(render, frame, shapes):
+    best = None
+    for _ in range(ROUNDS):
+        started = time.perf_counter()
+        output = render(frame, shapes)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000, len(output.getvalue()) / 1024
+
+def main():
+    rng = random.Random(1)
+    frame = Image.effect_noise((FRAME_SIZE[0] // 4, FRAME_SIZE[1] // 4), 40).convert('RGB').resize(FRAME_SIZE)
+    print(f"{'case':12}{'previous ms':>13}{'KB':>6}{'current ms':>13}{'KB':>6}")
+    for count in SHAPE_COUNTS:
+        for label, shapes, previous, current in (
+            ('boxes', random_boxes(rng, count), previous_boxes, visualize_bounding_boxes),
+            ('points', random_points(rng, count), previous_points, visualize_points),
+        ):
+            old_ms, old_kb = measure(previous, frame, shapes)
+            new_ms, new_kb = measure(current, frame, shapes)
+            print(f"{label + ' ' + str(count):12}{old_ms:13.1f}{old_kb:6.0f}{new_ms:13.1f}{new_kb:6.0f}")
+
+if __name__ == '__main__':
+    main()
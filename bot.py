@@ -1,209 +1,232 @@
+import asyncio
 import discord
 from discord.ext import commands, tasks
-import requests
-import sys
-import base64
+import functools
 import json
 import io
 import os
-from PIL import Image, ImageDraw
+from PIL import Image, ImageDraw, ImageOps, UnidentifiedImageError
 from dotenv import load_dotenv
 import datetime
 import re
 import math
-from collections import OrderedDict
-import time
 import psutil
 import platform
+import time
 
 # Load environment variables
 load_dotenv()
 
-def visualize_bounding_boxes(image, boxes, outline="#FF1E1E", width=8):
-    """Draw bounding boxes on a copy of the image and return an in-memory buffer."""
-    # Create a copy of the image to avoid modifying the original
-    img_copy = image.copy()
-    draw = ImageDraw.Draw(img_copy)
-    img_width, img_height = img_copy.size
+from moondream_client import MoondreamClient, EncodedImage
+from image_downloader import ImageDownloader, ImageDownloadError, LazyImage
+from image_executor import ImageExecutor
+from image_cache import ImageCache, DiskCacheTier, FrameCache, IMAGE_CACHE_DIR, IMAGE_CACHE_FLUSH_INTERVAL, content_hash, normalize_url
+from result_cache import ResultCache
+from thread_store import ThreadStore, ImageHistory
+from command_router import CommandRouter
+from scheduler import RequestScheduler, RequestOwner, TokenBucket, SingleFlight, request_owner
+
+# Visualization output
+VISUALIZATION_JPEG_QUALITY = int(os.getenv('VISUALIZATION_JPEG_QUALITY', '75'))  # JPEG quality of posted visualizations
+
+def scaled_stroke(image, divisor):
+    """Return a stroke size proportional to the image, so overlays look the same at any resolution"""
+    return max(2, round(max(image.size) / divisor))
+
+@functools.lru_cache(maxsize=64)
+def point_sprite(point_radius, color):
+    """
+    Pre-render the concentric point marker for a radius and color.
+    
+    Drawn at 4x and downsampled for smooth edges; cached because every point
+    of a visualization (and most visualizations) uses the same few markers.
+    """
+    scale = 4
+    outer_radius = point_radius * 5
+    half = outer_radius + 3
+    size = 2 * half + 1
+    sprite = Image.new("RGBA", (size * scale, size * scale), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(sprite)
+    center = half * scale + scale // 2
+    
+    def circle(radius, **kwargs):
+        radius *= scale
+        draw.ellipse([center - radius, center - radius, center + radius, center + radius], **kwargs)
+    
+    # Black outer ring for contrast, then the colored ring
+    circle(outer_radius + 2, outline="#000000", width=6 * scale)
+    circle(outer_radius, outline=color, width=4 * scale)
+    # Neon green middle ring
+    circle(point_radius * 3, outline="#00FF00", width=4 * scale)
+    # Solid colored inner circle with a neon green center dot
+    circle(point_radius * 1.5, fill=color)
+    circle(point_radius * 0.8, fill="#00FF00")
+    return sprite.resize((size, size), Image.LANCZOS)
 
-    # Draw each bounding box
-    for box in boxes:
-        x_min = box["x_min"] * img_width
-        y_min = box["y_min"] * img_height
-        x_max = box["x_max"] * img_width
-        y_max = box["y_max"] * img_height
-        # Draw a slightly thicker black outline first for contrast
-        draw.rectangle([x_min, y_min, x_max, y_max], outline="#000000", width=width+2)
-        # Draw bright red box
-        draw.rectangle([x_min, y_min, x_max, y_max], outline="#FF1E1E", width=width)
-    
-    # Save to buffer
+def encode_visualization(image):
+    """Encode a finished visualization as JPEG into an in-memory buffer"""
     buf = io.BytesIO()
-    img_copy.save(buf, format="JPEG")
+    image.save(buf, format="JPEG", quality=VISUALIZATION_JPEG_QUALITY)
     buf.seek(0)
     return buf
 
-def visualize_points(image, points, point_radius=5):
-    """Draw points on a copy of the image and return an in-memory buffer."""
-    # Create a copy of the image to avoid modifying the original
+def visualize_bounding_boxes(image, boxes, outline="#FF1E1E", width=None):
+    """Draw bounding boxes on a copy of the image and return an in-memory buffer.
+    
+    A box may carry its own "color", otherwise `outline` is used. The line
+    width scales with the image unless given.
+    """
+    # Create a copy of the image to avoid modifying the original (it may be a shared cached frame)
     img_copy = image.copy()
     draw = ImageDraw.Draw(img_copy)
     img_width, img_height = img_copy.size
+    width = width or scaled_stroke(img_copy, 192)
+    
+    rects = [
+        (box["x_min"] * img_width, box["y_min"] * img_height, box["x_max"] * img_width, box["y_max"] * img_height)
+        for box in boxes
+    ]
+    # Draw every black contrast outline first, so no outline covers another box's color
+    for rect in rects:
+        draw.rectangle(rect, outline="#000000", width=width + 2)
+    for rect, box in zip(rects, boxes):
+        draw.rectangle(rect, outline=box.get("color", outline), width=width)
+    
+    return encode_visualization(img_copy)
 
-    # Draw each point with a concentric circle design
+def visualize_points(image, points, point_radius=None, color="#FF1E1E"):
+    """Draw points on a copy of the image and return an in-memory buffer.
+    
+    Each point is a cached, pre-rendered marker pasted through its own alpha.
+    A point may carry its own "color" for the outer ring and inner circle,
+    otherwise `color` is used. The marker size scales with the image unless given.
+    """
+    # Create a copy of the image to avoid modifying the original (it may be a shared cached frame)
+    img_copy = image.copy()
+    img_width, img_height = img_copy.size
+    point_radius = point_radius or scaled_stroke(img_copy, 300)
+    
     for point in points:
-        x = point["x"] * img_width
-        y = point["y"] * img_height
-        
-        # Draw outer black circle for contrast (largest)
-        outer_radius = point_radius * 5  # Increased from 3 to 5 for more spacing
-        draw.ellipse(
-            [x - outer_radius - 2, y - outer_radius - 2, 
-             x + outer_radius + 2, y + outer_radius + 2],
-            outline="#000000", width=6  # Increased from 3 to 6
-        )
-        
-        # Draw bright red outer circle
-        draw.ellipse(
-            [x - outer_radius, y - outer_radius, 
-             x + outer_radius, y + outer_radius],
-            outline="#FF1E1E", width=4  # Increased from 2 to 4
-        )
-        
-        # Draw neon green middle circle
-        middle_radius = point_radius * 3  # Adjusted for better spacing
-        draw.ellipse(
-            [x - middle_radius, y - middle_radius,
-             x + middle_radius, y + middle_radius],
-            outline="#00FF00", width=4  # Increased from 2 to 4
-        )
-        
-        # Draw solid bright red inner circle
-        inner_radius = point_radius * 1.5  # Added inner circle for better transition
-        draw.ellipse(
-            [x - inner_radius, y - inner_radius, 
-             x + inner_radius, y + inner_radius],
-            fill="#FF1E1E"
-        )
-        
-        # Draw larger neon green center dot
-        center_radius = point_radius * 0.8  # Increased from 0.5 to 0.8
-        draw.ellipse(
-            [x - center_radius, y - center_radius,
-             x + center_radius, y + center_radius],
-            fill="#00FF00"
-        )
+        sprite = point_sprite(point_radius, point.get("color", color))
+        half = sprite.width // 2
+        x = round(point["x"] * img_width) - half
+        y = round(point["y"] * img_height) - half
+        img_copy.paste(sprite, (x, y), sprite)
     
-    # Save to buffer
-    buf = io.BytesIO()
-    img_copy.save(buf, format="JPEG")
-    buf.seek(0)
-    return buf
+    return encode_visualization(img_copy)
+
+# Payload sent to the Moondream API
+IMAGE_MAX_SIDE = int(os.getenv('IMAGE_MAX_SIDE', '1536'))  # Longest side in pixels (0 keeps the original size)
+IMAGE_PAYLOAD_FORMAT = os.getenv('IMAGE_PAYLOAD_FORMAT', 'jpeg').lower()  # "jpeg" or "webp"
+IMAGE_JPEG_QUALITY = int(os.getenv('IMAGE_JPEG_QUALITY', '75'))  # JPEG quality (1-95), 75 matches the previous payloads
+IMAGE_JPEG_SUBSAMPLING = os.getenv('IMAGE_JPEG_SUBSAMPLING', '4:2:0')  # "4:4:4" keeps full color detail
+IMAGE_WEBP_QUALITY = int(os.getenv('IMAGE_WEBP_QUALITY', '80'))  # WebP quality (0-100)
 
-def optimize_image_load(image_bytes):
+def optimize_image_load(image_bytes, max_side=IMAGE_MAX_SIDE):
     """
-    Load an image with optimized settings based on size.
-    Returns a PIL Image with appropriate scaling applied for better performance.
+    Load an image as an RGB frame sized for the Moondream API.
     
-    Uses PIL's draft() method to efficiently scale JPEG images during loading:
-    - 1/4 scale if both dimensions > 3200px
-    - 1/3 scale if both dimensions > 2400px
-    - 1/2 scale if both dimensions > 1600px
+    - JPEGs are shrunk while decoding with PIL's draft(), which skips most of the decode work
+    - Every format is then resampled so its longest side is at most max_side
+    - EXIF orientation is applied, so phone photos aren't sent sideways
+    - Transparent images are flattened onto white instead of black
     """
     # Reposition to the start of the BytesIO object
     image_bytes.seek(0)
-    
-    # Open the image to get its size first
     img = Image.open(image_bytes)
-    width, height = img.size
-    
-    # Determine scaling factor based on dimensions
-    scale = 1  # Default - no scaling
     
-    if width > 3200 and height > 3200:
-        scale = 4  # Scale to 1/4 size
-    elif width > 2400 and height > 2400:
-        scale = 3  # Scale to 1/3 size
-    elif width > 1600 and height > 1600:
-        scale = 2  # Scale to 1/2 size
-        
-    if scale > 1:
-        # Calculate new dimensions
-        new_width = width // scale
-        new_height = height // scale
-        
-        # Reset file pointer and use draft mode for efficiency
-        image_bytes.seek(0)
-        img = Image.open(image_bytes)
-        img.draft('RGB', (new_width, new_height))
-        
-        # print(f"Image optimized: {width}x{height} → {new_width}x{new_height} (scale: 1/{scale})")
+    if max_side and max(img.size) > max_side:
+        # draft() picks the largest JPEG reduction (1/2, 1/4, 1/8) that stays at least this size
+        scale = max_side / max(img.size)
+        img.draft('RGB', (math.ceil(img.width * scale), math.ceil(img.height * scale)))
     
-    # Convert to RGB mode for consistency
-    img = img.convert('RGB')
+    img = ImageOps.exif_transpose(img)
     
-    return img
-
-# Create an image cache class for storing encoded images
-class ImageCache:
-    def __init__(self, max_size=200):
-        self.max_size = max_size
-        self.cache = OrderedDict()  # URL -> (base64_data, timestamp)
-        self.stats = {"hits": 0, "misses": 0}
-    
-    def get(self, url):
-        """Get base64 encoded image from cache if available"""
-        if url in self.cache:
-            # Move the item to the end to mark it as recently used
-            base64_data, _ = self.cache.pop(url)
-            self.cache[url] = (base64_data, time.time())
-            self.stats["hits"] += 1
-            return base64_data
-        self.stats["misses"] += 1
-        return None
+    if img.mode in ('RGBA', 'LA', 'PA') or (img.mode == 'P' and 'transparency' in img.info):
+        img = img.convert('RGBA')
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        background.paste(img, mask=img.getchannel('A'))
+        img = background
+    else:
+        # Convert to RGB mode for consistency
+        img = img.convert('RGB')
     
-    def put(self, url, base64_data):
-        """Store base64 encoded image in cache"""
-        # If cache is full, remove the least recently used item
-        if len(self.cache) >= self.max_size:
-            self.cache.popitem(last=False)
-        
-        # Store the new item with current timestamp
-        self.cache[url] = (base64_data, time.time())
-        return base64_data
-    
-    def get_stats(self):
-        """Get cache statistics"""
-        return {
-            "size": len(self.cache),
-            "max_size": self.max_size,
-            "hits": self.stats["hits"],
-            "misses": self.stats["misses"],
-            "hit_ratio": self.stats["hits"] / (self.stats["hits"] + self.stats["misses"]) if (self.stats["hits"] + self.stats["misses"]) > 0 else 0
-        }
+    if max_side and max(img.size) > max_side:
+        # Resample the rest of the way with a proper filter (also covers PNG, WebP, etc.)
+        img.thumbnail((max_side, max_side), Image.BICUBIC, reducing_gap=3.0)
     
-    def clear(self):
-        """Clear the cache"""
-        self.cache.clear()
-        return True
+    return img
 
 # Initialize the image cache
-image_cache = ImageCache(max_size=200)  # Adjust size based on your needs
+# Memory budget set by IMAGE_CACHE_MAX_MB, disk tier by IMAGE_CACHE_DIR and IMAGE_DISK_CACHE_MAX_MB
+image_cache = ImageCache(disk=DiskCacheTier() if IMAGE_CACHE_DIR else None)
 
-# Bot configuration
-intents = discord.Intents.default()
-intents.message_content = True  # Enable message content intent
-bot = commands.Bot(command_prefix='!', intents=intents)
+# Decoded frames the cached payloads were encoded from, reused for visualizations (IMAGE_FRAME_CACHE_MAX_MB)
+frame_cache = FrameCache()
+
+# Cache of Moondream API results, sized by RESULT_CACHE_TTL and RESULT_CACHE_MAX_ENTRIES
+result_cache = ResultCache()
 
 # Moondream API configuration
-API_BASE_URL = 'https://api.moondream.ai/v1'
 API_KEY = os.getenv('MOONDREAM_API_KEY')
 
+# Rate limiting and fair scheduling of API calls across guilds and users
+api_rate_limiter = TokenBucket()
+request_scheduler = RequestScheduler()
+
+# Shared async API client (pooled keep-alive connections)
+moondream_client = MoondreamClient(API_KEY, rate_limiter=api_rate_limiter)
+
+# Shared streaming downloader for Discord attachments
+image_downloader = ImageDownloader()
+
+# Worker pool for PIL decode/encode/draw work, kept off the event loop
+image_executor = ImageExecutor()
+
+# Identical work already in flight is joined rather than repeated
+# (downloads are coalesced inside image_downloader)
+encode_flights = SingleFlight()  # keyed by content hash
+api_flights = SingleFlight()  # keyed like the result cache
+stream_listeners = {}  # result cache key -> streamed text so far and the callbacks following it
+
+class MoondreamBot(commands.Bot):
+    async def close(self):
+        """Release pooled HTTP connections before shutting down"""
+        await moondream_client.close()
+        await image_downloader.close()
+        await thread_images.close()
+        image_executor.shutdown()
+        # Persist entries, recency and URL aliases gathered since the last index write
+        if image_cache.disk is not None and image_cache.disk.loaded:
+            await asyncio.to_thread(image_cache.disk.flush)
+        await super().close()
+
+# Bot configuration
+intents = discord.Intents.default()
+intents.message_content = True  # Enable message content intent
+bot = MoondreamBot(command_prefix='!', intents=intents)
+
 # Import the MessageSplitter class (assumed to be in a file named message_splitter.py)
-from message_splitter import MessageSplitter
+from message_splitter import MessageSplitter, ProgressiveMessage, DISCORD_SAFE_LIMIT
+from outbox import outbox
+
+# Last image information for each thread, persisted to SQLite (THREAD_DB_PATH)
+thread_images = ThreadStore()
+
+# Ids of the threads the bot runs Moondream sessions in, kept current by thread events
+# so classifying a message's channel is a set lookup
+moondream_threads = set()
+
+# Threads inactive for longer than this are forgotten
+THREAD_RETENTION_DAYS = float(os.getenv('THREAD_RETENTION_DAYS', '7'))
+THREAD_CLEANUP_MIN_INTERVAL = 60  # Seconds between cleanup runs at the most, so expiries due close together share a run
 
-# Dictionary to store the last image information for each thread
-thread_images = {}
+# How images are kept in a thread: "reference" links the user's original message,
+# "repost" uploads a copy of the image into the thread
+THREAD_IMAGE_MODE = os.getenv('THREAD_IMAGE_MODE', 'reference').lower()
+
+# Stream caption and query answers into the processing message as they are generated
+STREAM_RESPONSES = os.getenv('STREAM_RESPONSES', '1').lower() not in ('0', 'false', 'no')
 
 # Command aliases mapping
 COMMAND_ALIASES = {
@@ -213,121 +236,297 @@ COMMAND_ALIASES = {
     'point': ['point', 'p']
 }
 
-# Reverse mapping for alias lookup
-ALIAS_TO_COMMAND = {}
+# One routing table for the image commands, used in threads and channels alike
+command_router = CommandRouter(bot.command_prefix)
 for cmd, aliases in COMMAND_ALIASES.items():
-    for alias in aliases:
-        ALIAS_TO_COMMAND[alias] = cmd
+    command_router.add(cmd, aliases)
+command_router.add('moondream', ['md'], dispatches=True)
+command_router.add('help')
+command_router.add('images')
+
+# Colors (and matching legend markers) for each object in a multi-object detect/point command.
+# Green is left out because point markers already use it for their accents.
+LABEL_COLORS = [
+    ("#FF1E1E", "🟥"),
+    ("#1E90FF", "🟦"),
+    ("#FFD700", "🟨"),
+    ("#FF00FF", "🟪"),
+    ("#FF8C00", "🟧"),
+    ("#FFFFFF", "⬜"),
+]
+MAX_BATCH_OBJECTS = len(LABEL_COLORS)
 
 @bot.event
 async def on_ready():
     print(f'Logged in as {bot.user.name} ({bot.user.id})')
     print('------')
+    # Warm-start the image cache from the disk tier
+    if image_cache.disk is not None and not image_cache.disk.loaded:
+        try:
+            entries = await asyncio.to_thread(image_cache.disk.load)
+            print(f"[CACHE] Loaded {entries} images from disk cache at {image_cache.disk.directory}")
+        except OSError as e:
+            print(f"[CACHE] Disk cache unavailable: {e}")
+    # Persist the disk cache index periodically, so a crash loses little
+    if image_cache.disk is not None and image_cache.disk.loaded and not flush_image_cache_index.is_running():
+        flush_image_cache_index.start()
+    # Restore thread sessions saved before the last restart
+    if not thread_images.loaded:
+        try:
+            sessions = await thread_images.load()
+            print(f"[THREAD STORE] Loaded {sessions} thread sessions from {thread_images.path}")
+        except Exception as e:
+            print(f"[THREAD STORE] Failed to load thread sessions: {e}")
+        thread_images.start()
+    # Rebuild the set of Moondream threads and keep only live threads' sessions in memory
+    await restore_moondream_threads()
     # Start the cache stats logging task
-    log_cache_stats.start()
+    if not log_cache_stats.is_running():
+        log_cache_stats.start()
     # Start the thread cleanup task
-    cleanup_old_threads.start()
+    if not cleanup_old_threads.is_running():
+        cleanup_old_threads.start()
 
-def image_to_base64(image_bytes=None, image=None, url=None):
+def encode_image_payload(image_bytes=None, image=None):
     """
-    Convert an image to base64 string with optimization and caching.
+    Encode an image as the API payload (JPEG, or WebP if IMAGE_PAYLOAD_FORMAT is "webp").
     
-    This function follows this flow:
-    1. Check if the image is in cache (by URL)
-    2. If cached, return the cached base64 data
-    3. If not cached:
-       a. If image_bytes provided, optimize and load the image
-       b. If PIL Image provided, use it directly
-       c. Encode to base64
-       d. Cache the result by URL
+    This is the CPU-heavy part of encode_image and runs in the image executor.
     
     Args:
         image_bytes: BytesIO object containing the image data (optional)
         image: PIL Image object (optional)
-        url: URL for caching the image (optional)
         
     Returns:
-        str: Base64 encoded string of the image
+        bytes: Encoded image
     """
-    # Check cache first if URL is provided
-    if url and (cached_data := image_cache.get(url)):
-        # print(f"Cache hit for {url}")
-        return cached_data
-    
-    # Not in cache, we need to process the image
     if image is None and image_bytes is not None:
         # Load and optimize the image from bytes
         image = optimize_image_load(image_bytes)
     elif image is None:
         raise ValueError("Either image_bytes or image must be provided")
     
-    # Convert the image to base64
     buffer = io.BytesIO()
-    image.save(buffer, format="JPEG")
-    img_str = base64.b64encode(buffer.getvalue()).decode('utf-8')
-    base64_data = f"data:image/jpeg;base64,{img_str}"
-    
-    # Store in cache if URL was provided
-    if url:
-        # print(f"Caching image for {url}")
-        image_cache.put(url, base64_data)
-    
-    return base64_data
-
-async def call_moondream_api(endpoint, image_base64, additional_params=None):
-    """Call Moondream API and return the response"""
-    url = f"{API_BASE_URL}/{endpoint}"
-    
-    # Prepare request body
-    payload = {
-        "image_url": image_base64,
-        "stream": False
-    }
-    
-    # Add additional parameters if provided
-    if additional_params:
-        payload.update(additional_params)
-    
-    # Prepare headers
-    headers = {
-        "X-Moondream-Auth": API_KEY,
-        "Content-Type": "application/json",
-        "User-Agent": "MoondreamDiscordBot"
-    }
-    
-    # Try up to 3 times
-    for attempt in range(3):
+    if IMAGE_PAYLOAD_FORMAT == 'webp':
+        image.save(buffer, format="WEBP", quality=IMAGE_WEBP_QUALITY, method=4)
+    else:
+        image.save(buffer, format="JPEG", quality=IMAGE_JPEG_QUALITY, subsampling=IMAGE_JPEG_SUBSAMPLING)
+    return buffer.getvalue()
+
+def decode_and_encode(image_bytes):
+    """
+    Decode an image once and encode it, returning (frame, payload_bytes).
+    
+    The downscaled RGB frame is returned alongside the payload so it can be kept
+    for drawing visualizations (runs in the image executor).
+    """
+    frame = optimize_image_load(image_bytes)
+    return frame, encode_image_payload(image=frame)
+
+def decode_payload(payload_bytes):
+    """Decode cached payload bytes back into an RGB frame (runs in the image executor)"""
+    image = Image.open(io.BytesIO(payload_bytes))
+    return image.convert('RGB')
+
+def hash_image_bytes(image_bytes):
+    """Hash the raw contents of a BytesIO without copying it (runs in the image executor)"""
+    with image_bytes.getbuffer() as view:
+        return content_hash(view)
+
+def inspect_image(image_bytes):
+    """Return (content_hash, width, height) for raw image bytes (runs in the image executor)"""
+    key = hash_image_bytes(image_bytes)
+    image_bytes.seek(0)
+    # Only the header is read to get the size
+    width, height = Image.open(image_bytes).size
+    image_bytes.seek(0)
+    return key, width, height
+
+def prepare_payload(payload_bytes):
+    """Wrap encoded image bytes for the Moondream API, shared by every call on the image"""
+    # Cached entries keep the format they were encoded in, whatever the current setting
+    mime_type = "image/webp" if payload_bytes[:4] == b'RIFF' and payload_bytes[8:12] == b'WEBP' else "image/jpeg"
+    return EncodedImage(payload_bytes, mime_type)
+
+async def get_cached_image(key, url=None):
+    """
+    Look up encoded image bytes by content hash in memory, then on disk.
+    
+    Disk hits are promoted back into memory. If a URL is given it is recorded
+    as an alias so later lookups can skip the download.
+    """
+    if (cached_data := image_cache.get(key)) is not None:
+        if url and image_cache.lookup_url(url) != key:
+            image_cache.add_alias(url, key)
+            if image_cache.on_disk(key):
+                await asyncio.to_thread(image_cache.disk.add_alias, url, key)
+        return cached_data
+    
+    if image_cache.on_disk(key):
+        cached_data = await asyncio.to_thread(image_cache.disk.get, key)
+        if cached_data is not None:
+            image_cache.promote(key, cached_data, url=url)
+            if url and image_cache.disk.lookup_url(url) != key:
+                await asyncio.to_thread(image_cache.disk.add_alias, url, key)
+            return cached_data
+    return None
+
+async def store_cached_image(key, payload_bytes, url=None):
+    """Store encoded image bytes in memory and write them through to the disk tier"""
+    image_cache.put(key, payload_bytes, url=url)
+    if image_cache.disk is not None and image_cache.disk.loaded:
         try:
-            # Make the API call
-            response = requests.post(url, headers=headers, json=payload)
-            
-            # Check for success
-            if response.status_code == 200:
-                return response.json()
-            
-            # If we get here, the request failed but didn't raise an exception
-            print(f"API call failed (attempt {attempt + 1}/3): Status {response.status_code} - {response.text}")
-            
-            # If this was our last attempt, return the error
-            if attempt == 2:
-                return {"error": f"API Error: {response.status_code} - {response.text}"}
-                
-        except Exception as e:
-            # Log the error
-            print(f"API call exception (attempt {attempt + 1}/3): {str(e)}")
-            
-            # If this was our last attempt, re-raise
-            if attempt == 2:
-                return {"error": f"API Error: {str(e)}"}
+            await asyncio.to_thread(image_cache.disk.put, key, payload_bytes, [normalize_url(url)] if url else [])
+        except OSError as e:
+            print(f"[CACHE] Failed to write disk cache entry: {e}")
+
+async def encode_image(image_bytes=None, image=None, url=None, key=None, source=None):
+    """
+    Encode an image to the API payload format with optimization and caching.
     
-    # We should never get here, but just in case
-    return {"error": "API call failed after all retries"}
+    This function follows this flow:
+    1. Check the cache by content hash if known, or by URL alias (memory or disk)
+    2. Otherwise hash the raw image bytes and check the cache by content hash
+    3. If not cached:
+       a. Optimize, load and encode the image in the image executor
+       b. Cache the encoded bytes by content hash, with the URL as an alias
+       c. Keep the decoded frame in the frame cache for visualizations
+    
+    If no bytes are given and the image isn't cached, they are read from the
+    source handle, or downloaded from the URL.
+    
+    Args:
+        image_bytes: BytesIO object containing the image data (optional)
+        image: PIL Image object (optional)
+        url: Attachment URL to register as an alias of the image (optional)
+        key: Content hash of the image's source bytes, if already known (optional)
+        source: LazyImage to read the bytes from on a cache miss (optional)
+        
+    Returns:
+        tuple: (content_hash, payload_bytes)
+    """
+    # Check by content hash if the caller knows it, otherwise through the URL alias index
+    if key is None and url:
+        key = image_cache.lookup_url(url)
+    if key and (cached_data := await get_cached_image(key, url=url)) is not None:
+        return key, cached_data
+    
+    if image_bytes is None and image is None and (source or url):
+        image_bytes = await (source or LazyImage(image_downloader, url)).read()
+    
+    if image_bytes is not None:
+        if key is None:
+            # Same image under a new URL still hits by content hash
+            key = await image_executor.run(hash_image_bytes, image_bytes)
+            if (cached_data := await get_cached_image(key, url=url)) is not None:
+                return key, cached_data
+        
+        async def encode_and_store():
+            frame, payload_bytes = await image_executor.run(decode_and_encode, image_bytes)
+            frame_cache.put(key, frame)
+            await store_cached_image(key, payload_bytes, url=url)
+            return payload_bytes
+        
+        # Concurrent commands on the same new image share one decode and encode
+        payload_bytes = await encode_flights.run(key, encode_and_store)
+        if url:
+            image_cache.add_alias(url, key)
+        return key, payload_bytes
+    elif image is not None:
+        # A bare PIL image has no source bytes, so key it by its encoding
+        payload_bytes = await image_executor.run(encode_image_payload, image=image)
+        key = content_hash(payload_bytes)
+    else:
+        raise ValueError("Either image_bytes, image or url must be provided")
+    
+    await store_cached_image(key, payload_bytes, url=url)
+    return key, payload_bytes
 
-async def get_image_title(image_base64):
+async def get_image_frame(key=None, image_bytes=None, url=None, source=None):
+    """
+    Return the downscaled RGB frame of an image for drawing on.
+    
+    The frame kept by encode_image is used if it is still cached. Otherwise the
+    cached payload is decoded, which needs no download and is smaller than the
+    original; the original is only decoded (and read from the source handle or
+    downloaded, if no bytes are given) when the image isn't cached at all. The
+    result is shared, so copy it before drawing.
+    """
+    if key is None and url:
+        key = image_cache.lookup_url(url)
+    if key and (frame := frame_cache.get(key)) is not None:
+        return frame
+    
+    if key and (cached_data := await get_cached_image(key, url=url)) is not None:
+        frame = await image_executor.run(decode_payload, cached_data)
+    else:
+        if image_bytes is None:
+            image_bytes = await (source or LazyImage(image_downloader, url)).read()
+        frame = await image_executor.run(optimize_image_load, image_bytes)
+    
+    if key:
+        frame_cache.put(key, frame)
+    return frame
+
+async def call_moondream_api(endpoint, image_payload, additional_params=None, image_hash=None, on_chunk=None):
+    """
+    Call Moondream API and return the response.
+    
+    If the image's content hash is given, results are served from and stored in
+    the result cache, so repeating a command on the same image skips the API,
+    and identical calls already in flight are joined instead of repeated.
+    If on_chunk is given, the response is streamed and on_chunk(text) receives
+    the partial text (cached results are returned whole).
+    """
+    cache_key = None
+    if image_hash:
+        cache_key = ResultCache.make_key(image_hash, endpoint, additional_params)
+        if (cached_result := result_cache.get(cache_key)) is not None:
+            return cached_result
+    
+    listeners = stream_listeners.get(cache_key) if cache_key else None
+    if listeners is not None:
+        # Joining a running call: follow its stream from the text received so far
+        if on_chunk is not None:
+            listeners['callbacks'].append(on_chunk)
+            if listeners['text']:
+                on_chunk(listeners['text'])
+    else:
+        listeners = {'text': None, 'callbacks': [on_chunk] if on_chunk else []}
+        if cache_key and not api_flights.running(cache_key):
+            stream_listeners[cache_key] = listeners
+    
+    def broadcast(text):
+        listeners['text'] = text
+        for callback in listeners['callbacks']:
+            callback(text)
+    
+    async def call_api():
+        owner = request_owner.get()
+        try:
+            # Wait for a fair share of the global concurrency budget
+            result = await request_scheduler.run(
+                lambda: moondream_client.call(
+                    endpoint, image_payload, additional_params,
+                    deadline=owner.deadline if owner else None,
+                    on_chunk=broadcast if on_chunk else None
+                ),
+                owner=owner
+            )
+        finally:
+            if cache_key and stream_listeners.get(cache_key) is listeners:
+                del stream_listeners[cache_key]
+        if cache_key:
+            result_cache.put(cache_key, result)
+        return result
+    
+    return await api_flights.run(cache_key, call_api)
+
+async def get_image_title(image_payload, image_hash=None):
     """Generate a title for an image using Moondream API's query capability"""
     try:
         # Call the query endpoint with the specific question
-        result = await call_moondream_api('query', image_base64, {"question": "return a title for this image"})
+        result = await call_moondream_api('query', image_payload, {"question": "return a title for this image"}, image_hash=image_hash)
         
         # Check if we got a valid response
         if 'error' in result:
@@ -352,14 +551,47 @@ async def get_image_title(image_base64):
         # print(f"Error generating image title: {e}")
         return None
 
-async def download_image_bytes(url):
-    """Download an image from a URL and return the bytes"""
-    response = requests.get(url)
-    return io.BytesIO(response.content)
+async def rename_thread_with_title(thread, title_task):
+    """Rename a thread after its generated title once the title is ready"""
+    title = await title_task
+    
+    # Update thread name with the generated title if available
+    if title:
+        try:
+            # Ensure the title doesn't exceed Discord's thread name limits (100 chars)
+            formatted_title = f"Moondream: {title}"
+            if len(formatted_title) > 100:
+                formatted_title = formatted_title[:97] + "..."
+            
+            # Update the thread name
+            await thread.edit(name=formatted_title)
+        except Exception as e:
+            print(f"Error updating thread name: {e}")
 
-async def send_help_message(thread, user):
-    """Send a simplified help message with available commands"""
-    help_message = (
+async def timed_stage(stages, name, awaitable):
+    """Await one setup stage, recording its duration and when it finished"""
+    start = time.perf_counter()
+    try:
+        return await awaitable
+    finally:
+        stages[name] = (start, time.perf_counter())
+
+def format_stages(stages, started):
+    """Format stage timings as 'name duration (done at offset)' in milliseconds"""
+    parts = [
+        f"{name} {(end - start) * 1000:.0f}ms (@{(end - started) * 1000:.0f})"
+        for name, (start, end) in sorted(stages.items(), key=lambda item: item[1][1])
+    ]
+    parts.append(f"total {(time.perf_counter() - started) * 1000:.0f}ms")
+    return " | ".join(parts)
+
+async def download_image_bytes(url, expected_size=None):
+    """Download an image from a URL and return the bytes (raises ImageDownloadError)"""
+    return await image_downloader.download(url, expected_size=expected_size)
+
+def help_message_text(user):
+    """Build the simplified help message with available commands, shown when a thread starts"""
+    return (
         f"# Welcome {user.mention} to Moondream Bot\n\n"
         "I can analyze images using Moondream's vision API. Here are my commands:\n\n"
         "**📝 Caption Generation**\n"
@@ -367,13 +599,13 @@ async def send_help_message(thread, user):
         "**❓ Visual Question Answering**\n"
         "`!q [your question]` - Ask any question about your image\n\n"
         "**🔍 Object Detection**\n"
-        "`!d [object]` - Detect specific objects in your image\n\n"
+        "`!d [object]` - Detect specific objects in your image (e.g. `!d cat, dog`)\n\n"
         "**👉 Object Pointing**\n"
         "`!p [object]` - Point to specific objects in your image\n\n"
         "Upload a new image at any time to analyze it!\n"
+        "Use `!images` to list earlier images and `!q #1 [question]` to ask about one.\n"
         "Use `!help` for more details or `!learn` to discover Moondream's capabilities."
     )
-    await MessageSplitter.send_message(thread, help_message)
 
 async def send_detailed_help(channel):
     """Send a detailed help message with all command options"""
@@ -383,7 +615,10 @@ async def send_detailed_help(channel):
         "- `!c` - Generate an image caption\n"
         "- `!q [question]` - Ask a question about the image\n"
         "- `!d [object]` - Detect objects in the image\n"
-        "- `!p [object]` - Point to objects in the image\n\n"
+        "- `!p [object]` - Point to objects in the image\n"
+        "- `!d cat, dog, person` - Detect or point to several objects at once\n"
+        "- `!images` - List the images uploaded in this thread\n"
+        "- Add `#N` to target an earlier image, e.g. `!q #1 [question]` or `!c #2`\n\n"
         
         "## Standard Commands (Also work in threads)\n"
         "- `!caption` - Generate an image caption\n"
@@ -409,151 +644,325 @@ async def send_detailed_help(channel):
     )
     await MessageSplitter.send_message(channel, help_message)
 
-async def save_image_to_thread(thread, image_bytes, filename):
-    """Save an image to a thread and store its reference for later use"""
-    # Reposition to the start of the BytesIO object
-    image_bytes.seek(0)
+async def save_image_to_thread(thread, image_bytes, filename, source_message=None, attachment=None, footer=None):
+    """
+    Save an image to a thread and add it to the thread's image history.
+    
+    In "reference" mode (THREAD_IMAGE_MODE) an image posted as an attachment of
+    source_message is not uploaded again: the thread links to the original
+    message and the record keeps its attachment URL. Otherwise, or without a
+    source message, a copy is uploaded to the thread.
     
-    # Save a copy of the image in the thread
-    image_message = await thread.send(
-        "🖼️ **Analyzing this image:**",
-        file=discord.File(fp=image_bytes, filename=filename)
+    A footer (e.g. the help message) is sent in the same message.
+    """
+    # Hash and measure the image off the event loop
+    key, width, height = await image_executor.run(inspect_image, image_bytes)
+    
+    session = thread_images.get(thread.id)
+    if session is None:
+        session = {
+            'history': ImageHistory(),
+            'timestamp': datetime.datetime.now()
+        }
+    number = session['history'].next_number
+    reference = references_original(source_message, attachment)
+    header = f"🖼️ **Analyzing image #{number}:**"
+    if reference:
+        header += f" [{filename}]({source_message.jump_url})"
+    
+    # Fold the footer into the image message when both fit in one
+    if footer and len(header) + len(footer) + 2 <= DISCORD_SAFE_LIMIT:
+        header, footer = f"{header}\n\n{footer}", None
+    
+    if reference:
+        # Point at the original upload instead of sending the bytes to Discord again
+        await MessageSplitter.send_message(thread, header)
+        url = attachment.url
+        message_id = source_message.id
+        channel_id = source_message.channel.id if source_message.channel.id != thread.id else None
+    else:
+        # Reposition to the start of the BytesIO object
+        image_bytes.seek(0)
+        
+        # Save a copy of the image in the thread
+        image_message = await MessageSplitter.send_message(
+            thread,
+            header,
+            file=discord.File(fp=image_bytes, filename=filename)
+        )
+        url = image_message.attachments[0].url
+        message_id = image_message.id
+        channel_id = None
+    
+    # Store the image information (assigning the session persists it)
+    record = session['history'].add(
+        url,
+        filename,
+        content_hash=key,
+        width=width,
+        height=height,
+        message_id=message_id,
+        channel_id=channel_id
     )
+    thread_images[thread.id] = session
     
-    # Store the image information
-    thread_images[thread.id] = {
-        'url': image_message.attachments[0].url,
-        'filename': filename,
-        'message_id': image_message.id,
-        'timestamp': datetime.datetime.now()
-    }
+    if footer:
+        await MessageSplitter.send_message(thread, footer)
     
-    # Return the image message for reference
-    return image_message
+    # Return the image record for reference
+    return record
+
+def references_original(source_message, attachment):
+    """Whether an image is kept by linking its original message rather than reposting it"""
+    return THREAD_IMAGE_MODE == 'reference' and source_message is not None and attachment is not None
+
+LIST_CONJUNCTION_PATTERN = re.compile(r'and\s+', re.IGNORECASE)
 
-async def process_image_in_thread(thread, image_bytes, image_filename, endpoint=None, parameter=None, image_url=None, pre_encoded_base64=None):
-    """Process an image within a thread"""
-    # Add a divider before the new response
-    await thread.send("───────────────────────────────────────")
+def parse_object_labels(parameter):
+    """
+    Split a detect/point parameter like "cat, dog, person" into distinct labels.
+    
+    Only commas separate labels, so a name like "salt and pepper shaker" stays
+    whole; the "and" of a list such as "cat, dog, and person" is dropped.
+    
+    Returns:
+        tuple: (labels, dropped) where dropped counts labels over MAX_BATCH_OBJECTS
+    """
+    labels = []
+    for index, label in enumerate((parameter or "").split(',')):
+        label = label.strip()
+        if index and (match := LIST_CONJUNCTION_PATTERN.match(label)):
+            label = label[match.end():]
+        if label and label.casefold() not in (existing.casefold() for existing in labels):
+            labels.append(label)
+    if not labels:
+        return ["subject"], 0  # Default to "subject" if no parameter provided
+    return labels[:MAX_BATCH_OBJECTS], max(0, len(labels) - MAX_BATCH_OBJECTS)
+
+def api_requests_for(endpoint, parameter):
+    """Return the parameters of each API call a command makes (one per object for detect/point)"""
+    if endpoint in ('detect', 'point'):
+        labels, _ = parse_object_labels(parameter)
+        return [{"object": label} for label in labels]
+    if endpoint == 'query':
+        return [{"question": parameter}] if parameter else []
+    if endpoint == 'caption':
+        return [{"length": "normal"}]
+    return []
+
+IMAGE_REFERENCE_PATTERN = re.compile(r'#(\d+)(?:\s+|$)')
+
+def parse_image_reference(parameter):
+    """Split a leading image reference like "#2" off a command parameter"""
+    if parameter and parameter.startswith('#') and (match := IMAGE_REFERENCE_PATTERN.match(parameter)):
+        return int(match.group(1)), parameter[match.end():] or None
+    return None, parameter
+
+async def send_image_history(thread):
+    """List the images remembered for a thread"""
+    session = thread_images.get(thread.id)
+    if not session or not session['history']:
+        await MessageSplitter.send_message(thread, "I don't have any images for this thread yet.")
+        return
     
-    # Create an initial message that preserves the command context
-    command_display = ""
+    history = session['history']
+    latest = history.latest()
+    lines = ["# Images in this thread\n"]
+    for record in history:
+        size = f" ({record.width}×{record.height})" if record.width else ""
+        channel_id = record.channel_id or thread.id
+        link = f" - [jump](https://discord.com/channels/{thread.guild.id}/{channel_id}/{record.message_id})" if record.message_id else ""
+        current = " ← current" if record is latest else ""
+        lines.append(f"**#{record.number}** `{record.filename}`{size}{link}{current}")
+    lines.append("\nUse a number before your command input to target an earlier image, e.g. `!q #1 what changed?`")
+    await MessageSplitter.send_message(thread, "\n".join(lines))
+
+async def process_image_in_thread(thread, image_bytes, image_filename, endpoint=None, parameter=None, image_url=None, pre_encoded_payload=None, image_hash=None, image_number=None, alias=None):
+    """
+    Process an image within a thread.
+    
+    image_bytes may be None when the image has a URL: the bytes are then only
+    downloaded if the image cache can't serve the command. endpoint is the
+    canonical command; alias is the name it was typed as, for display.
+    """
+    # Create an initial message that preserves the command context,
+    # headed by the divider so both go out as one message
+    command_display = "───────────────────────────────────────"
     if endpoint:
         # Show the exact command used
-        command_used = f"!{endpoint}"
+        command_used = f"!{alias or endpoint}"
+        if image_number:
+            command_used += f" #{image_number}"
         if parameter:
             command_used += f" {parameter}"
-        command_display = f"**Command:** `{command_used}`"
+        command_display += f"\n**Command:** `{command_used}`"
     
     # Send the "processing" message
-    processing_msg = await thread.send(f"{command_display}\n\nProcessing your image... please wait before running another command.")
+    processing_text = f"{command_display}\n\nProcessing your image... please wait before running another command."
+    processing_msg = await MessageSplitter.send_message(thread, processing_text)
+    
+    # Show the queue position on the processing message while the API is busy
+    owner = request_owner.get()
+    if owner is not None:
+        async def show_queue_position(position):
+            if position:
+                await outbox.edit(processing_msg, content=f"{command_display}\n\nThe bot is busy, you're #{position} in the queue... please wait before running another command.")
+            else:
+                await outbox.edit(processing_msg, content=processing_text)
+        owner.notify = show_queue_position
+        owner.last_position = None
+        # Calls started before this message existed (the !moondream prefetch) may already be waiting
+        await request_scheduler.follow(owner)
     
+    # Downloaded only if the cache misses
+    image_source = LazyImage(image_downloader, image_url, data=image_bytes)
+    
+    stream_view = None
     try:
-        # Use pre-encoded base64 if provided, otherwise encode the image
-        if pre_encoded_base64:
-            image_base64 = pre_encoded_base64
+        # Use the pre-encoded payload if provided, otherwise encode the image
+        if pre_encoded_payload:
+            image_payload = pre_encoded_payload
         else:
-            # Convert image to base64, using cache if URL is provided
-            image_base64 = image_to_base64(image_bytes=image_bytes, url=image_url)
+            # Encode the image, using cache if URL is provided
+            image_hash, payload_bytes = await encode_image(url=image_url, key=image_hash, source=image_source)
+            image_payload = prepare_payload(payload_bytes)
         
         # If no endpoint specified, just confirm image is ready and send help
         if not endpoint:
-            await processing_msg.edit(content="Image received! What would you like to know about it?")
+            await outbox.edit(processing_msg, content=f"{command_display}\nImage received! What would you like to know about it?")
             return
         
-        # Map endpoint alias to actual endpoint if needed
         actual_endpoint = endpoint
-        if endpoint in ALIAS_TO_COMMAND:
-            actual_endpoint = ALIAS_TO_COMMAND[endpoint]
+        
+        # Detect and point fan out one API call per object over the same encoded image
+        if actual_endpoint in ['detect', 'point']:
+            await process_objects_in_thread(
+                thread, processing_msg, command_display, actual_endpoint, parameter,
+                image_payload, image_hash, image_source
+            )
+            return
         
         # Prepare additional parameters based on endpoint
-        additional_params = {}
+        requests = api_requests_for(actual_endpoint, parameter)
+        if actual_endpoint == 'query' and not requests:
+            await outbox.edit(processing_msg, content=f"{command_display}\n\nPlease provide a question for the image.")
+            return
+        additional_params = requests[0] if requests else {}
         
-        if actual_endpoint == 'query':
-            if not parameter:
-                await processing_msg.edit(content=f"{command_display}\n\nPlease provide a question for the image.")
-                return
-            additional_params["question"] = parameter
-            
-        elif actual_endpoint == 'caption':
-            additional_params["length"] = "normal"
-            
-        elif actual_endpoint in ['detect', 'point']:
-            object_to_find = parameter or "subject"  # Default to "subject" if no parameter provided
-            additional_params["object"] = object_to_find
+        # Label the answer the same way while it streams and once it is complete
+        if actual_endpoint == 'caption':
+            answer_prefix = "**Caption:** "
+        elif actual_endpoint == 'query':
+            answer_prefix = f"**Question:** {parameter}\n**Moondream:** "
+        else:
+            answer_prefix = None
+        
+        # Stream the answer into the processing message as it is generated
+        on_chunk = None
+        if STREAM_RESPONSES and answer_prefix is not None:
+            stream_view = ProgressiveMessage(processing_msg)
+            on_chunk = lambda text: stream_view.update(f"{command_display}\n\n{answer_prefix}{text} \u258c")
         
         # Call the API
-        result = await call_moondream_api(actual_endpoint, image_base64, additional_params)
+        result = await call_moondream_api(actual_endpoint, image_payload, additional_params, image_hash=image_hash, on_chunk=on_chunk)
         
         # Check for errors
         if 'error' in result:
-            await MessageSplitter.edit_message(
-                processing_msg, 
-                f"{command_display}\n\nError: {result['error']}"
-            )
+            error_content = f"{command_display}\n\nError: {result['error']}"
+            if stream_view is not None:
+                await stream_view.finish(error_content)
+            else:
+                await MessageSplitter.edit_message(processing_msg, error_content)
             return
         
-        # Format the response and prepare visualization if needed
+        # Format the response (a stream that ended early says so, since the answer may be cut short)
+        cut_off = "\n*The answer may be incomplete, the response ended early.*" if result.get('incomplete') else ""
         if actual_endpoint == 'caption':
-            formatted_result = f"**Caption:** {result['caption']}\n───────────────────────────────────────"
+            formatted_result = f"{answer_prefix}{result['caption']}{cut_off}\n───────────────────────────────────────"
         elif actual_endpoint == 'query':
-            formatted_result = f"**Question:** {parameter}\n**Moondream:** {result['answer']}\n───────────────────────────────────────"
-        elif actual_endpoint == 'detect':
-            objects = result["objects"]
-            formatted_result = f"**Detecting:** {parameter or 'subject'}\n**Found:** {len(objects)} instances\n───────────────────────────────────────"
-            
-            # Create visualization with an optimized image
-            image = optimize_image_load(image_bytes)
-            vis_buffer = visualize_bounding_boxes(image, objects)
-            
-            # Send both the text result and visualization
-            await MessageSplitter.edit_message(processing_msg, f"{command_display}\n\n{formatted_result}")
-            await thread.send(file=discord.File(vis_buffer, filename=f"detect_{parameter}.jpg"))
-            
-            # Send the raw API response as a separate message
-            # raw_response = json.dumps(result, indent=2)
-            # await MessageSplitter.send_code_block(thread, raw_response, "json")
-            return
-            
-        elif actual_endpoint == 'point':
-            points = result["points"]
-            formatted_result = f"**Pointing at:** {parameter or 'subject'}\n**Found:** {len(points)} points\n───────────────────────────────────────"
-            
-            # Create visualization with an optimized image
-            image = optimize_image_load(image_bytes)
-            vis_buffer = visualize_points(image, points)
-            
-            # Send both the text result and visualization
-            await MessageSplitter.edit_message(processing_msg, f"{command_display}\n\n{formatted_result}")
-            await thread.send(file=discord.File(vis_buffer, filename=f"point_{parameter}.jpg"))
-            
-            # Send the raw API response as a separate message
-            # raw_response = json.dumps(result, indent=2)
-            # await MessageSplitter.send_code_block(thread, raw_response, "json")
-            return
+            formatted_result = f"{answer_prefix}{result['answer']}{cut_off}\n───────────────────────────────────────"
         else:
             formatted_result = f"**Raw response:** {json.dumps(result)}\n───────────────────────────────────────"
         
         # Update the processing message with just the formatted result
-        await MessageSplitter.edit_message(
-            processing_msg,
-            f"{command_display}\n\n{formatted_result}"
-        )
+        if stream_view is not None:
+            await stream_view.finish(f"{command_display}\n\n{formatted_result}")
+        else:
+            await MessageSplitter.edit_message(
+                processing_msg,
+                f"{command_display}\n\n{formatted_result}"
+            )
         
         # Send the raw API response as a separate message with proper splitting
         # raw_response = json.dumps(result, indent=2)
         # await MessageSplitter.send_code_block(thread, raw_response, "json")
         
     except Exception as e:
-        await MessageSplitter.edit_message(
-            processing_msg,
-            f"{command_display}\n\nError: {str(e)}"
-        )
+        if stream_view is not None:
+            await stream_view.finish(f"{command_display}\n\nError: {str(e)}")
+        else:
+            await MessageSplitter.edit_message(
+                processing_msg,
+                f"{command_display}\n\nError: {str(e)}"
+            )
+
+async def process_objects_in_thread(thread, processing_msg, command_display, endpoint, parameter, image_payload, image_hash, image_source):
+    """
+    Run detect/point for one or more comma-separated objects and post a single merged visualization.
+    
+    The API calls run concurrently over the already encoded image; each object gets
+    its own color in the visualization and legend.
+    """
+    labels, dropped = parse_object_labels(parameter)
+    results = await asyncio.gather(*[
+        call_moondream_api(endpoint, image_payload, params, image_hash=image_hash)
+        for params in api_requests_for(endpoint, parameter)
+    ])
+    
+    # If every call failed there is nothing to draw
+    errors = [result['error'] for result in results if 'error' in result]
+    if len(errors) == len(results):
+        await MessageSplitter.edit_message(processing_msg, f"{command_display}\n\nError: {errors[0]}")
+        return
+    
+    result_key, verb, unit = ("objects", "Detecting", "instances") if endpoint == 'detect' else ("points", "Pointing at", "points")
+    
+    # Merge every object's shapes into one list, tagged with the object's color
+    shapes = []
+    summary_lines = []
+    for (color, marker), label, result in zip(LABEL_COLORS, labels, results):
+        if 'error' in result:
+            summary_lines.append(f"{marker} **{label}:** Error: {result['error']}")
+            continue
+        found = result[result_key]
+        shapes.extend({**shape, "color": color} for shape in found)
+        summary_lines.append(f"{marker} **{label}:** {len(found)} {unit}")
+    
+    if len(labels) == 1:
+        formatted_result = f"**{verb}:** {labels[0]}\n**Found:** {len(shapes)} {unit}"
+    else:
+        formatted_result = f"**{verb}:** {', '.join(labels)}\n" + "\n".join(summary_lines)
+    if dropped:
+        formatted_result += f"\n*Only the first {MAX_BATCH_OBJECTS} objects were used ({dropped} skipped).*"
+    formatted_result += "\n───────────────────────────────────────"
+    
+    # Draw on the frame the image was encoded from, decoding only if it was evicted
+    image = await get_image_frame(image_hash, url=image_source.url, source=image_source)
+    visualize = visualize_bounding_boxes if endpoint == 'detect' else visualize_points
+    vis_buffer = await image_executor.run(visualize, image, shapes)
+    
+    # Send the text result and the visualization with a single edit
+    filename = re.sub(r'[^\w-]+', '_', '_'.join(labels))[:60]
+    await MessageSplitter.edit_message(
+        processing_msg,
+        f"{command_display}\n\n{formatted_result}",
+        file=discord.File(vis_buffer, filename=f"{endpoint}_{filename}.jpg")
+    )
 
 async def try_delete_message(message):
     """Try to delete a message and handle permission errors"""
     try:
-        await message.delete()
+        await outbox.delete(message)
         return True
     except discord.Forbidden:
         await MessageSplitter.send_message(
@@ -565,17 +974,58 @@ async def try_delete_message(message):
         print(f"Error deleting message: {e}")
         return False
 
-async def is_moondream_thread(thread):
-    """Check if this is a thread created by the Moondream bot"""
-    if not isinstance(thread, discord.Thread):
-        return False
-    
-    # Check thread name
-    if "Moondream" in thread.name:
-        return True
+def is_moondream_thread(channel):
+    """Check if this is a thread created by the Moondream bot, including an archived one whose session is on disk"""
+    return channel.id in moondream_threads or channel.id in thread_images.unloaded
+
+async def restore_moondream_threads():
+    """
+    Mark the active threads the bot started, and active threads with stored sessions, as Moondream threads.
     
-    # If we can't determine from the name, check if we have stored image data for this thread
-    return thread.id in thread_images
+    Sessions of threads that aren't active (archived or gone) are unloaded to
+    disk; they come back when the thread is reopened or used again.
+    """
+    active = {thread.id: thread for guild in bot.guilds for thread in guild.threads}
+    unloaded = 0
+    for thread_id in list(thread_images):
+        if thread_id in active:
+            moondream_threads.add(thread_id)
+        elif await thread_images.unload(thread_id):
+            unloaded += 1
+    for thread in active.values():
+        if thread.owner_id == bot.user.id:
+            moondream_threads.add(thread.id)
+    print(f"[THREADS] Tracking {len(moondream_threads)} active Moondream threads ({unloaded} archived sessions left on disk)")
+
+async def track_moondream_thread(thread_id, owner_id, archived):
+    """Unload the session of an archived Moondream thread, or bring it back when the thread is reopened"""
+    if archived:
+        # Archived threads leave memory; their session stays on disk in case the thread is reopened
+        moondream_threads.discard(thread_id)
+        await thread_images.unload(thread_id)
+    elif owner_id == bot.user.id or thread_id in thread_images.unloaded:
+        # A thread the bot started is a Moondream thread whatever it's called
+        moondream_threads.add(thread_id)
+        await thread_images.restore(thread_id)
+
+@bot.event
+async def on_raw_thread_update(payload):
+    # Raw because discord.py drops archived threads from its cache: reopening one
+    # is then reported as thread_join rather than thread_update
+    metadata = payload.data.get('thread_metadata', {})
+    owner_id = payload.data.get('owner_id')
+    await track_moondream_thread(payload.thread_id, int(owner_id) if owner_id else None, metadata.get('archived', False))
+
+@bot.event
+async def on_thread_join(thread):
+    # Also sent for threads that are new to discord.py's cache, e.g. reopened after a restart
+    await track_moondream_thread(thread.id, thread.owner_id, thread.archived)
+
+@bot.event
+async def on_raw_thread_delete(payload):
+    # Raw so deletions of threads missing from discord.py's cache are seen too
+    moondream_threads.discard(payload.thread_id)
+    thread_images.forget(payload.thread_id)
 
 @bot.event
 async def on_message(message):
@@ -583,40 +1033,59 @@ async def on_message(message):
     if message.author == bot.user:
         return
     
+    # Route the message once; chatter is rejected without any parsing
+    route = command_router.route(message.content)
+    
     # Check if message is in a thread created by Moondream
-    if await is_moondream_thread(message.channel):
+    if is_moondream_thread(message.channel):
         thread = message.channel
         
-        # Check for all possible command formats, including shortcuts
-        # 1. Check for !moondream command format
-        moondream_match = re.match(r'!moondream\s+(\w+)(?:\s+(.+))?', message.content.strip())
-        # 2. Check for !command shortcut format
-        shortcut_match = re.match(r'!(\w+)(?:\s+(.+))?', message.content.strip())
+        # Attribute API calls made for this message to its guild and author for fair queuing
+        request_owner.set(RequestOwner(message.guild.id if message.guild else None, message.author.id))
         
-        command_match = moondream_match
-        if not command_match:
-            command_match = shortcut_match
+        # The thread may have been reopened before its session was brought back from disk
+        if thread.id in thread_images.unloaded:
+            moondream_threads.add(thread.id)
+            await thread_images.restore(thread.id)
         
-        if command_match:
-            endpoint = command_match.group(1).lower()
-            parameter = command_match.group(2) if command_match.group(2) else None
+        # A bare !moondream has nothing to run here
+        if route is not None and route.command == 'moondream' and route.endpoint is None:
+            await MessageSplitter.send_message(thread, "You're already in a Moondream thread! Just use shorthand commands like `!c`, `!q`, `!d`, or `!p`.")
+            return
+        
+        if route is not None and route.command is not None:
+            endpoint = route.target
+            parameter = route.parameter
             
             # Check if help command
             if endpoint == 'help':
                 await send_detailed_help(thread)
                 return
             
-            # Check if the command is a valid endpoint or an alias
-            valid_endpoint = endpoint in ['caption', 'query', 'detect', 'point'] or endpoint in ALIAS_TO_COMMAND
+            # List the images remembered for this thread
+            if endpoint == 'images':
+                await send_image_history(thread)
+                return
             
-            if valid_endpoint:
+            # Check if the command is an image command (names and aliases were resolved by the router)
+            if endpoint in COMMAND_ALIASES:
+                image_attachment = None
+                
                 # If there's an image attachment, use that
                 if message.attachments and any(att.content_type and att.content_type.startswith('image/') for att in message.attachments):
                     image_attachment = next(att for att in message.attachments if att.content_type and att.content_type.startswith('image/'))
-                    image_bytes = await download_image_bytes(image_attachment.url)
+                    try:
+                        image_bytes = await download_image_bytes(image_attachment.url, image_attachment.size)
+                    except ImageDownloadError as e:
+                        await MessageSplitter.send_message(thread, f"Error: {str(e)}")
+                        return
                     
                     # Save the new image to the thread
-                    await save_image_to_thread(thread, image_bytes, image_attachment.filename)
+                    try:
+                        record = await save_image_to_thread(thread, image_bytes, image_attachment.filename, message, image_attachment)
+                    except UnidentifiedImageError:
+                        await MessageSplitter.send_message(thread, "Error: I couldn't read this image.")
+                        return
                     
                     # Process with the new image, passing the URL for caching
                     await process_image_in_thread(
@@ -625,50 +1094,93 @@ async def on_message(message):
                         image_attachment.filename, 
                         endpoint, 
                         parameter,
-                        image_url=image_attachment.url
+                        image_url=image_attachment.url,
+                        image_hash=record.content_hash,
+                        alias=route.endpoint
                     )
                 
-                # Otherwise, use the last saved image for this thread
+                # Otherwise, use a saved image for this thread (the latest, or one referenced as #N)
                 elif thread.id in thread_images:
-                    # Get the last image info
-                    image_info = thread_images[thread.id]
-                    
-                    # Download the image
-                    image_bytes = await download_image_bytes(image_info['url'])
+                    history = thread_images[thread.id]['history']
+                    image_number, parameter = parse_image_reference(parameter)
+                    image_info = history.get(image_number) if image_number else history.latest()
+                    if image_info is None:
+                        await MessageSplitter.send_message(
+                            thread,
+                            f"I can't find image #{image_number} in this thread. Use `!images` to see the images I remember."
+                        )
+                        await try_delete_message(message)
+                        return
+                    thread_images.touch(thread.id)
                     
-                    # Process with the saved image, passing the URL for caching
+                    # Process with the saved image, reusing its cached encoding by content hash.
+                    # The image is only downloaded if neither cache tier still holds it.
                     await process_image_in_thread(
                         thread, 
-                        image_bytes, 
-                        image_info['filename'], 
+                        None, 
+                        image_info.filename, 
                         endpoint, 
                         parameter,
-                        image_url=image_info['url']
+                        image_url=image_info.url,
+                        image_hash=image_info.content_hash,
+                        image_number=image_number,
+                        alias=route.endpoint
                     )
                 
                 else:
                     await MessageSplitter.send_message(thread, "I can't find an image to analyze. Please start a new thread with an image.")
                 
-                # Try to delete the command message
-                await try_delete_message(message)
+                # Try to delete the command message, unless the thread's record of the image points at it
+                if not (image_attachment and references_original(message, image_attachment)):
+                    await try_delete_message(message)
+                outbox.record_command(request_owner.get())
                 return
             
         # If a new image is uploaded without a command, save it for later use
-        elif message.attachments and any(att.content_type and att.content_type.startswith('image/') for att in message.attachments):
+        elif route is None and message.attachments and any(att.content_type and att.content_type.startswith('image/') for att in message.attachments):
             image_attachment = next(att for att in message.attachments if att.content_type and att.content_type.startswith('image/'))
-            image_bytes = await download_image_bytes(image_attachment.url)
+            try:
+                image_bytes = await download_image_bytes(image_attachment.url, image_attachment.size)
+            except ImageDownloadError as e:
+                await MessageSplitter.send_message(thread, f"Error: {str(e)}")
+                return
             
             # Save the new image to the thread
-            await save_image_to_thread(thread, image_bytes, image_attachment.filename)
+            try:
+                await save_image_to_thread(thread, image_bytes, image_attachment.filename, message, image_attachment)
+            except UnidentifiedImageError:
+                await MessageSplitter.send_message(thread, "Error: I couldn't read this image.")
+                return
             
             # Acknowledge the image
             await MessageSplitter.send_message(thread, "New image received! What would you like to know about it?")
             return
     
-    # Let the command system process commands
+    if route is None:
+        return
+    
+    # Other bots and webhooks don't get to start threads (process_commands used to skip them)
+    if message.author.bot:
+        return
+    
+    # Image commands in channels go through the same table as in threads
+    if route.command == 'moondream' or route.command in COMMAND_ALIASES:
+        ctx = await bot.get_context(message)
+        await moondream(ctx, route.target, parameter=route.parameter)
+        return
+    
+    # The command reference covers the image commands, which the command system doesn't know about
+    if route.command == 'help':
+        await send_detailed_help(message.channel)
+        return
+    
+    # Image history only exists inside Moondream threads
+    if route.command == 'images':
+        return
+    
+    # Let the command system process the admin and info commands
     await bot.process_commands(message)
 
-@bot.command()
 async def moondream(ctx, endpoint=None, *, parameter=None):
     """
     Process an image with Moondream API
@@ -681,10 +1193,13 @@ async def moondream(ctx, endpoint=None, *, parameter=None):
     !moondream point cat - Point at objects in the attached image
     """
     # Check if we're already in a thread - if so, redirect to use thread commands
-    if isinstance(ctx.channel, discord.Thread) and await is_moondream_thread(ctx.channel):
+    if is_moondream_thread(ctx.channel):
         await MessageSplitter.send_message(ctx.channel, "You're already in a Moondream thread! Just use shorthand commands like `!c`, `!q`, `!d`, or `!p`.")
         return
     
+    # Attribute API calls made for this command to its guild and author for fair queuing
+    request_owner.set(RequestOwner(ctx.guild.id if ctx.guild else None, ctx.author.id))
+    
     # Format the command for display
     command_display = f"**Command:** `{ctx.message.content}`"
     
@@ -710,73 +1225,113 @@ async def moondream(ctx, endpoint=None, *, parameter=None):
     
     # Process only if the attachment is an image
     if attachment.content_type and attachment.content_type.startswith('image/'):
+        # Setup runs as a small dependency graph; each stage's timing is logged at the end
+        started = time.perf_counter()
+        stages = {}
+        
+        # Download the image to bytes before creating a thread, so bad uploads are rejected early
+        try:
+            image_bytes = await timed_stage(stages, 'download', download_image_bytes(attachment.url, attachment.size))
+        except ImageDownloadError as e:
+            await MessageSplitter.send_message(
+                ctx.channel,
+                f"{command_display}\n\n{str(e)}",
+                delete_after=20
+            )
+            # Try to delete the original message
+            await try_delete_message(ctx.message)
+            return
+        
+        # Encode while the thread is being created. The encode decodes from its own
+        # buffer: the image post below seeks and reads image_bytes at the same time.
+        encode_task = asyncio.create_task(timed_stage(stages, 'encode', encode_image(
+            image_bytes=io.BytesIO(image_bytes.getbuffer()), url=attachment.url
+        )))
+        
         # Create an initial temporary thread name with timestamp
         timestamp = datetime.datetime.now().strftime("%H:%M:%S")
         temp_thread_name = f"Moondream Analysis {timestamp}"
         
         # Create a thread with the temporary name
-        thread = await ctx.message.create_thread(name=temp_thread_name, auto_archive_duration=60)
+        try:
+            thread = await timed_stage(stages, 'thread', ctx.message.create_thread(name=temp_thread_name, auto_archive_duration=60))
+        except BaseException:
+            # Without a thread nobody waits for the encode, so stop it rather than leave its result unretrieved
+            encode_task.cancel()
+            await asyncio.gather(encode_task, return_exceptions=True)
+            raise
+        moondream_threads.add(thread.id)
         
         # Send a notification in the original channel pointing to the thread
-        notification = await MessageSplitter.send_message(
+        notification_task = asyncio.create_task(timed_stage(stages, 'notification', MessageSplitter.send_message(
             ctx.channel,
             f"✅ Image received from {ctx.author.mention}! Please continue in the thread: {thread.mention}",
             delete_after=900
-        )
+        )))
         
-        # Download the image to bytes
-        image_bytes = await download_image_bytes(attachment.url)
-        
-        # Save the image to the thread
-        await save_image_to_thread(thread, image_bytes, attachment.filename)
-        
-        # Convert to base64 for API - using our optimized function
-        image_base64 = image_to_base64(image_bytes=image_bytes, url=attachment.url)
-        
-        # Get a title for the image using the already encoded base64
-        title = await get_image_title(image_base64)
-        
-        # Update thread name with the generated title if available
-        if title:
-            try:
-                # Ensure the title doesn't exceed Discord's thread name limits (100 chars)
-                formatted_title = f"Moondream: {title}"
-                if len(formatted_title) > 100:
-                    formatted_title = formatted_title[:97] + "..."
-                
-                # Update the thread name
-                await thread.edit(name=formatted_title)
-                
-                # Log the title that was generated
-                # print(f"Thread renamed to: {formatted_title}")
-            except Exception as e:
-                print(f"Error updating thread name: {e}")
+        # The router has already resolved aliases, so this is a canonical command (or None)
+        actual_endpoint = endpoint
         
-        # Send welcome message with user mention in the thread
-        await send_help_message(thread, ctx.author)
+        # Start the title and the requested command's API calls as soon as the image is encoded.
+        # The command's calls are joined later by process_image_in_thread (see api_flights).
+        async def start_api_calls():
+            image_hash, payload_bytes = await encode_task
+            image_payload = prepare_payload(payload_bytes)
+            title_task = asyncio.create_task(timed_stage(stages, 'title', get_image_title(image_payload, image_hash=image_hash)))
+            prefetch_tasks = [
+                asyncio.create_task(call_moondream_api(
+                    actual_endpoint, image_payload, params, image_hash=image_hash,
+                    # Stream so that the command, joining this call, can show the text as it arrives
+                    on_chunk=(lambda text: None) if STREAM_RESPONSES and actual_endpoint in ('caption', 'query') else None
+                ))
+                for params in api_requests_for(actual_endpoint, parameter)
+            ]
+            return image_hash, image_payload, title_task, prefetch_tasks
+        api_task = asyncio.create_task(start_api_calls())
         
-        # Process the image in the thread (map endpoint alias to actual endpoint if needed)
-        actual_endpoint = endpoint
-        if endpoint and endpoint in ALIAS_TO_COMMAND:
-            actual_endpoint = ALIAS_TO_COMMAND[endpoint]
+        try:
+            # Meanwhile post the image with the help message
+            await timed_stage(stages, 'image post', save_image_to_thread(
+                thread, image_bytes, attachment.filename, ctx.message, attachment,
+                footer=help_message_text(ctx.author)
+            ))
             
+            image_hash, image_payload, title_task, prefetch_tasks = await api_task
+        except Exception as e:
+            # The thread already exists, so the user hears about a broken image there
+            api_task.cancel()
+            print(f"[SETUP] Could not prepare image {attachment.filename}: {e}")
+            await MessageSplitter.send_message(thread, f"Error: I couldn't read this image ({str(e) or e.__class__.__name__}).")
+            await asyncio.gather(api_task, notification_task, return_exceptions=True)
+            outbox.record_command(request_owner.get())
+            return
+        rename_task = asyncio.create_task(timed_stage(stages, 'rename', rename_thread_with_title(thread, title_task)))
+        
+        # Process the image in the thread
         if actual_endpoint and actual_endpoint in ['caption', 'query', 'detect', 'point']:
-            await process_image_in_thread(
+            await timed_stage(stages, 'command', process_image_in_thread(
                 thread, 
                 image_bytes, 
                 attachment.filename, 
                 actual_endpoint, 
                 parameter,
                 image_url=attachment.url,
-                pre_encoded_base64=image_base64
-            )
+                pre_encoded_payload=image_payload,
+                image_hash=image_hash
+            ))
         else:
             # Just confirm image received if no specific endpoint
             # No divider needed for first message in thread
             await MessageSplitter.send_message(thread, "Image received! What would you like to know about it?")
         
-        # Try to delete the original message
-        await try_delete_message(ctx.message)
+        await asyncio.gather(rename_task, notification_task, *prefetch_tasks, return_exceptions=True)
+        owner = request_owner.get()
+        outbox.record_command(owner)
+        print(f"[SETUP] {format_stages(stages, started)} | {owner.discord_calls} Discord calls")
+        
+        # Try to delete the original message, unless the thread links to its image
+        if not references_original(ctx.message, attachment):
+            await try_delete_message(ctx.message)
     else:
         notice = await MessageSplitter.send_message(
             ctx.channel, 
@@ -786,79 +1341,54 @@ async def moondream(ctx, endpoint=None, *, parameter=None):
         # Try to delete the original message
         await try_delete_message(ctx.message)
 
-# Add command aliases for the main channel
-@bot.command(aliases=['c'])
-async def caption(ctx, *, parameter=None):
-    """Shortcut for !moondream caption"""
-    await moondream(ctx, 'caption', parameter=parameter)
-
-@bot.command(aliases=['q'])
-async def query(ctx, *, parameter=None):
-    """Shortcut for !moondream query"""
-    await moondream(ctx, 'query', parameter=parameter)
-
-@bot.command(aliases=['d'])
-async def detect(ctx, *, parameter=None):
-    """Shortcut for !moondream detect"""
-    await moondream(ctx, 'detect', parameter=parameter)
-
-@bot.command(aliases=['p'])
-async def point(ctx, *, parameter=None):
-    """Shortcut for !moondream point"""
-    await moondream(ctx, 'point', parameter=parameter)
-
-@bot.command(aliases=['md'])
-async def moondream_short(ctx, endpoint=None, *, parameter=None):
-    """Shortcut for !moondream - works exactly like the full command
+@tasks.loop(hours=1)
+async def cleanup_old_threads():
+    """
+    Expire thread sessions that have been inactive for longer than the retention period.
     
-    Usage:
-    !md - Start interactive mode with the attached image
-    !md caption - Generate a caption for the attached image
-    !md query What's in this image? - Ask a question about the attached image
+    The task wakes up when the next session is due (at least every hour, for
+    sessions only on disk), so sessions are removed a few at a time as they
+    expire rather than in one long pass.
     """
-    await moondream(ctx, endpoint, parameter=parameter)
-
-@tasks.loop(hours=24)
-async def cleanup_old_threads():
-    """Clean up old thread references to prevent memory leaks"""
+    max_age = THREAD_RETENTION_DAYS * 24 * 60 * 60
     try:
-        current_time = datetime.datetime.now()
         removed = 0
         
-        for thread_id in list(thread_images.keys()):
-            try:
-                # Try to fetch the thread
-                thread = bot.get_channel(thread_id)
-                
-                # Check if thread no longer exists or is archived
-                if not thread or thread.archived:
-                    del thread_images[thread_id]
-                    removed += 1
-                    continue
-                
-                # Check if thread data is older than 7 days
-                thread_data = thread_images[thread_id]
-                if 'timestamp' in thread_data:
-                    age = current_time - thread_data['timestamp']
-                    if age.days > 7:  # Remove data older than 7 days
-                        del thread_images[thread_id]
-                        removed += 1
-            except Exception as e:
-                print(f"Error checking thread {thread_id}: {e}")
-                # Remove problematic threads
-                if thread_id in thread_images:
-                    del thread_images[thread_id]
-                    removed += 1
-        
-        print(f"[THREAD CLEANUP] Removed {removed} old thread references. Active threads: {len(thread_images)}")
+        # Expired sessions come off the last-activity heap (and index) in batches
+        while True:
+            batch = await thread_images.expire(max_age, limit=500)
+            removed += len(batch)
+            # Yield to the event loop between batches
+            await asyncio.sleep(0)
+            if len(batch) < 500:
+                break
+        
+        if removed:
+            print(f"[THREAD CLEANUP] Removed {removed} old thread references. Active threads: {len(thread_images)}")
     except Exception as e:
         print(f"Error in cleanup_old_threads: {e}")
+    
+    # Sleep until the next session is due
+    delay = thread_images.next_expiry(max_age)
+    cleanup_old_threads.change_interval(seconds=min(max(delay, THREAD_CLEANUP_MIN_INTERVAL), 3600) if delay is not None else 3600)
+
+@tasks.loop(seconds=IMAGE_CACHE_FLUSH_INTERVAL)
+async def flush_image_cache_index():
+    """Write the disk cache index if entries, recency or URL aliases changed since the last write"""
+    try:
+        await asyncio.to_thread(image_cache.disk.flush)
+    except OSError as e:
+        print(f"[CACHE] Failed to write the disk cache index: {e}")
 
 @tasks.loop(hours=24)
 async def log_cache_stats():
     """Log cache statistics periodically"""
     stats = image_cache.get_stats()
-    print(f"[CACHE STATS] Size: {stats['size']}/{stats['max_size']}, Hit ratio: {stats['hit_ratio']*100:.2f}%")
+    print(f"[CACHE STATS] Size: {stats['size']} images, {stats['bytes'] / (1024*1024):.2f}/{stats['max_bytes'] / (1024*1024):.0f} MB, Hit ratio: {stats['hit_ratio']*100:.2f}%")
+    frames = frame_cache.get_stats()
+    print(f"[FRAME CACHE STATS] Size: {frames['size']} frames, {frames['bytes'] / (1024*1024):.2f}/{frames['max_bytes'] / (1024*1024):.0f} MB, Hit ratio: {frames['hit_ratio']*100:.2f}%")
+    api_stats = result_cache.get_stats()
+    print(f"[API CACHE STATS] Size: {api_stats['size']}/{api_stats['max_entries']}, Hit ratio: {api_stats['hit_ratio']*100:.2f}%")
 
 @bot.command()
 @commands.has_permissions(administrator=True)
@@ -867,36 +1397,121 @@ async def cache_stats(ctx):
     stats = image_cache.get_stats()
     stats_message = (
         "# Image Cache Statistics\n\n"
-        f"**Cache Size:** {stats['size']}/{stats['max_size']} images\n"
+        f"**Cache Size:** {stats['size']} images ({stats['aliases']} URL aliases)\n"
         f"**Cache Hits:** {stats['hits']}\n"
         f"**Cache Misses:** {stats['misses']}\n"
+        f"**Evictions:** {stats['evictions']}\n"
         f"**Hit Ratio:** {stats['hit_ratio']*100:.2f}%\n"
-        f"**Memory Usage (est):** {sum(len(cache_item[0]) for cache_item in image_cache.cache.values()) / (1024*1024):.2f} MB\n"
+        f"**Memory Usage:** {stats['bytes'] / (1024*1024):.2f}/{stats['max_bytes'] / (1024*1024):.0f} MB\n"
     )
-    await ctx.send(stats_message)
+    if image_cache.disk is not None:
+        stats_message += (
+            f"**Disk Hits:** {stats['disk_hits']}\n"
+            f"**Disk Cache:** {stats['disk_size']} images, {stats['disk_bytes'] / (1024*1024):.2f}/{stats['disk_max_bytes'] / (1024*1024):.0f} MB\n"
+        )
+    frames = frame_cache.get_stats()
+    stats_message += (
+        f"**Decoded Frames:** {frames['size']} frames, {frames['bytes'] / (1024*1024):.2f}/{frames['max_bytes'] / (1024*1024):.0f} MB "
+        f"({frames['hits']} hits, {frames['evictions']} evictions)\n"
+    )
+    await MessageSplitter.send_message(ctx.channel, stats_message)
 
 @bot.command()
 @commands.has_permissions(administrator=True)
 async def clear_cache(ctx):
     """Clear the image cache"""
     image_cache.clear()
-    await ctx.send("Image cache cleared successfully!")
+    frame_cache.clear()
+    if image_cache.disk is not None and image_cache.disk.loaded:
+        await asyncio.to_thread(image_cache.disk.clear)
+    await MessageSplitter.send_message(ctx.channel, "Image cache cleared successfully!")
+
+@bot.command()
+@commands.has_permissions(administrator=True)
+async def api_cache_stats(ctx):
+    """View the Moondream API result cache statistics and recent entries"""
+    stats = result_cache.get_stats()
+    stats_message = (
+        "# API Result Cache Statistics\n\n"
+        f"**Cache Size:** {stats['size']}/{stats['max_entries']} results\n"
+        f"**TTL:** {stats['ttl'] / 60:.0f} minutes\n"
+        f"**Cache Hits:** {stats['hits']}\n"
+        f"**Cache Misses:** {stats['misses']}\n"
+        f"**Expired:** {stats['expired']}\n"
+        f"**Evictions:** {stats['evictions']}\n"
+        f"**Hit Ratio:** {stats['hit_ratio']*100:.2f}%\n"
+    )
+    recent = result_cache.recent()
+    if recent:
+        stats_message += "\n## Recent Entries\n"
+        for endpoint, params, age in recent:
+            stats_message += f"- `{endpoint}` `{params}` ({age / 60:.1f} min old)\n"
+    await MessageSplitter.send_message(ctx.channel, stats_message)
+
+@bot.command()
+@commands.has_permissions(administrator=True)
+async def clear_api_cache(ctx):
+    """Clear the Moondream API result cache"""
+    result_cache.clear()
+    await MessageSplitter.send_message(ctx.channel, "API result cache cleared successfully!")
+
+@bot.command()
+@commands.has_permissions(administrator=True)
+async def queue_stats(ctx):
+    """View the API request scheduler, rate limiter and circuit breaker statistics"""
+    stats = request_scheduler.get_stats()
+    limiter = api_rate_limiter.get_stats()
+    client = moondream_client.get_stats()
+    discord_calls = outbox.get_stats()
+    stats_message = (
+        "# API Queue Statistics\n\n"
+        f"**In Flight:** {stats['active']}/{stats['max_concurrency']}\n"
+        f"**Waiting:** {stats['waiting']} across {stats['guilds_waiting']} servers (peak {stats['peak_waiting']})\n"
+        f"**Completed:** {stats['completed']} ({stats['queued']} had to queue)\n"
+        f"**Rate Limit:** {limiter['rate']:g}/s, burst {limiter['burst']}\n"
+        f"**Throttled Requests:** {limiter['throttled']}\n"
+        f"**429 Responses:** {limiter['rate_limited']}\n"
+        f"**Paused For:** {limiter['paused_for']:.1f}s\n\n"
+        "## API Health\n"
+        f"**Circuit:** {client['state']} ({client['consecutive_failures']} consecutive failures, opened {client['opened']} times, {client['probes']} probes)\n"
+        f"**Calls:** {client['calls']} ({client['succeeded']} succeeded, {client['failed']} failed after retries)\n"
+        f"**Retries:** {client['retries']} (up to {client['max_attempts']} attempts per call)\n"
+        f"**Permanent Errors:** {client['permanent_errors']}\n"
+        f"**Rejected While Open:** {client['rejected']}\n"
+        f"**Deadline Exceeded:** {client['deadline_exceeded']}\n"
+        f"**Incomplete Streams:** {client['incomplete_streams']}\n"
+        f"**Request Bytes Sent:** {client['bytes_sent'] / (1024*1024):.2f} MB\n\n"
+        "## Coalesced Requests\n"
+        f"**Downloads:** {image_downloader.flights.stats['coalesced']} joined ({image_downloader.flights.stats['calls']} run)\n"
+        f"**Encodes:** {encode_flights.stats['coalesced']} joined ({encode_flights.stats['calls']} run)\n"
+        f"**API Calls:** {api_flights.stats['coalesced']} joined ({api_flights.stats['calls']} run)\n\n"
+        "## Discord Calls\n"
+        f"**Sends / Edits / Deletes:** {discord_calls['sends']} / {discord_calls['edits']} / {discord_calls['deletes']}\n"
+        f"**Coalesced Edits:** {discord_calls['coalesced_edits']}\n"
+        f"**Paced by Channel Budget:** {discord_calls['throttled']} ({discord_calls['rate']:g}/s, burst {discord_calls['burst']})\n"
+        f"**Per Command:** {discord_calls['calls_per_command']:.1f} on average over {discord_calls['commands']} commands\n"
+    )
+    await MessageSplitter.send_message(ctx.channel, stats_message)
 
 @bot.command()
 @commands.has_permissions(administrator=True)
 async def thread_stats(ctx):
     """View thread statistics"""
-    thread_count = len(thread_images)
-    active_threads = sum(1 for thread_id in thread_images if bot.get_channel(thread_id) and not bot.get_channel(thread_id).archived)
-    memory_usage = sum(sys.getsizeof(str(thread_data)) for thread_data in thread_images.values())
+    # Walks every session in memory; it must run on the event loop so the sessions don't change under it
+    memory_usage = thread_images.memory_usage()
+    disk_usage = await asyncio.to_thread(thread_images.disk_usage)
+    next_expiry = thread_images.next_expiry(THREAD_RETENTION_DAYS * 24 * 60 * 60)
     
     stats_message = (
         "# Thread Statistics\n\n"
-        f"**Total Tracked Threads:** {thread_count}\n"
-        f"**Active Threads:** {active_threads}\n"
-        f"**Memory Usage (approx):** {memory_usage / 1024:.2f} KB\n"
+        f"**Active Moondream Threads:** {len(moondream_threads)}\n"
+        f"**Sessions in Memory:** {len(thread_images)}\n"
+        f"**Archived Sessions (on disk only):** {len(thread_images.unloaded)}\n"
+        f"**Memory Usage:** {memory_usage / 1024:.2f} KB\n"
+        f"**Database Size:** {disk_usage / 1024:.2f} KB\n"
+        f"**Next Expiry:** {f'in {next_expiry / 3600:.1f} hours' if next_expiry is not None else 'none scheduled'}\n"
     )
-    await ctx.send(stats_message)
+    await MessageSplitter.send_message(ctx.channel, stats_message)
 
 @bot.command(aliases=['info'])
 async def learn(ctx):
@@ -948,6 +1563,9 @@ async def sys_stats(ctx):
         # Get disk info
         disk = psutil.disk_usage('/')
         
+        # Get image worker pool info
+        executor_stats = image_executor.get_stats()
+        
         # Format the stats message
         stats_message = (
             "# System Resource Statistics\n\n"
@@ -972,12 +1590,19 @@ async def sys_stats(ctx):
             "## System Info\n"
             f"**Platform:** {platform.system()} {platform.release()}\n"
             f"**Python Version:** {platform.python_version()}\n"
-            f"**Process Uptime:** {datetime.datetime.now() - datetime.datetime.fromtimestamp(psutil.Process().create_time())}\n"
+            f"**Process Uptime:** {datetime.datetime.now() - datetime.datetime.fromtimestamp(psutil.Process().create_time())}\n\n"
+            
+            "## Image Workers\n"
+            f"**Mode:** {executor_stats['mode']} ({executor_stats['workers']} workers, {executor_stats['max_pending']} slots)\n"
+            f"**In Flight:** {executor_stats['in_flight']}\n"
+            f"**Waiting:** {executor_stats['waiting']} (peak {executor_stats['peak_waiting']})\n"
+            f"**Completed:** {executor_stats['completed']} ({executor_stats['failed']} failed)\n"
         )
         await MessageSplitter.send_message(ctx.channel, stats_message)
         
     except Exception as e:
-        await ctx.send(f"Error getting system stats: {str(e)}")
+        await MessageSplitter.send_message(ctx.channel, f"Error getting system stats: {str(e)}")
 
 # Run the bot
-bot.run(os.getenv('DISCORD_TOKEN'))
\ No newline at end of file
+if __name__ == '__main__':
+    bot.run(os.getenv('DISCORD_TOKEN'))
\ No newline at end of file
@@ -0,0 +1,72 @@
+import re
+
+# Command name and the rest of the message, matched just after the prefix
+COMMAND_PATTERN = re.compile(r'(\S+)(?:\s+(.*\S))?\s*$', re.DOTALL)
+
+class Route:
+    """Where a message is routed: the command, its endpoint (as typed), the command to run and the rest of the message"""
+    __slots__ = ('command', 'endpoint', 'parameter', 'target')
+
+    def __init__(self, command, endpoint=None, parameter=None, target=None):
+        self.command = command  # Canonical command name, or None if the name isn't in the table
+        self.endpoint = endpoint
+        self.parameter = parameter
+        # Canonical command to run: the command itself, or for a dispatching command the
+        # command named by its first argument (None if that isn't in the table)
+        self.target = target
+
+class CommandRouter:
+    """
+    Table-driven router for the bot's text commands.
+
+    The table is built once at startup: every name and alias maps to its
+    command in a single dict, so routing a message is a prefix check, one
+    precompiled match and a dict lookup. Messages that don't start with the
+    prefix (ordinary chatter) are rejected before any pattern runs.
+
+    Commands added with dispatches=True take the command to run as their
+    first argument (!moondream caption ...), resolved through the same table.
+    """
+
+    def __init__(self, prefix='!'):
+        self.prefix = prefix
+        self.routes = {}  # lowercase name or alias -> canonical command
+        self.dispatchers = set()
+
+    def add(self, command, aliases=(), dispatches=False):
+        """Register a command under its name and aliases"""
+        for name in (command, *aliases):
+            self.routes[name.lower()] = command
+        if dispatches:
+            self.dispatchers.add(command)
+
+    def route(self, content):
+        """
+        Route a message.
+
+        Returns:
+            Route or None: None if the message isn't a command at all; a Route
+            with command None if it looks like one but the name is unknown
+        """
+        if not content.startswith(self.prefix):
+            # Leading whitespace is rare, so only pay for stripping when it's there
+            if not content[:1].isspace() or not (content := content.lstrip()).startswith(self.prefix):
+                return None
+
+        match = COMMAND_PATTERN.match(content, len(self.prefix))
+        if match is None:
+            return None
+        name, parameter = match.groups()
+        command = self.routes.get(name.lower())
+        if command is None:
+            return Route(None, name.lower(), parameter)
+
+        if command in self.dispatchers:
+            # The first argument names the command to run, the rest is its parameter
+            if parameter is None:
+                return Route(command)
+            endpoint, *rest = parameter.split(None, 1)
+            endpoint = endpoint.lower()
+            target = self.routes.get(endpoint)
+            return Route(command, endpoint, rest[0] if rest else None, None if target in self.dispatchers else target)
+        return Route(command, name.lower(), parameter, command)
@@ -0,0 +1,401 @@
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+# Image cache configuration
+IMAGE_CACHE_MAX_BYTES = int(float(os.getenv('IMAGE_CACHE_MAX_MB', '100')) * 1024 * 1024)  # Memory budget
+IMAGE_CACHE_DIR = os.getenv('IMAGE_CACHE_DIR', os.path.join('.cache', 'images'))  # Disk tier location ("" disables it)
+IMAGE_DISK_CACHE_MAX_BYTES = int(float(os.getenv('IMAGE_DISK_CACHE_MAX_MB', '1024')) * 1024 * 1024)  # Disk budget
+IMAGE_CACHE_FLUSH_INTERVAL = float(os.getenv('IMAGE_CACHE_FLUSH_INTERVAL', '30'))  # Seconds between disk index writes
+IMAGE_FRAME_CACHE_MAX_BYTES = int(float(os.getenv('IMAGE_FRAME_CACHE_MAX_MB', '64')) * 1024 * 1024)  # Decoded frame budget
+
+def content_hash(data):
+    """Return a stable content hash for raw image bytes (bytes or buffer)"""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+def normalize_url(url):
+    """
+    Strip the query string and fragment from an attachment URL.
+
+    Discord CDN URLs carry rotating signature parameters (ex, is, hm), but the
+    path identifies the attachment, so it is used as the alias key.
+    """
+    parts = urlsplit(url)
+    return f"{parts.netloc}{parts.path}"
+
+class CacheEntry:
+    __slots__ = ('data', 'timestamp', 'urls')
+
+    def __init__(self, data, urls=None):
+        self.data = data
+        self.timestamp = time.time()
+        self.urls = set(urls or ())
+
+    @property
+    def nbytes(self):
+        return sys.getsizeof(self.data)
+
+def atomic_write(path, data):
+    """Write bytes to path so readers never see a partial file, even after a crash"""
+    directory = os.path.dirname(path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+class DiskCacheTier:
+    """
+    Second cache tier storing one file per encoded entry (JPEG or WebP) plus a JSON index.
+
+    Data files are written before the index and both are replaced atomically,
+    so a crash can at worst leave an orphaned file, which is removed on the
+    next load. The index also persists URL aliases so images from old threads
+    can be served after a restart without touching the Discord CDN.
+
+    New entries, recency and aliases only mark the index dirty; flush() writes
+    it, on a timer (IMAGE_CACHE_FLUSH_INTERVAL) rather than once per image, so
+    a crash loses at most the changes since the last flush.
+
+    All methods are blocking and thread-safe; call them from a worker thread.
+    """
+
+    INDEX_FILE = 'index.json'
+    ENTRY_SUFFIX = '.bin'  # Entries may be JPEG or WebP payloads; their format is read from the bytes
+
+    def __init__(self, directory=IMAGE_CACHE_DIR, max_bytes=IMAGE_DISK_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # content hash -> file size, least recently used first
+        self.aliases = {}  # normalized URL -> content hash
+        self.total_bytes = 0
+        self.loaded = False
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + self.ENTRY_SUFFIX)
+
+    def load(self):
+        """Load the index from disk, dropping entries whose files are missing and orphaned files"""
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            index = {}
+            try:
+                with open(os.path.join(self.directory, self.INDEX_FILE), 'r') as f:
+                    index = json.load(f)
+            except (OSError, ValueError):
+                pass
+
+            self.entries.clear()
+            self.aliases.clear()
+            self.total_bytes = 0
+            # Entries were saved least recently used first
+            for key, size in index.get('entries', []):
+                try:
+                    if os.path.getsize(self._path(key)) != size:
+                        continue
+                except OSError:
+                    continue
+                self.entries[key] = size
+                self.total_bytes += size
+            for alias, key in index.get('aliases', {}).items():
+                if key in self.entries:
+                    self.aliases[alias] = key
+
+            # Remove leftovers from interrupted writes and files the index doesn't know about
+            for name in os.listdir(self.directory):
+                if name == self.INDEX_FILE:
+                    continue
+                key, ext = os.path.splitext(name)
+                if ext == '.tmp' or (ext == self.ENTRY_SUFFIX and key not in self.entries):
+                    try:
+                        os.unlink(os.path.join(self.directory, name))
+                    except OSError:
+                        pass
+
+            self._evict()
+            self._save_index()
+            self.loaded = True
+            return len(self.entries)
+
+    def contains(self, key):
+        return key in self.entries
+
+    def lookup_url(self, url):
+        """Return the content hash stored for a URL, if any"""
+        return self.aliases.get(normalize_url(url))
+
+    def get(self, key):
+        """Read an entry from disk, or return None if it isn't stored"""
+        with self._lock:
+            if key not in self.entries:
+                return None
+            try:
+                with open(self._path(key), 'rb') as f:
+                    data = f.read()
+            except OSError:
+                self._remove(key)
+                return None
+            self.entries.move_to_end(key)
+            self._dirty = True
+            return data
+
+    def put(self, key, data, urls=()):
+        """Write an entry to disk (the index is persisted by the next flush())"""
+        with self._lock:
+            if len(data) > self.max_bytes:
+                return False
+            if key not in self.entries:
+                atomic_write(self._path(key), data)
+                self.entries[key] = len(data)
+                self.total_bytes += len(data)
+            self.entries.move_to_end(key)
+            for alias in urls:
+                self.aliases[alias] = key
+            self._evict()
+            self._dirty = True
+            return True
+
+    def add_alias(self, url, key):
+        """Point a URL at a stored entry (persisted by the next flush())"""
+        with self._lock:
+            if key in self.entries:
+                self.aliases[normalize_url(url)] = key
+                self._dirty = True
+
+    def flush(self):
+        """Persist the index if it changed since the last save; returns True if it was written"""
+        with self._lock:
+            if not self._dirty:
+                return False
+            self._save_index()
+            return True
+
+    def clear(self):
+        """Remove every stored entry"""
+        with self._lock:
+            for key in list(self.entries):
+                self._remove(key)
+            self._save_index()
+
+    def _evict(self):
+        """Remove least recently used entries until the tier fits its budget"""
+        while self.entries and self.total_bytes > self.max_bytes:
+            self._remove(next(iter(self.entries)))
+
+    def _remove(self, key):
+        size = self.entries.pop(key, None)
+        if size is None:
+            return
+        self.total_bytes -= size
+        for alias in [alias for alias, alias_key in self.aliases.items() if alias_key == key]:
+            del self.aliases[alias]
+        try:
+            os.unlink(self._path(key))
+        except OSError:
+            pass
+        self._dirty = True
+
+    def _save_index(self):
+        index = {'entries': list(self.entries.items()), 'aliases': self.aliases}
+        atomic_write(os.path.join(self.directory, self.INDEX_FILE), json.dumps(index).encode('utf-8'))
+        self._dirty = False
+
+# Create an image cache class for storing encoded images
+class ImageCache:
+    """
+    Content-addressed LRU cache of encoded image bytes (JPEG or WebP payloads).
+
+    Entries are keyed by a hash of the source image bytes, so the same image
+    re-uploaded under a new URL still hits. A URL -> hash alias index lets
+    callers look up an image without downloading it first. The cache is bounded
+    by the total size of the stored bytes rather than the number of entries.
+
+    An optional DiskCacheTier sits behind the memory tier. This class never
+    performs disk I/O itself: callers read and write the tier from a worker
+    thread and hand results back with promote().
+    """
+
+    def __init__(self, max_bytes=IMAGE_CACHE_MAX_BYTES, disk=None):
+        self.max_bytes = max_bytes
+        self.disk = disk
+        self.cache = OrderedDict()  # content hash -> CacheEntry
+        self.aliases = {}  # normalized URL -> content hash
+        self.total_bytes = 0
+        self.stats = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+
+    def lookup_url(self, url):
+        """Return the content hash previously seen for a URL in either tier, if any"""
+        key = self.aliases.get(normalize_url(url))
+        if key is None and self.disk is not None:
+            key = self.disk.lookup_url(url)
+        return key
+
+    def on_disk(self, key):
+        """Check whether the disk tier holds an entry"""
+        return self.disk is not None and self.disk.contains(key)
+
+    def get(self, key):
+        """Get encoded image bytes by content hash from the memory tier if available"""
+        entry = self.cache.get(key)
+        if entry is not None:
+            # Move the item to the end to mark it as recently used
+            self.cache.move_to_end(key)
+            entry.timestamp = time.time()
+            self.stats["hits"] += 1
+            return entry.data
+        # Entries on disk are counted when promote() brings them back
+        if not self.on_disk(key):
+            self.stats["misses"] += 1
+        return None
+
+    def promote(self, key, data, url=None):
+        """Bring an entry read from the disk tier back into memory"""
+        self.stats["disk_hits"] += 1
+        return self.put(key, data, url=url)
+
+    def add_alias(self, url, key):
+        """Point a URL at an existing entry"""
+        entry = self.cache.get(key)
+        if entry is None:
+            return False
+        alias = normalize_url(url)
+        self.aliases[alias] = key
+        entry.urls.add(alias)
+        return True
+
+    def put(self, key, data, url=None):
+        """Store encoded image bytes under their content hash"""
+        if key in self.cache:
+            self._remove(key)
+
+        entry = CacheEntry(data)
+        # Don't cache anything that could never fit in the budget
+        if entry.nbytes > self.max_bytes:
+            return data
+
+        # Evict least recently used items until the new entry fits
+        while self.cache and self.total_bytes + entry.nbytes > self.max_bytes:
+            oldest_key = next(iter(self.cache))
+            self._remove(oldest_key)
+            self.stats["evictions"] += 1
+
+        self.cache[key] = entry
+        self.total_bytes += entry.nbytes
+        if url:
+            self.add_alias(url, key)
+        return data
+
+    def _remove(self, key):
+        """Remove an entry together with its URL aliases"""
+        entry = self.cache.pop(key)
+        self.total_bytes -= entry.nbytes
+        for alias in entry.urls:
+            if self.aliases.get(alias) == key:
+                del self.aliases[alias]
+
+    def get_stats(self):
+        """Get cache statistics"""
+        found = self.stats["hits"] + self.stats["disk_hits"]
+        lookups = found + self.stats["misses"]
+        return {
+            "size": len(self.cache),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "aliases": len(self.aliases),
+            "hits": self.stats["hits"],
+            "disk_hits": self.stats["disk_hits"],
+            "misses": self.stats["misses"],
+            "evictions": self.stats["evictions"],
+            "hit_ratio": found / lookups if lookups > 0 else 0,
+            "disk_size": len(self.disk.entries) if self.disk is not None else 0,
+            "disk_bytes": self.disk.total_bytes if self.disk is not None else 0,
+            "disk_max_bytes": self.disk.max_bytes if self.disk is not None else 0
+        }
+
+    def clear(self):
+        """Clear the memory tier (the disk tier is cleared separately from a worker thread)"""
+        self.cache.clear()
+        self.aliases.clear()
+        self.total_bytes = 0
+        return True
+
+class FrameCache:
+    """
+    LRU cache of decoded, downscaled RGB frames keyed by content hash.
+
+    The frame an image was encoded from is kept here so detect/point can draw
+    on it without decoding the image again. Decoded pixels are large (three
+    bytes per pixel), so the cache has its own, smaller byte budget and simply
+    drops frames when it is full: a missing frame can always be rebuilt from
+    the encoded bytes in the ImageCache. Frames are shared, so callers must
+    copy before drawing.
+    """
+
+    def __init__(self, max_bytes=IMAGE_FRAME_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.cache = OrderedDict()  # content hash -> (PIL image, size in bytes)
+        self.total_bytes = 0
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    @staticmethod
+    def frame_size(frame):
+        width, height = frame.size
+        return width * height * len(frame.getbands())
+
+    def get(self, key):
+        """Get a decoded frame if present"""
+        item = self.cache.get(key)
+        if item is None:
+            self.stats["misses"] += 1
+            return None
+        self.cache.move_to_end(key)
+        self.stats["hits"] += 1
+        return item[0]
+
+    def put(self, key, frame):
+        """Store a decoded frame, evicting least recently used frames to fit"""
+        if key in self.cache:
+            self.total_bytes -= self.cache.pop(key)[1]
+        size = self.frame_size(frame)
+        if size > self.max_bytes:
+            return frame
+        while self.cache and self.total_bytes + size > self.max_bytes:
+            _, (_, evicted_size) = self.cache.popitem(last=False)
+            self.total_bytes -= evicted_size
+            self.stats["evictions"] += 1
+        self.cache[key] = (frame, size)
+        self.total_bytes += size
+        return frame
+
+    def get_stats(self):
+        """Get cache statistics"""
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            "size": len(self.cache),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            **self.stats,
+            "hit_ratio": self.stats["hits"] / lookups if lookups > 0 else 0
+        }
+
+    def clear(self):
+        """Drop every frame"""
+        self.cache.clear()
+        self.total_bytes = 0
+        return True
@@ -0,0 +1,177 @@
+import asyncio
+import io
+import os
+import aiohttp
+from scheduler import SingleFlight
+
+# Attachment download configuration
+MAX_IMAGE_BYTES = int(os.getenv('MAX_IMAGE_BYTES', str(25 * 1024 * 1024)))  # Hard cap on downloaded bytes
+DOWNLOAD_TIMEOUT = float(os.getenv('DOWNLOAD_TIMEOUT', '30'))  # Seconds for a full download
+DOWNLOAD_CONNECT_TIMEOUT = float(os.getenv('DOWNLOAD_CONNECT_TIMEOUT', '10'))  # Seconds to establish a connection
+DOWNLOAD_POOL_LIMIT = int(os.getenv('DOWNLOAD_POOL_LIMIT', '10'))  # Max open connections to the CDN
+DOWNLOAD_CHUNK_SIZE = 64 * 1024  # Bytes read per chunk
+
+# Leading bytes of the image formats PIL can decode for us
+IMAGE_SIGNATURES = (
+    b'\xff\xd8\xff',         # JPEG
+    b'\x89PNG\r\n\x1a\n',    # PNG
+    b'GIF87a',               # GIF
+    b'GIF89a',               # GIF
+    b'II*\x00',              # TIFF (little endian)
+    b'MM\x00*',              # TIFF (big endian)
+)
+BMP_HEADER_SIZES = (12, 40, 52, 56, 64, 108, 124)  # DIB header sizes PIL can read
+SNIFF_BYTES = 18  # Enough to identify every format above, RIFF/WEBP and a BMP's DIB header size
+
+class ImageDownloadError(Exception):
+    """Raised when an attachment can't be downloaded or isn't an acceptable image"""
+
+def looks_like_image(header):
+    """Check the first bytes of a file against known image signatures"""
+    if header.startswith(IMAGE_SIGNATURES):
+        return True
+    # WEBP is a RIFF container with a "WEBP" form type
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return True
+    # "BM" alone starts plenty of text, so a BMP also needs a known DIB header size after its 14-byte file header
+    return header[:2] == b'BM' and int.from_bytes(header[14:18], 'little') in BMP_HEADER_SIZES
+
+class ImageDownloader:
+    """
+    Async streaming downloader for Discord attachments.
+
+    Attachments are read in chunks through a shared keep-alive session with a
+    hard byte cap, so a large upload can't stall the event loop or grow memory
+    without bound. Oversized files are rejected up front from the attachment
+    size or Content-Length, and non-images are rejected from the first chunk.
+
+    Concurrent downloads of the same URL are coalesced into one; callers that
+    join a running download get their own copy of the buffer.
+    """
+
+    def __init__(self, max_bytes=MAX_IMAGE_BYTES, timeout=DOWNLOAD_TIMEOUT,
+                 connect_timeout=DOWNLOAD_CONNECT_TIMEOUT, pool_limit=DOWNLOAD_POOL_LIMIT,
+                 chunk_size=DOWNLOAD_CHUNK_SIZE):
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.pool_limit = pool_limit
+        self.chunk_size = chunk_size
+        self.flights = SingleFlight()
+        self._session = None
+
+    async def get_session(self):
+        """Return the shared session, creating it on first use"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_limit,
+                limit_per_host=self.pool_limit,
+                ttl_dns_cache=300
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout, connect=self.connect_timeout),
+                headers={"User-Agent": "MoondreamDiscordBot"}
+            )
+        return self._session
+
+    async def close(self):
+        """Close the shared session and release pooled connections"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    def _check_size(self, size):
+        """Reject sizes over the byte cap"""
+        if size is not None and size > self.max_bytes:
+            raise ImageDownloadError(
+                f"Image is too large ({size / (1024*1024):.1f} MB). "
+                f"The limit is {self.max_bytes / (1024*1024):.0f} MB."
+            )
+
+    async def download(self, url, expected_size=None):
+        """
+        Download an image and return it as a BytesIO object.
+
+        If the same URL is already being downloaded, its result is shared.
+
+        Args:
+            url: URL of the image to download
+            expected_size: Size reported by Discord for the attachment (optional)
+
+        Returns:
+            io.BytesIO: The downloaded image, positioned at the start
+
+        Raises:
+            ImageDownloadError: If the download fails, exceeds the byte cap, or isn't an image
+        """
+        # Reject before opening a connection if Discord already told us the size
+        self._check_size(expected_size)
+        return await self.flights.run(
+            url,
+            lambda: self._download(url),
+            share=lambda buffer: io.BytesIO(buffer.getbuffer())
+        )
+
+    async def _download(self, url):
+        session = await self.get_session()
+        buffer = io.BytesIO()
+        try:
+            async with session.get(url) as response:
+                if response.status != 200:
+                    raise ImageDownloadError(f"Failed to download image (HTTP {response.status})")
+
+                # Reject before reading the body if the server reports the size
+                self._check_size(response.content_length)
+
+                sniffed = False
+                async for chunk in response.content.iter_chunked(self.chunk_size):
+                    buffer.write(chunk)
+                    self._check_size(buffer.tell())
+
+                    # Abort non-images as soon as we have enough bytes to identify them
+                    if not sniffed and buffer.tell() >= SNIFF_BYTES:
+                        if not looks_like_image(buffer.getvalue()[:SNIFF_BYTES]):
+                            raise ImageDownloadError("The attachment does not appear to be an image.")
+                        sniffed = True
+
+                if not sniffed and not looks_like_image(buffer.getvalue()[:SNIFF_BYTES]):
+                    raise ImageDownloadError("The attachment does not appear to be an image.")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise ImageDownloadError(f"Failed to download image: {str(e) or e.__class__.__name__}") from e
+
+        buffer.seek(0)
+        return buffer
+
+class LazyImage:
+    """
+    Handle to an image whose bytes are only downloaded when someone needs them.
+
+    Commands pass the handle down instead of downloading up front, so a
+    follow-up served from the image cache never touches the CDN. The first
+    read() downloads, concurrent readers share that download, and later reads
+    return the same buffer rewound to the start.
+    """
+
+    def __init__(self, downloader, url, data=None):
+        self.downloader = downloader
+        self.url = url
+        self._data = data
+        self._task = None
+
+    async def read(self):
+        """Return the image as a BytesIO, downloading it on first use"""
+        if self._data is None:
+            if not self.url:
+                raise ImageDownloadError("The image is no longer available.")
+            if self._task is None:
+                self._task = asyncio.ensure_future(self.downloader.download(self.url))
+            try:
+                # Shielded so one cancelled reader doesn't abort the download for the others
+                self._data = await asyncio.shield(self._task)
+            except ImageDownloadError:
+                # Let a later read try again
+                self._task = None
+                raise
+        self._data.seek(0)
+        return self._data
@@ -0,0 +1,73 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+# Image worker pool configuration
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', str(min(4, os.cpu_count() or 1))))  # Worker threads/processes
+IMAGE_MAX_PENDING = int(os.getenv('IMAGE_MAX_PENDING', str(IMAGE_WORKERS * 4)))  # Jobs admitted before callers wait
+IMAGE_EXECUTOR_MODE = os.getenv('IMAGE_EXECUTOR_MODE', 'thread')  # "thread" or "process"
+
+class ImageExecutor:
+    """
+    Worker pool for CPU-heavy PIL work (decode, convert, encode, draw).
+
+    Jobs run off the event loop so a large image doesn't delay every other
+    message the bot handles. At most `max_pending` jobs are admitted at once;
+    further callers wait for a free slot instead of queueing unbounded work.
+
+    Thread mode works for any callable since PIL releases the GIL for most
+    codec work. Process mode requires picklable, module-level functions.
+    """
+
+    def __init__(self, max_workers=IMAGE_WORKERS, max_pending=IMAGE_MAX_PENDING, mode=IMAGE_EXECUTOR_MODE):
+        self.max_workers = max_workers
+        self.max_pending = max(max_pending, max_workers)
+        self.mode = mode
+        if mode == 'process':
+            self._executor = ProcessPoolExecutor(max_workers=max_workers)
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='image-worker')
+        # Created lazily so it binds to the bot's running event loop
+        self._slots = None
+        self.stats = {"submitted": 0, "completed": 0, "failed": 0, "in_flight": 0, "waiting": 0, "peak_waiting": 0}
+
+    async def run(self, func, *args, **kwargs):
+        """Run func(*args, **kwargs) in the pool and return its result"""
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_pending)
+
+        # Apply backpressure when the pool is saturated
+        self.stats["waiting"] += 1
+        self.stats["peak_waiting"] = max(self.stats["peak_waiting"], self.stats["waiting"])
+        try:
+            await self._slots.acquire()
+        finally:
+            self.stats["waiting"] -= 1
+
+        self.stats["submitted"] += 1
+        self.stats["in_flight"] += 1
+        try:
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+            self.stats["completed"] += 1
+            return result
+        except Exception:
+            self.stats["failed"] += 1
+            raise
+        finally:
+            self.stats["in_flight"] -= 1
+            self._slots.release()
+
+    def get_stats(self):
+        """Get worker pool statistics"""
+        return {
+            "mode": self.mode,
+            "workers": self.max_workers,
+            "max_pending": self.max_pending,
+            **self.stats
+        }
+
+    def shutdown(self):
+        """Stop accepting work and release the workers"""
+        self._executor.shutdown(wait=False)
@@ -1,11 +1,181 @@
+import asyncio
 import discord
 import math
+import os
+import re
+import time
+from outbox import outbox
 
 # Discord message size limits
 DISCORD_MSG_LIMIT = 2000
 DISCORD_SAFE_LIMIT = 1900  # Setting slightly under the 2000 limit for safety
 DISCORD_CODE_BLOCK_LIMIT = 1800  # Even smaller limit for code blocks due to backticks
 
+# Streaming edits
+STREAM_EDIT_INTERVAL = float(os.getenv('STREAM_EDIT_INTERVAL', '1.0'))  # Minimum seconds between edits of a streamed message
+
+# Inline Markdown markers that must be closed before a cut and re-opened after it, longest first
+INLINE_MARKER_PATTERN = re.compile(r'\*\*|__|~~|\|\||[*_`]')
+FENCE_PATTERN = re.compile(r'^[ \t]*```([^`\n]*)$', re.MULTILINE)  # A backtick fence's info string can't contain backticks
+NON_SPACE_PATTERN = re.compile(r'[ \t]*\S')
+SENTENCE_END_PATTERN = re.compile(r'[.!?]["\')\]]*\s')
+MARKUP_RESERVE = 32  # Room kept at the end of a chunk for closing markers
+MAX_FENCE_LANGUAGE = 20  # Longest code block language carried over to the next chunk
+MARKER_CHARACTERS = '*_~|`'
+MARKER_STEP_BACK = 8  # Characters a hard cut may move back to get clear of marker characters
+ZERO_WIDTH_SPACE = '\u200b'  # Keeps added markers from merging with neighbouring ones (e.g. * and ** into ***)
+
+def find_split(text, start, end):
+    """
+    Find where to cut text[start:] so the piece is at most end - start characters.
+    
+    Prefers paragraph breaks, then line breaks, then sentence ends, then spaces,
+    as long as the piece stays at least half as long; otherwise cuts at end,
+    stepping back up to MARKER_STEP_BACK characters so the cut isn't next to
+    a marker character (which would split ** in two, or read the _ of
+    snake_case as an italic). Inside a longer run of markers it cuts at end
+    anyway, so a wall of asterisks still fills whole chunks.
+    """
+    if end >= len(text):
+        return len(text)
+    floor = start + (end - start) // 2
+    for separator in ('\n\n', '\n'):
+        cut = text.rfind(separator, floor, end)
+        if cut != -1:
+            return cut + len(separator)
+    last = None
+    for last in SENTENCE_END_PATTERN.finditer(text, floor, end):
+        pass
+    if last is not None:
+        return last.end()
+    # Never cut through a code fence line
+    line_start = text.rfind('\n', start, end) + 1
+    if line_start > start and FENCE_PATTERN.match(text, line_start):
+        return line_start
+    cut = text.rfind(' ', floor, end)
+    if cut != -1:
+        return cut + 1
+    cut = end
+    lowest = max(start + 1, end - MARKER_STEP_BACK)
+    while cut > lowest and (text[cut - 1] in MARKER_CHARACTERS or text[cut] in MARKER_CHARACTERS):
+        cut -= 1
+    if text[cut - 1] in MARKER_CHARACTERS or text[cut] in MARKER_CHARACTERS:
+        return end
+    return cut
+
+def scan_markdown(text, fence=None, markers=(), start=0, end=None):
+    """
+    Track which code fence and inline markers are open at the end of text[start:end].
+    
+    The characters around the range still count when deciding whether a
+    single * or _ at its edge is a marker, so a cut through snake_case
+    doesn't open an italic.
+    
+    Args:
+        text: Markdown to scan
+        fence: Language of the code fence open before the range ("" if none was given), or None
+        markers: Inline markers open before the range, outermost first
+        start, end: Range of text to scan (the whole text by default)
+    
+    Returns:
+        tuple: (fence, markers) open at the end of the range
+    """
+    if end is None:
+        end = len(text)
+    markers = list(markers)
+    position = start
+    for match in FENCE_PATTERN.finditer(text, start, end):
+        if fence is None:
+            # Inline formatting can't continue into a code block, so anything still open ends here
+            markers = []
+            # Only the language is repeated when the fence is re-opened
+            words = match.group(1).split()
+            fence = words[0][:MAX_FENCE_LANGUAGE] if words else ""
+        else:
+            fence = None
+        position = match.end()
+    if fence is None:
+        markers = _scan_inline(text, position, end, markers)
+    return fence, tuple(markers)
+
+def _scan_inline(text, start, end, markers):
+    for match in INLINE_MARKER_PATTERN.finditer(text, start, end):
+        marker = match.group()
+        # Inside inline code only a closing backtick counts
+        if markers and markers[-1] == '`' and marker != '`':
+            continue
+        before = text[match.start() - 1] if match.start() > 0 else ' '
+        after = text[match.end()] if match.end() < len(text) else ' '
+        if marker in ('*', '_'):
+            # Single markers only count next to text: "2 * 3", "* item" and snake_case are left alone
+            if marker == '_' and before.isalnum() and after.isalnum():
+                continue
+            closing = marker in markers and not before.isspace()
+            if not closing and after.isspace():
+                continue
+        if marker in markers:
+            # Closing an outer marker implicitly closes anything opened inside it
+            del markers[markers.index(marker):]
+        else:
+            markers.append(marker)
+    return markers
+
+def split_markdown(content, limit=DISCORD_SAFE_LIMIT):
+    """
+    Split Markdown into chunks of at most `limit` characters in a single pass.
+    
+    Chunks end on paragraph, line, sentence or word boundaries where possible.
+    Code fences and inline formatting (bold, italics, strikethrough, spoilers,
+    inline code) open at a cut are closed at the end of the chunk and re-opened
+    at the start of the next, so every chunk renders on its own. Whitespace-only
+    chunks are dropped; there is always at least one chunk, so content that is
+    nothing but whitespace becomes a single ellipsis Discord will accept.
+    """
+    if len(content) <= limit:
+        return [content]
+    
+    chunks = []
+    fence, markers = None, ()
+    position = 0
+    while position < len(content):
+        if markers and fence is None:
+            # A code block coming up closes open inline formatting, so there is nothing to re-open
+            start = NON_SPACE_PATTERN.search(content, position)
+            if start is None or FENCE_PATTERN.match(content, start.start()):
+                markers = ()
+        opening = (f"```{fence}\n" if fence is not None else "") + _join_markers(markers)
+        if len(opening) + len(content) - position <= limit:
+            chunks.append(_join(opening, content[position:].lstrip() if markers else content[position:]))
+            break
+        
+        budget = max(limit - len(opening) - MARKUP_RESERVE, 1)
+        cut = find_split(content, position, position + budget)
+        start = position
+        if markers and fence is None:
+            # A re-opened marker only counts when text follows it directly
+            start = NON_SPACE_PATTERN.search(content, position, cut)
+            start = start.end() - 1 if start is not None else cut
+        piece = content[start:cut]
+        fence, markers = scan_markdown(content, fence, markers, start, cut)
+        # Closing markers go right after the text, as they wouldn't count after whitespace
+        closing = _join_markers(reversed(markers))
+        if fence is not None:
+            closing += "\n```"
+        
+        if piece.strip():
+            chunks.append(_join(_join(opening, piece.rstrip()), closing))
+        position = cut
+    return [chunk for chunk in chunks if chunk.strip()] or ["\u2026"]
+
+def _join_markers(markers):
+    return ZERO_WIDTH_SPACE.join(markers)
+
+def _join(left, right):
+    """Concatenate, separating marker characters that would otherwise run together"""
+    if left and right and left[-1] in MARKER_CHARACTERS and right[0] in MARKER_CHARACTERS:
+        return left + ZERO_WIDTH_SPACE + right
+    return left + right
+
 class MessageSplitter:
     @staticmethod
     async def send_message(channel, content, **kwargs):
@@ -23,7 +193,7 @@ class MessageSplitter:
         """
         # If content is short enough, send it as is
         if len(content) <= DISCORD_SAFE_LIMIT:
-            return await channel.send(content, **kwargs)
+            return await outbox.send(channel, content, **kwargs)
         
         # For split messages, we need to handle attachments and embeds specially
         # Only include them in the first message
@@ -31,32 +201,38 @@ class MessageSplitter:
         rest_message_kwargs = {k: v for k, v in kwargs.items() 
                               if k not in ('file', 'files', 'embed', 'embeds')}
         
-        # Otherwise, split it into chunks
+        # Otherwise, split it into chunks on Markdown-safe boundaries
         messages = []
-        chunks = [content[i:i + DISCORD_SAFE_LIMIT] 
-                for i in range(0, len(content), DISCORD_SAFE_LIMIT)]
+        chunks = split_markdown(content)
         
         # Send first chunk with all attachments
-        messages.append(await channel.send(chunks[0], **first_message_kwargs))
+        messages.append(await outbox.send(channel, chunks[0], **first_message_kwargs))
         
         # Send remaining chunks without attachments
         for chunk in chunks[1:]:
-            messages.append(await channel.send(chunk, **rest_message_kwargs))
+            messages.append(await outbox.send(channel, chunk, **rest_message_kwargs))
         
         return messages[-1]  # Return the last message for reference
     
     @staticmethod
-    async def edit_message(message, content):
-        """Edit a message, splitting it if needed."""
-        # If content is short enough, edit it directly
-        if len(content) <= DISCORD_SAFE_LIMIT:
-            return await message.edit(content=content)
+    async def edit_message(message, content, file=None):
+        """
+        Edit a message, splitting it if needed.
         
-        # For longer content, delete original and send as multiple messages
-        channel = message.channel
-        await message.delete()
+        Longer content keeps the message: it is edited to hold the first chunk
+        and the rest follows in new messages. Returns the last message.
+        A file is attached to the last message, by the same call that sends it.
+        """
+        chunks = split_markdown(content)
+        fields = {"attachments": [file]} if file is not None and len(chunks) == 1 else {}
+        last = await outbox.edit(message, content=chunks[0], **fields)
         
-        return await MessageSplitter.send_message(channel, content)
+        for index, chunk in enumerate(chunks[1:], start=2):
+            if file is not None and index == len(chunks):
+                last = await outbox.send(message.channel, chunk, file=file)
+            else:
+                last = await outbox.send(message.channel, chunk)
+        return last
     
     @staticmethod
     async def send_code_block(channel, content, language=""):
@@ -66,7 +242,7 @@ class MessageSplitter:
         
         # If it fits in one message
         if len(content) <= max_content:
-            return await channel.send(f"```{language}\n{content}\n```")
+            return await outbox.send(channel, f"```{language}\n{content}\n```")
         
         # Calculate number of parts needed
         total_parts = math.ceil(len(content) / max_content)
@@ -80,7 +256,7 @@ class MessageSplitter:
             
             # Add part indicator
             part_msg = f"```{language}\n# Part {i+1}/{total_parts}\n{part_content}\n```"
-            messages.append(await channel.send(part_msg))
+            messages.append(await outbox.send(channel, part_msg))
         
         return messages[-1]  # Return the last message for reference
     
@@ -89,16 +265,113 @@ class MessageSplitter:
         """Send an embed, splitting the description if needed."""
         # Check if the embed description exceeds the limit
         if embed.description and len(embed.description) > DISCORD_SAFE_LIMIT:
-            # Save the original description
-            full_description = embed.description
+            chunks = split_markdown(embed.description)
             
             # Send first part with embed
-            embed.description = full_description[:DISCORD_SAFE_LIMIT]
-            await channel.send(embed=embed)
+            embed.description = chunks[0]
+            last = await outbox.send(channel, embed=embed)
             
             # Send remaining parts as regular messages
-            remaining = full_description[DISCORD_SAFE_LIMIT:]
-            return await MessageSplitter.send_message(channel, remaining)
+            for chunk in chunks[1:]:
+                last = await outbox.send(channel, chunk)
+            return last
         
         # If within limits, send normally
-        return await channel.send(embed=embed)
\ No newline at end of file
+        return await outbox.send(channel, embed=embed)
+
+class ProgressiveMessage:
+    """
+    A message that is edited repeatedly while its content streams in.
+
+    Edits are coalesced: at most one edit goes out per `interval` seconds and
+    it always carries the latest content, so a fast stream costs a handful of
+    Discord API calls instead of one per chunk. Content that grows past
+    DISCORD_SAFE_LIMIT is cut at a paragraph, line, sentence or word boundary
+    and continues in a follow-up message, re-opening any code block or
+    formatting open at the cut as split_markdown() does; text moved into a
+    full message is never edited again.
+    """
+
+    def __init__(self, message, interval=STREAM_EDIT_INTERVAL):
+        self.messages = [message]
+        self.interval = interval
+        self.content = message.content
+        self.rendered = message.content
+        self.shown = message.content  # What Discord currently shows in the last message
+        self.frozen = ""  # Leading content already finalized in earlier messages
+        self.fence, self.markers = None, ()  # Code fence and inline markers open where the frozen content ends
+        self.last_edit = 0.0
+        self._task = None
+
+    def update(self, content):
+        """Queue new content, shown with the next coalesced edit"""
+        self.content = content
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._edit_loop())
+
+    async def finish(self, content):
+        """Show the final content and return the last message"""
+        self.content = content
+        if self._task is not None and not self._task.done():
+            # The running loop picks up the final content before it exits
+            await self._task
+        if self.rendered != content:
+            await self._render()
+        return self.messages[-1]
+
+    async def _edit_loop(self):
+        while self.rendered != self.content:
+            delay = self.last_edit + self.interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                await self._render()
+            except discord.HTTPException as e:
+                print(f"[STREAM] Edit failed: {e}")
+                return
+
+    async def _render(self):
+        content = self.content
+        if not content.startswith(self.frozen):
+            # The content was replaced (e.g. by an error), so continue in a fresh message
+            self.messages.append(await outbox.send(self.messages[-1].channel, "\u2026"))
+            self.shown = "\u2026"
+            self.frozen = ""
+            self.fence, self.markers = None, ()
+
+        # Cut like split_markdown, so a code block or formatting open at a cut is closed
+        # in the full message and re-opened in the follow-up
+        position = len(self.frozen)
+        opening = self._opening()
+        while len(opening) + len(content) - position > DISCORD_SAFE_LIMIT:
+            budget = max(DISCORD_SAFE_LIMIT - len(opening) - MARKUP_RESERVE, 1)
+            cut = find_split(content, position, position + budget)
+            self.fence, self.markers = scan_markdown(content, self.fence, self.markers, position, cut)
+            closing = _join_markers(reversed(self.markers))
+            if self.fence is not None:
+                closing += "\n```"
+            await self._show(_join(_join(opening, content[position:cut].rstrip()), closing))
+            self.frozen = content[:cut]
+            position = cut
+            opening = self._opening()
+            # Start the follow-up message with as much of the rest as fits
+            self.shown = self._compose(opening, content[position:])[:DISCORD_SAFE_LIMIT].strip() or "\u2026"
+            self.messages.append(await outbox.send(self.messages[-1].channel, self.shown))
+            self.last_edit = time.monotonic()
+        await self._show(self._compose(opening, content[position:]))
+        self.rendered = content
+
+    def _opening(self):
+        """Markup re-opening the code block and formatting left open by the frozen content"""
+        return (f"```{self.fence}\n" if self.fence is not None else "") + _join_markers(self.markers)
+
+    def _compose(self, opening, text):
+        # A re-opened marker only counts when text follows it directly
+        return _join(opening, text.lstrip() if self.markers and self.fence is None else text)
+
+    async def _show(self, text):
+        text = text.strip() or "\u2026"
+        if text != self.shown:
+            await MessageSplitter.edit_message(self.messages[-1], text)
+            self.shown = text
+            self.last_edit = time.monotonic()
@@ -0,0 +1,387 @@
+import asyncio
+import base64
+import json
+import os
+import random
+import time
+import aiohttp
+from scheduler import parse_retry_after
+
+# Moondream API configuration
+API_BASE_URL = os.getenv('MOONDREAM_API_URL', 'https://api.moondream.ai/v1')
+API_TIMEOUT = float(os.getenv('MOONDREAM_API_TIMEOUT', '60'))  # Seconds for a full request round-trip
+API_CONNECT_TIMEOUT = float(os.getenv('MOONDREAM_API_CONNECT_TIMEOUT', '10'))  # Seconds to establish a connection
+API_POOL_LIMIT = int(os.getenv('MOONDREAM_API_POOL_LIMIT', '20'))  # Max open connections to the API
+API_KEEPALIVE_TIMEOUT = float(os.getenv('MOONDREAM_API_KEEPALIVE', '30'))  # Seconds an idle connection is kept open
+API_MAX_ATTEMPTS = int(os.getenv('MOONDREAM_API_MAX_ATTEMPTS', '3'))  # Attempts per call, first try included
+API_BACKOFF_BASE = float(os.getenv('MOONDREAM_API_BACKOFF_BASE', '0.5'))  # Seconds before the first retry (jittered)
+API_BACKOFF_MAX = float(os.getenv('MOONDREAM_API_BACKOFF_MAX', '8'))  # Upper bound on a single backoff
+BREAKER_FAILURE_THRESHOLD = int(os.getenv('MOONDREAM_BREAKER_THRESHOLD', '5'))  # Consecutive failures that open the circuit
+BREAKER_RECOVERY_TIMEOUT = float(os.getenv('MOONDREAM_BREAKER_RECOVERY', '30'))  # Seconds open before a probe is let through
+
+RETRYABLE_STATUSES = {408, 500, 502, 503, 504}  # Plus 429, which is handled separately
+JSON_HEADERS = {"Content-Type": "application/json"}
+ERROR_BODY_LIMIT = 200  # Characters of an error response kept for logs and messages
+STREAM_FIELDS = {'caption': 'caption', 'query': 'answer'}  # Result field a streamed endpoint's text belongs in
+UNAVAILABLE_MESSAGE = "Moondream is temporarily unavailable. Please try again in a minute."
+DEADLINE_MESSAGE = "The request took too long. Please try again."
+
+class EncodedImage:
+    """
+    An encoded image ready to be sent to the API.
+
+    The API takes images as base64 data URLs inside a JSON body. The data URL
+    is built once per image, as bytes, and spliced into every request body,
+    so calls on the same image (a title and a command, or one detect per
+    object) share a single base64 encoding and never pass a multi-megabyte
+    string through json.dumps.
+    """
+    __slots__ = ('data', 'mime_type', '_data_url')
+
+    def __init__(self, data, mime_type='image/jpeg'):
+        self.data = data
+        self.mime_type = mime_type
+        self._data_url = None
+
+    @property
+    def data_url(self):
+        if self._data_url is None:
+            self._data_url = b'data:' + self.mime_type.encode('ascii') + b';base64,' + base64.b64encode(self.data)
+        return self._data_url
+
+def build_request_body(image, fields):
+    """
+    Serialize a request body as JSON bytes.
+
+    An EncodedImage's data URL is spliced in as is: base64 never needs JSON
+    escaping, so only the small remaining fields go through json.dumps.
+    Anything else (a plain URL string) is serialized normally.
+    """
+    if not isinstance(image, EncodedImage):
+        return json.dumps({"image_url": image, **fields}).encode('utf-8')
+    rest = json.dumps(fields).encode('utf-8')
+    if rest == b'{}':
+        return b'{"image_url": "' + image.data_url + b'"}'
+    return b'{"image_url": "' + image.data_url + b'", ' + rest[1:]
+
+class CircuitBreaker:
+    """
+    Circuit breaker guarding the Moondream API.
+
+    After `failure_threshold` consecutive failures the circuit opens and calls
+    are rejected without touching the network. Once `recovery_timeout` has
+    passed, a single probe call is let through (half-open): success closes the
+    circuit again, failure re-opens it for another recovery period.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD, recovery_timeout=BREAKER_RECOVERY_TIMEOUT):
+        self.failure_threshold = max(failure_threshold, 1)
+        self.recovery_timeout = recovery_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = None  # ticket of the probe in flight, if any
+        self.stats = {"opened": 0, "probes": 0}
+
+    def allow(self):
+        """
+        Return a ticket if a request may be sent now, or False.
+
+        The ticket is passed back to release() or record_*(), so only the
+        probe that took the half-open slot can give it back; calls admitted
+        before the circuit opened get a plain True.
+        """
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.recovery_timeout:
+                return False
+            self.state = self.HALF_OPEN
+            print("[API] Circuit half-open, probing the API")
+        # Half-open: only one probe at a time
+        if self.probing is not None:
+            return False
+        self.probing = object()
+        self.stats["probes"] += 1
+        return self.probing
+
+    def record_success(self, ticket=None):
+        if self.state != self.CLOSED:
+            print("[API] Circuit closed, the API is responding again")
+        self.state = self.CLOSED
+        self.failures = 0
+        self.release(ticket)
+
+    def record_failure(self, ticket=None):
+        self.failures += 1
+        self.release(ticket)
+        if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.failure_threshold):
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+            self.stats["opened"] += 1
+            print(f"[API] Circuit opened after {self.failures} consecutive failures")
+
+    def release(self, ticket=None):
+        """Give back a probe slot without judging the API either way (a no-op unless ticket holds it)"""
+        if ticket is not None and ticket is self.probing:
+            self.probing = None
+
+    def get_stats(self):
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            **self.stats
+        }
+
+class MoondreamClient:
+    """
+    Async client for the Moondream API.
+
+    All calls share a single aiohttp session with a pooled keep-alive connector,
+    so concurrent commands run concurrently instead of blocking the event loop.
+    The session is created lazily on first use because it must be bound to the
+    running event loop.
+
+    If a rate limiter (see scheduler.TokenBucket) is given, every attempt waits
+    for it, and a 429 response pauses it for the Retry-After period. A
+    CircuitBreaker rejects calls outright while the API keeps failing.
+    """
+
+    def __init__(self, api_key, base_url=API_BASE_URL, timeout=API_TIMEOUT,
+                 connect_timeout=API_CONNECT_TIMEOUT, pool_limit=API_POOL_LIMIT,
+                 keepalive_timeout=API_KEEPALIVE_TIMEOUT, rate_limiter=None, breaker=None,
+                 max_attempts=API_MAX_ATTEMPTS, backoff_base=API_BACKOFF_BASE, backoff_max=API_BACKOFF_MAX):
+        self.api_key = api_key
+        self.rate_limiter = rate_limiter
+        self.breaker = breaker or CircuitBreaker()
+        self.max_attempts = max(max_attempts, 1)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.stats = {
+            "calls": 0, "succeeded": 0, "failed": 0, "retries": 0,
+            "permanent_errors": 0, "rejected": 0, "deadline_exceeded": 0, "incomplete_streams": 0, "bytes_sent": 0
+        }
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.pool_limit = pool_limit
+        self.keepalive_timeout = keepalive_timeout
+        self._session = None
+
+    async def get_session(self):
+        """Return the shared session, creating it on first use"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_limit,
+                limit_per_host=self.pool_limit,
+                keepalive_timeout=self.keepalive_timeout,
+                ttl_dns_cache=300
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout, connect=self.connect_timeout),
+                headers={
+                    "X-Moondream-Auth": self.api_key or "",
+                    "User-Agent": "MoondreamDiscordBot"
+                }
+            )
+        return self._session
+
+    async def close(self):
+        """Close the shared session and release pooled connections"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def _read_stream(self, response, endpoint, on_chunk):
+        """Collect a streamed (server-sent events) response, reporting the text as it grows"""
+        field = STREAM_FIELDS.get(endpoint, 'text')
+
+        # The API may answer a streaming request with a plain JSON body
+        if response.content_type == 'application/json':
+            result = await response.json()
+            if result.get(field):
+                on_chunk(result[field])
+            return result
+
+        text = ""
+        async for raw_line in response.content:
+            line = raw_line.decode('utf-8', 'replace').strip()
+            if not line.startswith('data:'):
+                continue
+            data = line[5:].strip()
+            if data == '[DONE]':
+                return {field: text}
+            if not data:
+                continue
+            event = json.loads(data)
+            if event.get('error'):
+                return {"error": f"API Error: {event['error']}"}
+            if event.get('chunk'):
+                text += event['chunk']
+                on_chunk(text)
+            if event.get('completed'):
+                return {field: text}
+
+        # The stream ended without saying the answer was finished, so it may be cut short
+        print(f"[API] {endpoint} stream ended before its completion event")
+        self.stats["incomplete_streams"] += 1
+        return {field: text, "incomplete": True}
+
+    async def call(self, endpoint, image, additional_params=None, timeout=None, deadline=None, on_chunk=None):
+        """
+        Call a Moondream API endpoint and return the decoded JSON response.
+
+        Retryable failures (timeouts, connection errors, 429 and 5xx) are retried
+        with exponential backoff and full jitter; other errors fail immediately.
+
+        If on_chunk is given the response is streamed, and on_chunk(text) is
+        called with the text received so far every time a chunk arrives. A
+        stream that breaks after text was shown is not retried, and one that
+        ends without its completion event is returned with "incomplete": True.
+
+        Args:
+            endpoint: API endpoint name (caption, query, detect, point)
+            image: EncodedImage, or an image URL string, sent as the "image_url" field
+            additional_params: Extra fields merged into the request body (optional)
+            timeout: Per-request timeout in seconds, overriding the client default (optional)
+            deadline: time.monotonic() value after which no attempt is started (optional)
+            on_chunk: Callback receiving the partial text of a streamed caption or query (optional)
+
+        Returns:
+            dict: The API response, or {"error": ...} if the call failed
+        """
+        url = f"{self.base_url}/{endpoint}"
+
+        # Prepare request body once, it is the same for every attempt
+        payload = {"stream": on_chunk is not None}
+
+        # Add additional parameters if provided
+        if additional_params:
+            payload.update(additional_params)
+        body = build_request_body(image, payload)
+
+        session = await self.get_session()
+        self.stats["calls"] += 1
+        full_timeout = timeout or self.timeout
+        error_text = "API call failed"
+
+        streamed = False
+        def deliver(text):
+            nonlocal streamed
+            streamed = True
+            on_chunk(text)
+
+        for attempt in range(1, self.max_attempts + 1):
+            # Fail fast while the API is known to be down
+            ticket = self.breaker.allow()
+            if not ticket:
+                self.stats["rejected"] += 1
+                return {"error": UNAVAILABLE_MESSAGE}
+
+            attempt_timeout = full_timeout
+            try:
+                # Wait for the rate limiter before every attempt, retries included
+                if self.rate_limiter is not None:
+                    await self.rate_limiter.acquire()
+
+                # Never let a single attempt run past the command's deadline
+                if deadline is not None:
+                    attempt_timeout = min(attempt_timeout, deadline - time.monotonic())
+                    if attempt_timeout <= 0:
+                        self.breaker.release(ticket)
+                        self.stats["deadline_exceeded"] += 1
+                        return {"error": DEADLINE_MESSAGE}
+                request_timeout = aiohttp.ClientTimeout(total=attempt_timeout, connect=self.connect_timeout)
+
+                # Make the API call
+                self.stats["bytes_sent"] += len(body)
+                async with session.post(url, data=body, headers=JSON_HEADERS, timeout=request_timeout) as response:
+                    # Check for success
+                    if response.status == 200:
+                        if on_chunk is not None:
+                            result = await self._read_stream(response, endpoint, deliver)
+                        else:
+                            result = await response.json()
+                        self.breaker.record_success(ticket)
+                        self.stats["succeeded"] += 1
+                        return result
+
+                    # Keep the log readable when the API answers with a full error page
+                    response_text = (await response.text())[:ERROR_BODY_LIMIT]
+                    error_text = f"{response.status} - {response_text}"
+                    print(f"[API] {endpoint} failed (attempt {attempt}/{self.max_attempts}): Status {error_text}")
+
+                    if response.status == 429:
+                        # The API is up, just busy: honor Retry-After instead of tripping the breaker
+                        self.breaker.release(ticket)
+                        retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                    elif response.status in RETRYABLE_STATUSES:
+                        self.breaker.record_failure(ticket)
+                        retry_after = None
+                    else:
+                        # The request itself is wrong (bad parameters, bad key), retrying won't help
+                        self.breaker.record_success(ticket)
+                        self.stats["permanent_errors"] += 1
+                        return {"error": f"API Error: {error_text}"}
+
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if isinstance(e, asyncio.TimeoutError) and attempt_timeout < full_timeout:
+                    # Cut short by our own deadline, which says nothing about the API's health
+                    self.breaker.release(ticket)
+                else:
+                    self.breaker.record_failure(ticket)
+                retry_after = None
+                # Timeouts stringify to an empty message, so fall back to the exception name
+                error_text = str(e) or e.__class__.__name__
+                print(f"[API] {endpoint} exception (attempt {attempt}/{self.max_attempts}): {error_text}")
+
+                # Restarting would replace text the user has already seen
+                if streamed:
+                    self.stats["failed"] += 1
+                    return {"error": f"API Error: {error_text}"}
+
+            except Exception as e:
+                # Anything else (e.g. an undecodable response) won't be fixed by retrying
+                self.breaker.release(ticket)
+                self.stats["permanent_errors"] += 1
+                error_text = str(e) or e.__class__.__name__
+                print(f"[API] {endpoint} exception: {error_text}")
+                return {"error": f"API Error: {error_text}"}
+
+            except BaseException:
+                # Cancelled mid-attempt: don't leave a half-open probe slot taken
+                self.breaker.release(ticket)
+                raise
+
+            if attempt == self.max_attempts:
+                break
+
+            # Exponential backoff with full jitter, so retries from many commands spread out
+            delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
+            if retry_after is not None:
+                if self.rate_limiter is not None:
+                    # Pausing the shared limiter holds back every caller, not just this one
+                    self.rate_limiter.penalize(retry_after)
+                else:
+                    delay = max(delay, retry_after)
+            if deadline is not None and time.monotonic() + delay >= deadline:
+                self.stats["deadline_exceeded"] += 1
+                self.stats["failed"] += 1
+                return {"error": DEADLINE_MESSAGE}
+            self.stats["retries"] += 1
+            await asyncio.sleep(delay)
+
+        self.stats["failed"] += 1
+        return {"error": f"API Error: {error_text}"}
+
+    def get_stats(self):
+        return {
+            "max_attempts": self.max_attempts,
+            **self.stats,
+            **self.breaker.get_stats()
+        }
@@ -0,0 +1,122 @@
+import asyncio
+import os
+from collections import OrderedDict
+from scheduler import TokenBucket, request_owner
+
+# Outbound Discord message configuration
+DISCORD_CHANNEL_RATE = float(os.getenv('DISCORD_CHANNEL_RATE', '1'))  # Sends/edits per second per channel (0 disables)
+DISCORD_CHANNEL_BURST = int(os.getenv('DISCORD_CHANNEL_BURST', '5'))  # Writes allowed back-to-back in one channel
+MAX_CHANNEL_BUDGETS = 1024  # Channels whose budget is remembered before the least recently used is dropped
+
+class Outbox:
+    """
+    Outbound layer for Discord sends and edits.
+
+    Writes to a channel are paced by a per-channel token bucket sized to
+    Discord's per-channel limit (about 5 messages per 5 seconds), so a busy
+    thread waits briefly here instead of hitting a 429 and having discord.py
+    sleep inside the handler.
+
+    Edits to the same message are coalesced: an edit that is still waiting
+    for its turn absorbs later edits, and all of their callers get the one
+    resulting message.
+
+    Every call is counted, globally and on the RequestOwner of the command
+    that made it.
+    """
+
+    def __init__(self, rate=DISCORD_CHANNEL_RATE, burst=DISCORD_CHANNEL_BURST):
+        self.rate = rate
+        self.burst = burst
+        self.budgets = OrderedDict()  # channel id -> TokenBucket
+        self.pending_edits = {}  # message id -> waiting edit
+        self.stats = {
+            "sends": 0, "edits": 0, "deletes": 0, "coalesced_edits": 0,
+            "throttled": 0, "commands": 0, "command_calls": 0
+        }
+
+    def _budget(self, channel):
+        # Command contexts are accepted wherever a channel is, like channel.send()
+        channel_id = getattr(channel, 'id', None) or getattr(getattr(channel, 'channel', None), 'id', None)
+        budget = self.budgets.get(channel_id)
+        if budget is None:
+            budget = self.budgets[channel_id] = TokenBucket(self.rate, self.burst)
+            if len(self.budgets) > MAX_CHANNEL_BUDGETS:
+                self.budgets.popitem(last=False)
+        else:
+            self.budgets.move_to_end(channel_id)
+        return budget
+
+    async def _acquire(self, channel):
+        """Wait for the channel's write budget"""
+        budget = self._budget(channel)
+        throttled = budget.stats["throttled"]
+        await budget.acquire()
+        self.stats["throttled"] += budget.stats["throttled"] - throttled
+
+    def _count(self, kind):
+        self.stats[kind] += 1
+        owner = request_owner.get()
+        if owner is not None:
+            owner.discord_calls += 1
+
+    async def send(self, channel, content=None, **kwargs):
+        """Send a message once the channel's budget allows it"""
+        await self._acquire(channel)
+        self._count("sends")
+        return await channel.send(content, **kwargs)
+
+    async def edit(self, message, **fields):
+        """
+        Edit a message, merging with an edit of the same message that hasn't gone out yet.
+
+        Returns the edited message.
+        """
+        pending = self.pending_edits.get(message.id)
+        if pending is not None and not pending["started"]:
+            pending["fields"].update(fields)
+            self.stats["coalesced_edits"] += 1
+            return await asyncio.shield(pending["future"])
+
+        # An edit already on its way is allowed to finish first, so edits land in order
+        previous = pending["future"] if pending is not None else None
+        pending = {"fields": dict(fields), "started": False, "future": None}
+        self.pending_edits[message.id] = pending
+        pending["future"] = asyncio.ensure_future(self._edit(message, pending, previous))
+        return await asyncio.shield(pending["future"])
+
+    async def _edit(self, message, pending, previous):
+        try:
+            if previous is not None:
+                await asyncio.wait([previous])
+            await self._acquire(message.channel)
+            pending["started"] = True
+            self._count("edits")
+            return await message.edit(**pending["fields"])
+        finally:
+            if self.pending_edits.get(message.id) is pending:
+                del self.pending_edits[message.id]
+
+    async def delete(self, message):
+        """Delete a message (deletes have their own Discord limit, so they are only counted)"""
+        self._count("deletes")
+        await message.delete()
+
+    def record_command(self, owner):
+        """Add a finished command's Discord call count to the per-command average"""
+        if owner is not None:
+            self.stats["commands"] += 1
+            self.stats["command_calls"] += owner.discord_calls
+
+    def get_stats(self):
+        commands = self.stats["commands"]
+        return {
+            "rate": self.rate,
+            "burst": self.burst,
+            "channels": len(self.budgets),
+            "calls_per_command": self.stats["command_calls"] / commands if commands else 0,
+            **self.stats
+        }
+
+# Shared by every module that writes to Discord
+outbox = Outbox()
@@ -0,0 +1,101 @@
+import json
+import os
+import time
+from collections import OrderedDict
+
+# Moondream API result cache configuration
+RESULT_CACHE_TTL = float(os.getenv('RESULT_CACHE_TTL', '3600'))  # Seconds a result stays valid
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv('RESULT_CACHE_MAX_ENTRIES', '1000'))  # Results kept before LRU eviction
+
+CASE_INSENSITIVE_PARAMS = {'object'}  # Parameters whose case never changes the answer
+
+def normalize_params(params):
+    """
+    Normalize request parameters so equivalent commands share a cache key.
+
+    String values are trimmed and have runs of whitespace collapsed. Object
+    names are also case-folded, so "!d  Person" and "!d person" hit the same
+    entry; questions keep their case, which can matter (acronyms, quoted text).
+    """
+    normalized = {}
+    for name, value in (params or {}).items():
+        if isinstance(value, str):
+            value = ' '.join(value.split())
+            if name in CASE_INSENSITIVE_PARAMS:
+                value = value.casefold()
+        normalized[name] = value
+    return json.dumps(normalized, sort_keys=True)
+
+class ResultCache:
+    """
+    TTL + LRU cache of Moondream API responses.
+
+    Keyed by image content hash, endpoint and normalized parameters, so a
+    repeated command on the same image is answered without calling the API.
+    Error responses are never cached.
+    """
+
+    def __init__(self, ttl=RESULT_CACHE_TTL, max_entries=RESULT_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.cache = OrderedDict()  # (image hash, endpoint, params) -> (result, stored_at)
+        self.stats = {"hits": 0, "misses": 0, "expired": 0, "evictions": 0}
+
+    @staticmethod
+    def make_key(image_hash, endpoint, params=None):
+        return (image_hash, endpoint, normalize_params(params))
+
+    def get(self, key):
+        """Get a cached result if present and not expired"""
+        item = self.cache.get(key)
+        if item is not None:
+            result, stored_at = item
+            if time.time() - stored_at <= self.ttl:
+                # Move the item to the end to mark it as recently used
+                self.cache.move_to_end(key)
+                self.stats["hits"] += 1
+                return result
+            del self.cache[key]
+            self.stats["expired"] += 1
+        self.stats["misses"] += 1
+        return None
+
+    def put(self, key, result):
+        """Store a successful API result (errors and incomplete streamed answers are not cached)"""
+        if 'error' in result or result.get('incomplete'):
+            return result
+        if key in self.cache:
+            del self.cache[key]
+
+        # If cache is full, remove the least recently used items
+        while len(self.cache) >= self.max_entries:
+            self.cache.popitem(last=False)
+            self.stats["evictions"] += 1
+
+        self.cache[key] = (result, time.time())
+        return result
+
+    def recent(self, limit=10):
+        """Return the most recently used entries as (endpoint, params, age in seconds)"""
+        now = time.time()
+        items = list(self.cache.items())[-limit:]
+        return [(endpoint, params, now - stored_at) for (_, endpoint, params), (_, stored_at) in reversed(items)]
+
+    def get_stats(self):
+        """Get cache statistics"""
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            "size": len(self.cache),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "hits": self.stats["hits"],
+            "misses": self.stats["misses"],
+            "expired": self.stats["expired"],
+            "evictions": self.stats["evictions"],
+            "hit_ratio": self.stats["hits"] / lookups if lookups > 0 else 0
+        }
+
+    def clear(self):
+        """Clear the cache"""
+        self.cache.clear()
+        return True
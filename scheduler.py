@@ -0,0 +1,344 @@
+import asyncio
+import contextvars
+import datetime
+import email.utils
+import os
+import time
+from collections import OrderedDict, deque
+
+# Request scheduling configuration
+SCHEDULER_MAX_CONCURRENCY = int(os.getenv('SCHEDULER_MAX_CONCURRENCY', '4'))  # API calls in flight at once
+MOONDREAM_RATE_LIMIT = float(os.getenv('MOONDREAM_RATE_LIMIT', '10'))  # Requests per second (0 disables)
+MOONDREAM_RATE_BURST = int(os.getenv('MOONDREAM_RATE_BURST', '10'))  # Requests allowed back-to-back
+QUEUE_NOTIFY_INTERVAL = float(os.getenv('SCHEDULER_NOTIFY_INTERVAL', '1'))  # Seconds between queue position updates at the most
+COMMAND_DEADLINE = float(os.getenv('MOONDREAM_COMMAND_DEADLINE', '120'))  # Seconds a command may spend on API calls
+MAX_RETRY_AFTER = 60  # Never pause for longer than this on a single Retry-After
+
+class RequestOwner:
+    """Who a request is for, used for fair queuing and queue-position feedback"""
+    __slots__ = ('guild_id', 'user_id', 'notify', 'last_position', 'deadline', 'discord_calls')
+
+    def __init__(self, guild_id=None, user_id=None, notify=None, deadline=COMMAND_DEADLINE):
+        self.guild_id = guild_id
+        self.user_id = user_id
+        self.notify = notify  # async callable(position), position 0 meaning "running now"
+        self.last_position = None
+        # Every API call made for the command shares one budget, retries included
+        self.deadline = time.monotonic() + deadline if deadline else None
+        self.discord_calls = 0  # Discord sends/edits/deletes made for the command (see outbox)
+
+# Set by Discord handlers so API calls made further down know who they are for
+request_owner = contextvars.ContextVar('request_owner', default=None)
+
+def parse_retry_after(value, default=1.0):
+    """Parse a Retry-After header (delay in seconds or an HTTP date) into seconds"""
+    if not value:
+        return default
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            retry_at = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return default
+        seconds = (retry_at - datetime.datetime.now(datetime.timezone.utc)).total_seconds()
+    return min(max(seconds, 0.0), MAX_RETRY_AFTER)
+
+class TokenBucket:
+    """
+    Token-bucket rate limiter for outgoing API requests.
+
+    penalize() pauses the bucket entirely, which is how a 429's Retry-After
+    is honored for every caller rather than just the one that got it.
+    """
+
+    def __init__(self, rate=MOONDREAM_RATE_LIMIT, burst=MOONDREAM_RATE_BURST):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.stats = {"acquired": 0, "throttled": 0, "rate_limited": 0}
+
+    async def acquire(self):
+        """Wait until a request may be sent"""
+        throttled = False
+        while True:
+            now = time.monotonic()
+            if now < self.paused_until:
+                throttled = True
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            if self.rate <= 0:
+                break
+            # Refill tokens for the time that has passed
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                break
+            throttled = True
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+        self.stats["acquired"] += 1
+        if throttled:
+            self.stats["throttled"] += 1
+
+    def penalize(self, retry_after):
+        """Stop sending requests for retry_after seconds (the API answered 429)"""
+        self.stats["rate_limited"] += 1
+        self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+
+    def get_stats(self):
+        return {
+            "rate": self.rate,
+            "burst": self.burst,
+            "paused_for": max(0.0, self.paused_until - time.monotonic()),
+            **self.stats
+        }
+
+class RequestScheduler:
+    """
+    Bounded-concurrency scheduler with fair queuing for Moondream API calls.
+
+    At most `max_concurrency` calls run at once. Waiting calls are queued per
+    guild and per user and served round-robin (guilds first, then users within
+    a guild), so one busy server or one spammy user can't starve everyone else.
+    A finishing call hands its slot directly to the next waiter.
+
+    Waiters whose owner has a notify callback are told their place in line
+    when they join the queue and again as it moves. Updates are batched: a
+    change of positions schedules one refresh `notify_interval` seconds
+    later, which notifies only the owners whose position changed. An owner
+    that gets its callback after its calls were queued catches up with
+    follow().
+    """
+
+    def __init__(self, max_concurrency=SCHEDULER_MAX_CONCURRENCY, notify_interval=QUEUE_NOTIFY_INTERVAL):
+        self.max_concurrency = max_concurrency
+        self.notify_interval = notify_interval
+        self.active = 0
+        self.queues = OrderedDict()  # guild id -> OrderedDict(user id -> deque of futures)
+        self.waiting = 0
+        self.owners = {}  # future -> owner, for waiters with an owner
+        self._refresh = None  # pending position refresh task
+        self.stats = {"completed": 0, "queued": 0, "peak_waiting": 0}
+
+    async def run(self, factory, owner=None):
+        """
+        Run factory() once a slot is free and return its result.
+
+        Args:
+            factory: Callable returning the awaitable to run
+            owner: RequestOwner for fair queuing and position feedback (optional)
+        """
+        if self.active < self.max_concurrency and not self.waiting:
+            self.active += 1
+        else:
+            await self._wait_for_slot(owner)
+
+        try:
+            return await factory()
+        finally:
+            self.stats["completed"] += 1
+            self._release()
+
+    async def _wait_for_slot(self, owner):
+        guild_id = owner.guild_id if owner else None
+        user_id = owner.user_id if owner else None
+        future = asyncio.get_running_loop().create_future()
+        self.queues.setdefault(guild_id, OrderedDict()).setdefault(user_id, deque()).append(future)
+        self.waiting += 1
+        self.stats["queued"] += 1
+        self.stats["peak_waiting"] = max(self.stats["peak_waiting"], self.waiting)
+
+        # Every await from here on is covered, so a cancelled caller never takes its slot with it
+        try:
+            # Tell the user where they are in line; later moves are sent by _refresh_positions()
+            if owner is not None:
+                self.owners[future] = owner
+                await self.follow(owner)
+
+            # The slot is handed over by _release(), so active stays unchanged
+            await future
+
+            # Let the user know their request left the queue
+            if owner is not None and owner.notify is not None and owner.last_position:
+                await self._notify(owner, 0)
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # We were given a slot but won't use it, so pass it on
+                self._release()
+            else:
+                future.cancel()
+                self._discard(future)
+                self._positions_changed()
+            raise
+        finally:
+            self.owners.pop(future, None)
+
+    async def follow(self, owner):
+        """
+        Send an owner the place of its first waiting call, if any.
+
+        Called when a call joins the queue, and by owners that get a notify
+        callback after their calls were queued.
+        """
+        for position, future in enumerate(self.order(), 1):
+            if self.owners.get(future) is owner:
+                await self._notify(owner, position)
+                return
+
+    async def _notify(self, owner, position):
+        """Send an owner its position (0 once running), unless it already has it"""
+        if position is None or position == owner.last_position or owner.notify is None:
+            return
+        owner.last_position = position
+        try:
+            await owner.notify(position)
+        except Exception as e:
+            print(f"[SCHEDULER] Queue notification failed: {e}")
+
+    def _positions_changed(self):
+        """Schedule a position update for the waiters left in the queue"""
+        if self.owners and (self._refresh is None or self._refresh.done()):
+            self._refresh = asyncio.ensure_future(self._refresh_positions())
+
+    async def _refresh_positions(self):
+        # Moves within the interval share one update, so a draining queue doesn't flood Discord with edits
+        await asyncio.sleep(self.notify_interval)
+        updates = []
+        seen = set()
+        for position, future in enumerate(self.order(), 1):
+            owner = self.owners.get(future)
+            # An owner with several calls waiting is shown the place of the first
+            if owner is None or id(owner) in seen:
+                continue
+            seen.add(id(owner))
+            if owner.last_position:
+                updates.append(self._notify(owner, position))
+        await asyncio.gather(*updates)
+
+    def _release(self):
+        next_future = self._next_waiter()
+        if next_future is not None:
+            next_future.set_result(None)
+            self._positions_changed()
+        else:
+            self.active -= 1
+
+    def _next_waiter(self):
+        """Pop the next waiter, rotating through guilds and then users"""
+        while self.queues:
+            guild_id, users = next(iter(self.queues.items()))
+            self.queues.move_to_end(guild_id)
+            user_id, futures = next(iter(users.items()))
+            users.move_to_end(user_id)
+            future = futures.popleft()
+            if not futures:
+                del users[user_id]
+            if not users:
+                del self.queues[guild_id]
+            if not future.cancelled():
+                self.waiting -= 1
+                return future
+        return None
+
+    def _discard(self, future):
+        """Remove a cancelled waiter from its queue"""
+        for guild_id, users in list(self.queues.items()):
+            for user_id, futures in list(users.items()):
+                if future in futures:
+                    futures.remove(future)
+                    self.waiting -= 1
+                    if not futures:
+                        del users[user_id]
+                    if not users:
+                        del self.queues[guild_id]
+                    return
+
+    def order(self):
+        """Return the waiting futures in the order they will be served, by replaying the round-robin"""
+        queues = [[list(futures) for futures in users.values()] for users in self.queues.values()]
+        order = []
+        while queues:
+            for users in list(queues):
+                futures = users[0]
+                order.append(futures.pop(0))
+                # Rotate users within the guild, then move on to the next guild
+                users.pop(0)
+                if futures:
+                    users.append(futures)
+                if not users:
+                    queues.remove(users)
+        return order
+
+    def position(self, future):
+        """Return a waiter's 1-based place in line"""
+        order = self.order()
+        return order.index(future) + 1 if future in order else None
+
+    def get_stats(self):
+        return {
+            "max_concurrency": self.max_concurrency,
+            "active": self.active,
+            "waiting": self.waiting,
+            "guilds_waiting": len(self.queues),
+            **self.stats
+        }
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key into one.
+
+    While a call for a key is running, later callers with the same key wait
+    for it and receive its result (or exception) instead of repeating the
+    work. This covers the window before a result is cached, e.g. several
+    people running the same command on a freshly posted image.
+
+    The shared call keeps running if the caller that started it is cancelled,
+    so the others still get their result.
+    """
+
+    def __init__(self):
+        self.in_flight = {}  # key -> future of the running call
+        self.stats = {"calls": 0, "coalesced": 0}
+
+    def running(self, key):
+        return key in self.in_flight
+
+    async def run(self, key, factory, share=None):
+        """
+        Run factory() unless a call for key is already running, and return its result.
+
+        Args:
+            key: Hashable key identifying the work (None disables coalescing)
+            factory: Callable returning the awaitable to run
+            share: Callable applied to the result for callers that joined a running call,
+                   e.g. to give each its own copy of a mutable result (optional)
+        """
+        if key is None:
+            return await factory()
+
+        future = self.in_flight.get(key)
+        if future is not None:
+            self.stats["coalesced"] += 1
+            result = await asyncio.shield(future)
+            return share(result) if share is not None else result
+
+        self.stats["calls"] += 1
+        future = asyncio.ensure_future(factory())
+        self.in_flight[key] = future
+        future.add_done_callback(lambda done: self._finished(key, done))
+        return await asyncio.shield(future)
+
+    def _finished(self, key, future):
+        if self.in_flight.get(key) is future:
+            del self.in_flight[key]
+        # Mark the exception as retrieved in case every caller was cancelled
+        if not future.cancelled():
+            future.exception()
+
+    def get_stats(self):
+        return {"in_flight": len(self.in_flight), **self.stats}
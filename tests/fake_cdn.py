@@ -0,0 +1,91 @@
+import asyncio
+from aiohttp import web
+
+PNG_HEADER = b'\x89PNG\r\n\x1a\n'
+
+class FakeCDN:
+    """
+    Local stand-in for Discord's attachment CDN, served by aiohttp on 127.0.0.1.
+
+    Files are added with serve() and fetched from url(name). Bodies are
+    streamed in chunks without a Content-Length unless one is given, so the
+    downloader's own byte counting is exercised. Requests are counted per
+    file.
+    """
+
+    def __init__(self):
+        self.files = {}
+        self.requests = {}
+        self.base_url = None
+        self._runner = None
+
+    def serve(self, name, body, status=200, content_length=None, delay=0.0, chunk_size=1024, chunk_delay=0.0):
+        """
+        Publish a file.
+
+        Args:
+            name: Path of the file under the CDN's root
+            body: Bytes to send
+            status: HTTP status of the response
+            content_length: Content-Length header to announce, which may differ from the body (optional)
+            delay: Seconds to wait after the headers and before the body
+            chunk_size: Bytes written per chunk
+            chunk_delay: Seconds between chunks
+        """
+        self.files[name] = {
+            "body": body, "status": status, "content_length": content_length, "delay": delay,
+            "chunk_size": chunk_size, "chunk_delay": chunk_delay
+        }
+        return self
+
+    def url(self, name):
+        return f"{self.base_url}/{name}"
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/{name}', self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        self.base_url = f"http://127.0.0.1:{port}"
+        return self
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc_info):
+        await self.stop()
+
+    async def _handle(self, request):
+        name = request.match_info['name']
+        self.requests[name] = self.requests.get(name, 0) + 1
+        file = self.files.get(name)
+        if file is None:
+            return web.Response(status=404)
+        if file["status"] != 200:
+            return web.Response(status=file["status"], body=file["body"])
+
+        response = web.StreamResponse()
+        if file["content_length"] is not None:
+            response.content_length = file["content_length"]
+        try:
+            await response.prepare(request)
+            if file["delay"]:
+                await asyncio.sleep(file["delay"])
+            body = file["body"]
+            for start in range(0, len(body), file["chunk_size"]):
+                await response.write(body[start:start + file["chunk_size"]])
+                if file["chunk_delay"]:
+                    await asyncio.sleep(file["chunk_delay"])
+            await response.write_eof()
+        except ConnectionResetError:
+            # The downloader gave up on the file part way through
+            pass
+        return response
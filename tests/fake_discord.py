@@ -0,0 +1,89 @@
+import itertools
+
+_ids = itertools.count(1)
+
+class FakeChannel:
+    """Stand-in for a Discord channel or thread that keeps every message sent to it"""
+
+    def __init__(self):
+        self.id = next(_ids)
+        self.messages = []
+
+    async def send(self, content=None, **kwargs):
+        message = FakeMessage(self, content, **kwargs)
+        self.messages.append(message)
+        return message
+
+class FakeMessage:
+    """Stand-in for a Discord message that counts its edits"""
+
+    def __init__(self, channel, content=None, **fields):
+        self.id = next(_ids)
+        self.channel = channel
+        self.content = content
+        self.fields = fields
+        self.edits = 0
+        self.deleted = False
+
+    async def edit(self, **fields):
+        self.edits += 1
+        self.content = fields.pop('content', self.content)
+        self.fields.update(fields)
+        return self
+
+    async def delete(self):
+        self.deleted = True
+
+class FakeUser:
+    """Stand-in for a Discord user or member"""
+
+    def __init__(self, bot=False):
+        self.id = next(_ids)
+        self.bot = bot
+        self.mention = f"<@{self.id}>"
+
+def incoming(channel, content, author=None, attachments=()):
+    """A message posted to a channel by someone else, as on_message receives it"""
+    message = FakeMessage(channel, content)
+    message.author = author or FakeUser()
+    message.attachments = list(attachments)
+    message.guild = None
+    return message
+
+class FakeThread(FakeChannel):
+    """Stand-in for a Discord thread"""
+
+    def __init__(self, owner_id=None, archived=False, name=None):
+        super().__init__()
+        self.owner_id = owner_id
+        self.archived = archived
+        self.name = name
+        self.mention = f"<#{self.id}>"
+
+    async def edit(self, **fields):
+        self.name = fields.get('name', self.name)
+        return self
+
+class FakeAttachment:
+    """Stand-in for an image attached to a message"""
+
+    def __init__(self, filename='cat.png', size=1024, content_type='image/png'):
+        self.id = next(_ids)
+        self.filename = filename
+        self.size = size
+        self.content_type = content_type
+        self.url = f"https://cdn.example.com/attachments/{self.id}/{filename}"
+
+class FakeGuild:
+    """Stand-in for a guild, holding its active threads"""
+
+    def __init__(self, threads=()):
+        self.id = next(_ids)
+        self.threads = list(threads)
+
+class FakeThreadPayload:
+    """Stand-in for the payload of a raw thread update or delete event"""
+
+    def __init__(self, thread_id, owner_id=None, archived=False):
+        self.thread_id = thread_id
+        self.data = {'owner_id': str(owner_id) if owner_id else None, 'thread_metadata': {'archived': archived}}
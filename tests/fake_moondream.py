@@ -0,0 +1,102 @@
+import asyncio
+import json
+from collections import deque
+from aiohttp import web
+
+class FakeMoondreamAPI:
+    """
+    Local stand-in for the Moondream API, served by aiohttp on 127.0.0.1.
+
+    Responses are scripted with reply() and served in order to whichever
+    endpoint is called next; once the script runs out every call gets
+    `default`. Each request is recorded as (endpoint, decoded JSON body).
+
+    A reply can be a plain JSON response (any status, e.g. 429 with a
+    Retry-After header), or a server-sent event stream of text chunks that
+    may break off before it completes.
+    """
+
+    def __init__(self, default=None):
+        self.default = default or {"caption": "a cat on a sofa"}
+        self.script = deque()
+        self.requests = []
+        self.url = None
+        self._runner = None
+
+    def reply(self, status=200, body=None, headers=None, delay=0.0, chunks=None, chunk_delay=0.0, complete=True, completed_event=True):
+        """
+        Queue the response for the next call.
+
+        Args:
+            status: HTTP status of a plain response
+            body: JSON body of a plain response (defaults to an error message for non-200s)
+            headers: Extra response headers, e.g. {"Retry-After": "1"}
+            delay: Seconds to wait before answering
+            chunks: Text chunks to stream as server-sent events instead of a plain response
+            chunk_delay: Seconds between streamed chunks
+            complete: Whether the stream ends cleanly or breaks off
+            completed_event: Whether a clean stream sends its completion event before it ends
+        """
+        self.script.append({
+            "status": status, "body": body, "headers": headers or {}, "delay": delay,
+            "chunks": chunks, "chunk_delay": chunk_delay, "complete": complete,
+            "completed_event": completed_event
+        })
+        return self
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post('/v1/{endpoint}', self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        self.url = f"http://127.0.0.1:{port}/v1"
+        return self
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc_info):
+        await self.stop()
+
+    def calls(self, endpoint=None):
+        """Number of requests received, optionally for one endpoint"""
+        return sum(1 for name, _ in self.requests if endpoint is None or name == endpoint)
+
+    async def _handle(self, request):
+        self.requests.append((request.match_info['endpoint'], json.loads(await request.read())))
+        response = self.script.popleft() if self.script else {
+            "status": 200, "body": self.default, "headers": {}, "delay": 0.0, "chunks": None
+        }
+        if response["delay"]:
+            await asyncio.sleep(response["delay"])
+        if response["chunks"] is not None:
+            return await self._stream(request, response)
+
+        body = response["body"]
+        if body is None and response["status"] != 200:
+            body = {"error": f"fake error {response['status']}"}
+        return web.json_response(body, status=response["status"], headers=response["headers"])
+
+    async def _stream(self, request, response):
+        stream = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await stream.prepare(request)
+        for chunk in response["chunks"]:
+            await stream.write(f"data: {json.dumps({'chunk': chunk})}\n\n".encode('utf-8'))
+            if response["chunk_delay"]:
+                await asyncio.sleep(response["chunk_delay"])
+        if not response["complete"]:
+            # Drop the connection mid-stream, as a failing upstream would
+            request.transport.close()
+            return stream
+        if response["completed_event"]:
+            await stream.write(b'data: {"completed": true}\n\n')
+        await stream.write_eof()
+        return stream
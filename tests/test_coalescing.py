@@ -0,0 +1,167 @@
+import asyncio
+import io
+
+import pytest
+from PIL import Image
+
+from fake_cdn import PNG_HEADER, FakeCDN
+from fake_moondream import FakeMoondreamAPI
+from image_cache import FrameCache, ImageCache
+from image_downloader import ImageDownloader
+from moondream_client import EncodedImage, MoondreamClient
+from result_cache import ResultCache
+from scheduler import RequestScheduler, SingleFlight
+
+PAYLOAD = EncodedImage(b'\xff\xd8\xff jpeg')
+
+@pytest.fixture
+def bot(monkeypatch):
+    """The bot module with fresh caches and flights, so tests don't share in-flight work or results"""
+    import bot
+
+    monkeypatch.setattr(bot, 'result_cache', ResultCache(ttl=60, max_entries=100))
+    monkeypatch.setattr(bot, 'image_cache', ImageCache())
+    monkeypatch.setattr(bot, 'frame_cache', FrameCache())
+    monkeypatch.setattr(bot, 'request_scheduler', RequestScheduler(max_concurrency=4))
+    monkeypatch.setattr(bot, 'encode_flights', SingleFlight())
+    monkeypatch.setattr(bot, 'api_flights', SingleFlight())
+    monkeypatch.setattr(bot, 'stream_listeners', {})
+    return bot
+
+def use_api(bot, monkeypatch, api):
+    client = MoondreamClient("key", base_url=api.url, backoff_base=0.01)
+    monkeypatch.setattr(bot, 'moondream_client', client)
+    return client
+
+def test_identical_api_calls_make_one_request(bot, monkeypatch):
+    async def main():
+        async with FakeMoondreamAPI() as api:
+            api.reply(delay=0.05, body={"objects": [{"x_min": 0.1}]})
+            client = use_api(bot, monkeypatch, api)
+            try:
+                results = await asyncio.gather(*(
+                    bot.call_moondream_api('detect', PAYLOAD, {"object": "cat"}, image_hash='a' * 32) for _ in range(5)
+                ))
+            finally:
+                await client.close()
+            return api, results
+
+    api, results = asyncio.run(main())
+    assert api.calls() == 1
+    assert all(result == {"objects": [{"x_min": 0.1}]} for result in results)
+    assert bot.api_flights.stats == {"calls": 1, "coalesced": 4}
+
+def test_different_calls_are_not_coalesced(bot, monkeypatch):
+    async def main():
+        async with FakeMoondreamAPI() as api:
+            client = use_api(bot, monkeypatch, api)
+            try:
+                await asyncio.gather(
+                    bot.call_moondream_api('detect', PAYLOAD, {"object": "cat"}, image_hash='a' * 32),
+                    bot.call_moondream_api('detect', PAYLOAD, {"object": "dog"}, image_hash='a' * 32),
+                    bot.call_moondream_api('detect', PAYLOAD, {"object": "cat"}, image_hash='b' * 32),
+                )
+            finally:
+                await client.close()
+            return api
+
+    assert asyncio.run(main()).calls() == 3
+
+def test_late_joiner_follows_the_stream(bot, monkeypatch):
+    async def main():
+        async with FakeMoondreamAPI() as api:
+            api.reply(chunks=["A cat", " on", " a sofa."], chunk_delay=0.05)
+            client = use_api(bot, monkeypatch, api)
+            leader_seen, joiner_seen = [], []
+            try:
+                leader = asyncio.create_task(bot.call_moondream_api('caption', PAYLOAD, {"length": "normal"}, image_hash='a' * 32, on_chunk=leader_seen.append))
+                while not leader_seen:
+                    await asyncio.sleep(0.01)
+                joiner = await bot.call_moondream_api('caption', PAYLOAD, {"length": "normal"}, image_hash='a' * 32, on_chunk=joiner_seen.append)
+                leader = await leader
+            finally:
+                await client.close()
+            return api, leader_seen, joiner_seen, leader, joiner
+
+    api, leader_seen, joiner_seen, leader, joiner = asyncio.run(main())
+    assert api.calls() == 1
+    assert leader_seen == ["A cat", "A cat on", "A cat on a sofa."]
+    # The joiner starts from the text shown so far and follows the rest
+    assert joiner_seen == ["A cat", "A cat on", "A cat on a sofa."]
+    assert leader == joiner == {"caption": "A cat on a sofa."}
+    assert not bot.stream_listeners
+
+def test_cancelling_the_leader_keeps_the_call_for_joiners(bot, monkeypatch):
+    async def main():
+        async with FakeMoondreamAPI() as api:
+            api.reply(delay=0.1, body={"caption": "a cat"})
+            client = use_api(bot, monkeypatch, api)
+            try:
+                leader = asyncio.create_task(bot.call_moondream_api('caption', PAYLOAD, image_hash='a' * 32))
+                await asyncio.sleep(0.02)
+                joiner = asyncio.create_task(bot.call_moondream_api('caption', PAYLOAD, image_hash='a' * 32))
+                await asyncio.sleep(0.02)
+                leader.cancel()
+                result = await joiner
+            finally:
+                await client.close()
+            return api, leader, result
+
+    api, leader, result = asyncio.run(main())
+    assert leader.cancelled()
+    assert result == {"caption": "a cat"}
+    assert api.calls() == 1
+    # The finished call still filled the cache
+    assert bot.result_cache.get(bot.ResultCache.make_key('a' * 32, 'caption', None)) == {"caption": "a cat"}
+
+def test_exception_reaches_every_waiter():
+    async def main():
+        flights = SingleFlight()
+        gate = asyncio.Event()
+
+        async def fail():
+            await gate.wait()
+            raise ValueError("broken image")
+
+        waiters = [asyncio.create_task(flights.run('key', fail)) for _ in range(3)]
+        await asyncio.sleep(0)
+        gate.set()
+        results = await asyncio.gather(*waiters, return_exceptions=True)
+        return flights, results
+
+    flights, results = asyncio.run(main())
+    assert [type(result) for result in results] == [ValueError] * 3
+    assert flights.stats == {"calls": 1, "coalesced": 2}
+    # The key is free again, so the next call runs afresh
+    assert not flights.in_flight
+
+def test_identical_downloads_make_one_request():
+    async def main():
+        async with FakeCDN() as cdn:
+            cdn.serve('cat.png', PNG_HEADER + b'\x00' * 500, delay=0.05)
+            downloader = ImageDownloader()
+            try:
+                buffers = await asyncio.gather(*(downloader.download(cdn.url('cat.png')) for _ in range(4)))
+            finally:
+                await downloader.close()
+            return cdn, buffers
+
+    cdn, buffers = asyncio.run(main())
+    assert cdn.requests == {'cat.png': 1}
+    assert len({id(buffer) for buffer in buffers}) == 4
+    buffers[0].read()
+    # Each caller reads its own position
+    assert all(buffer.tell() == 0 for buffer in buffers[1:])
+
+def test_identical_encodes_run_once(bot):
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 48), (200, 30, 30)).save(buffer, 'PNG')
+    image_bytes = buffer.getvalue()
+
+    async def main():
+        return await asyncio.gather(*(bot.encode_image(io.BytesIO(image_bytes)) for _ in range(4)))
+
+    results = asyncio.run(main())
+    assert len({key for key, _ in results}) == 1
+    assert len({jpeg for _, jpeg in results}) == 1
+    assert bot.encode_flights.stats["calls"] == 1
@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+
+from command_router import CommandRouter
+from fake_discord import FakeChannel, incoming
+
+@pytest.fixture
+def router():
+    router = CommandRouter('!')
+    router.add('caption', ['caption', 'c'])
+    router.add('query', ['query', 'q'])
+    router.add('moondream', ['md'], dispatches=True)
+    router.add('help')
+    return router
+
+def fields(route):
+    return route and (route.command, route.endpoint, route.parameter, route.target)
+
+def test_aliases_route_to_their_command(router):
+    assert fields(router.route("!c")) == ('caption', 'c', None, 'caption')
+    assert fields(router.route("!caption")) == ('caption', 'caption', None, 'caption')
+    assert fields(router.route("!q what is this?")) == ('query', 'q', 'what is this?', 'query')
+
+def test_dispatching_command_resolves_its_target(router):
+    assert fields(router.route("!md q what is this?")) == ('moondream', 'q', 'what is this?', 'query')
+    assert fields(router.route("!moondream caption")) == ('moondream', 'caption', None, 'caption')
+    # Unknown targets, and the dispatcher naming itself, run nothing
+    assert fields(router.route("!md frobnicate now")) == ('moondream', 'frobnicate', 'now', None)
+    assert fields(router.route("!md md")) == ('moondream', 'md', None, None)
+
+def test_bare_dispatching_command_has_no_target(router):
+    assert fields(router.route("!md")) == ('moondream', None, None, None)
+    assert fields(router.route("!moondream  ")) == ('moondream', None, None, None)
+
+def test_names_ignore_case_but_parameters_keep_it(router):
+    assert fields(router.route("!Q Is this the US?")) == ('query', 'q', 'Is this the US?', 'query')
+    assert fields(router.route("!MD C")) == ('moondream', 'c', None, 'caption')
+
+def test_multi_line_parameters_are_kept_whole(router):
+    assert router.route("!q first line\nsecond line\n").parameter == "first line\nsecond line"
+
+def test_leading_whitespace_is_allowed(router):
+    assert fields(router.route("  !c")) == ('caption', 'c', None, 'caption')
+
+def test_chatter_is_not_a_command(router):
+    for content in ["hello", "", "   ", "what does !c do?", "!", "! c"]:
+        assert router.route(content) is None, content
+
+def test_unknown_command_is_flagged(router):
+    assert fields(router.route("!cache_stats")) == (None, 'cache_stats', None, None)
+
+def on_message(monkeypatch, content):
+    """Post a message in an ordinary channel and return what the bot did with it"""
+    import bot
+
+    channel = FakeChannel()
+    handled = []
+
+    async def send_detailed_help(target):
+        handled.append(('help', target))
+
+    async def process_commands(message):
+        handled.append(('commands', message))
+
+    async def moondream(ctx, endpoint=None, *, parameter=None):
+        handled.append(('moondream', endpoint, parameter))
+
+    async def get_context(message):
+        return message
+
+    monkeypatch.setattr(bot, 'moondream_threads', set())
+    monkeypatch.setattr(bot, 'send_detailed_help', send_detailed_help)
+    monkeypatch.setattr(bot, 'moondream', moondream)
+    monkeypatch.setattr(bot.bot, 'process_commands', process_commands)
+    monkeypatch.setattr(bot.bot, 'get_context', get_context)
+    message = incoming(channel, content)
+    asyncio.run(bot.on_message(message))
+    return channel, message, handled
+
+def test_channel_help_shows_the_command_reference(monkeypatch):
+    channel, message, handled = on_message(monkeypatch, "!help")
+    assert handled == [('help', channel)]
+
+def test_channel_images_is_ignored(monkeypatch):
+    channel, message, handled = on_message(monkeypatch, "!images")
+    assert handled == []
+
+def test_channel_image_commands_run_the_canonical_command(monkeypatch):
+    assert on_message(monkeypatch, "!d cat, dog")[2] == [('moondream', 'detect', 'cat, dog')]
+    assert on_message(monkeypatch, "!md Q why?")[2] == [('moondream', 'query', 'why?')]
+    assert on_message(monkeypatch, "!md")[2] == [('moondream', None, None)]
+
+def test_channel_admin_commands_go_to_the_command_system(monkeypatch):
+    channel, message, handled = on_message(monkeypatch, "!cache_stats")
+    assert handled == [('commands', message)]
+
+def test_channel_chatter_is_ignored(monkeypatch):
+    assert on_message(monkeypatch, "nice picture")[2] == []
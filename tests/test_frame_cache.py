@@ -0,0 +1,96 @@
+import asyncio
+import io
+
+import pytest
+from PIL import Image
+
+from image_cache import FrameCache, ImageCache
+
+BOXES = [{"x_min": 0.1, "y_min": 0.1, "x_max": 0.6, "y_max": 0.7}]
+POINTS = [{"x": 0.5, "y": 0.5}]
+
+def png_bytes():
+    buffer = io.BytesIO()
+    Image.new('RGB', (120, 80), 'orange').save(buffer, 'PNG')
+    buffer.seek(0)
+    return buffer
+
+@pytest.fixture
+def bot(monkeypatch):
+    """The bot module with fresh image caches and a count of every decode"""
+    import bot
+
+    monkeypatch.setattr(bot, 'image_cache', ImageCache())
+    monkeypatch.setattr(bot, 'frame_cache', FrameCache())
+    monkeypatch.setattr(bot, 'decodes', [], raising=False)
+
+    def counted(name):
+        decode = getattr(bot, name)
+
+        def wrapper(*args, **kwargs):
+            bot.decodes.append(name)
+            return decode(*args, **kwargs)
+        return wrapper
+
+    for name in ('optimize_image_load', 'decode_payload'):
+        monkeypatch.setattr(bot, name, counted(name))
+    return bot
+
+def test_commands_on_one_image_decode_it_once(bot):
+    async def main():
+        # The first command encodes the image; it and the next command draw on the kept frame
+        key, _ = await bot.encode_image(image_bytes=png_bytes())
+        first = await bot.get_image_frame(key)
+        second = await bot.get_image_frame(key)
+        return first, second
+
+    first, second = asyncio.run(main())
+    assert bot.decodes == ['optimize_image_load']
+    assert first is second
+    assert first.size == (120, 80)
+    assert bot.frame_cache.get_stats()['hits'] == 2
+
+def test_evicted_frame_is_rebuilt_from_the_cached_payload(bot):
+    async def main():
+        key, _ = await bot.encode_image(image_bytes=png_bytes())
+        bot.frame_cache.clear()
+        # No bytes or URL: the original can't be read again, and isn't needed
+        first = await bot.get_image_frame(key)
+        second = await bot.get_image_frame(key)
+        return first, second
+
+    first, second = asyncio.run(main())
+    assert bot.decodes == ['optimize_image_load', 'decode_payload']
+    assert first is second
+    assert first.size == (120, 80) and first.mode == 'RGB'
+
+def test_drawing_leaves_the_cached_frame_untouched(bot):
+    async def main():
+        key, _ = await bot.encode_image(image_bytes=png_bytes())
+        return key, await bot.get_image_frame(key)
+
+    key, frame = asyncio.run(main())
+    pixels = frame.tobytes()
+    boxes = bot.visualize_bounding_boxes(frame, BOXES)
+    points = bot.visualize_points(frame, POINTS)
+
+    assert frame.tobytes() == pixels
+    assert bot.frame_cache.get(key) is frame
+    # The drawings themselves did change the pixels
+    assert Image.open(boxes).convert('RGB').tobytes() != pixels
+    assert Image.open(points).convert('RGB').tobytes() != pixels
+
+def test_frames_are_evicted_by_decoded_size():
+    frame = Image.new('RGB', (10, 10))
+    cache = FrameCache(max_bytes=2 * FrameCache.frame_size(frame))
+    cache.put('a' * 32, frame)
+    cache.put('b' * 32, frame)
+    cache.get('a' * 32)
+    cache.put('c' * 32, frame)
+
+    assert list(cache.cache) == ['a' * 32, 'c' * 32]
+    assert cache.total_bytes == 600
+    assert cache.get_stats()['evictions'] == 1
+    # A frame bigger than the whole budget is not kept
+    cache.put('d' * 32, Image.new('RGB', (20, 20)))
+    assert cache.get('d' * 32) is None
@@ -0,0 +1,140 @@
+import json
+import os
+import sys
+
+from image_cache import DiskCacheTier, ImageCache
+
+def read_index(directory):
+    with open(os.path.join(directory, DiskCacheTier.INDEX_FILE)) as f:
+        return json.load(f)
+
+def test_put_defers_the_index_to_flush(tmp_path):
+    disk = DiskCacheTier(str(tmp_path), max_bytes=1024)
+    disk.load()
+    disk.put('a' * 32, b'jpeg bytes', ['cdn.example.com/a.png'])
+    assert read_index(tmp_path)['entries'] == []
+
+    assert disk.flush()
+    assert read_index(tmp_path) == {'entries': [['a' * 32, 10]], 'aliases': {'cdn.example.com/a.png': 'a' * 32}}
+    # Nothing changed since, so nothing is written
+    assert not disk.flush()
+
+def test_recency_and_aliases_are_flushed(tmp_path):
+    disk = DiskCacheTier(str(tmp_path), max_bytes=1024)
+    disk.load()
+    disk.put('a' * 32, b'first')
+    disk.put('b' * 32, b'second')
+    disk.flush()
+
+    disk.get('a' * 32)
+    disk.add_alias('https://cdn.example.com/b.png?ex=1', 'b' * 32)
+    assert disk.flush()
+    index = read_index(tmp_path)
+    assert [key for key, size in index['entries']] == ['b' * 32, 'a' * 32]
+    assert index['aliases'] == {'cdn.example.com/b.png': 'b' * 32}
+
+def test_entries_written_after_the_last_flush_are_dropped_on_load(tmp_path):
+    disk = DiskCacheTier(str(tmp_path), max_bytes=1024)
+    disk.load()
+    disk.put('a' * 32, b'kept')
+    disk.flush()
+    # A crash before the next flush leaves this file out of the index
+    disk.put('b' * 32, b'lost')
+
+    reloaded = DiskCacheTier(str(tmp_path), max_bytes=1024)
+    assert reloaded.load() == 1
+    assert reloaded.get('a' * 32) == b'kept'
+    assert not os.path.exists(os.path.join(tmp_path, 'b' * 32 + DiskCacheTier.ENTRY_SUFFIX))
+
+def test_eviction_keeps_the_budget(tmp_path):
+    disk = DiskCacheTier(str(tmp_path), max_bytes=10)
+    disk.load()
+    disk.put('a' * 32, b'123456')
+    disk.put('b' * 32, b'123456')
+    assert disk.total_bytes == 6
+    assert disk.get('a' * 32) is None
+
+def test_entries_are_stored_whatever_their_format(tmp_path):
+    webp = b'RIFF\x00\x00\x00\x00WEBPVP8 '
+    disk = DiskCacheTier(str(tmp_path), max_bytes=1024)
+    disk.load()
+    disk.put('a' * 32, webp)
+    disk.flush()
+    assert sorted(os.listdir(tmp_path)) == ['a' * 32 + '.bin', DiskCacheTier.INDEX_FILE]
+
+    reloaded = DiskCacheTier(str(tmp_path), max_bytes=1024)
+    assert reloaded.load() == 1
+    assert reloaded.get('a' * 32) == webp
+
+def test_orphans_are_swept(tmp_path):
+    disk = DiskCacheTier(str(tmp_path), max_bytes=1024)
+    disk.load()
+    disk.put('a' * 32, b'kept')
+    disk.flush()
+    for name in ('b' * 32 + '.bin', 'd' * 32 + '.tmp'):
+        (tmp_path / name).write_bytes(b'left over')
+
+    reloaded = DiskCacheTier(str(tmp_path), max_bytes=1024)
+    assert reloaded.load() == 1
+    assert sorted(os.listdir(tmp_path)) == ['a' * 32 + '.bin', DiskCacheTier.INDEX_FILE]
+
+def image(fill, size=100):
+    return bytes([fill]) * size
+
+def test_memory_tier_evicts_by_bytes():
+    entry_bytes = sys.getsizeof(image(1))
+    cache = ImageCache(max_bytes=2 * entry_bytes)
+    cache.put('a' * 32, image(1))
+    cache.put('b' * 32, image(2))
+    # Using the first entry makes the second the least recently used
+    assert cache.get('a' * 32) == image(1)
+    cache.put('c' * 32, image(3))
+
+    assert list(cache.cache) == ['a' * 32, 'c' * 32]
+    assert cache.total_bytes == 2 * entry_bytes
+    assert cache.get_stats()['evictions'] == 1
+    # An entry larger than the whole budget is not stored and evicts nothing
+    cache.put('d' * 32, image(4, size=3 * entry_bytes))
+    assert list(cache.cache) == ['a' * 32, 'c' * 32]
+
+def test_alias_of_an_evicted_entry_falls_back_to_disk(tmp_path):
+    entry_bytes = sys.getsizeof(image(1))
+    url = 'https://cdn.example.com/attachments/1/a.png?ex=1&hm=2'
+    cache = ImageCache(max_bytes=entry_bytes)
+    cache.put('a' * 32, image(1), url=url)
+    cache.put('b' * 32, image(2))
+    # The alias went with the evicted entry, so it can't point at nothing
+    assert cache.lookup_url(url) is None
+    assert cache.get('a' * 32) is None
+
+    disk = DiskCacheTier(str(tmp_path), max_bytes=1024)
+    disk.load()
+    cache = ImageCache(max_bytes=entry_bytes, disk=disk)
+    cache.put('a' * 32, image(1), url=url)
+    disk.put('a' * 32, image(1), ['cdn.example.com/attachments/1/a.png'])
+    cache.put('b' * 32, image(2))
+    # Evicted from memory but still on disk: the URL resolves without a download
+    assert cache.lookup_url(url.replace('hm=2', 'hm=3')) == 'a' * 32
+    assert cache.get('a' * 32) is None
+    assert cache.on_disk('a' * 32)
+    assert cache.get_stats()['misses'] == 0
+
+def test_one_image_under_two_urls_shares_an_entry():
+    entry_bytes = sys.getsizeof(image(1))
+    cache = ImageCache(max_bytes=entry_bytes)
+    first = 'https://cdn.example.com/attachments/1/cat.png?ex=1'
+    second = 'https://cdn.example.com/attachments/2/cat-again.png?ex=2'
+    cache.put('a' * 32, image(1), url=first)
+    # The same bytes uploaded again hash the same and only gain an alias
+    assert cache.add_alias(second, 'a' * 32)
+
+    assert cache.lookup_url(first) == cache.lookup_url(second) == 'a' * 32
+    assert len(cache.cache) == 1
+    assert cache.total_bytes == entry_bytes
+    assert cache.get_stats()['aliases'] == 2
+    # Both aliases go when the entry does
+    cache.put('b' * 32, image(2))
+    assert cache.lookup_url(first) is None and cache.lookup_url(second) is None
+    assert not cache.aliases
+    # An alias can't be added for an entry that isn't stored
+    assert not cache.add_alias(first, 'a' * 32)
@@ -0,0 +1,164 @@
+import asyncio
+import io
+import time
+
+import pytest
+
+from fake_cdn import PNG_HEADER, FakeCDN
+from image_downloader import ImageDownloader, ImageDownloadError, LazyImage, looks_like_image
+
+IMAGE = PNG_HEADER + b'\x00' * 500
+
+async def fetch(cdn, name, expected_size=None, **options):
+    """Download one file from the fake CDN with a fresh downloader"""
+    downloader = ImageDownloader(**options)
+    try:
+        return await downloader.download(cdn.url(name), expected_size)
+    finally:
+        await downloader.close()
+
+def download(name, expected_size=None, files=(), **options):
+    """Serve files (name, body, serve() options) and download one of them; return the CDN and the result or error"""
+    async def main():
+        async with FakeCDN() as cdn:
+            for file_name, body, serve_options in files:
+                cdn.serve(file_name, body, **serve_options)
+            try:
+                result = await fetch(cdn, name, expected_size, **options)
+            except ImageDownloadError as e:
+                result = e
+            return cdn, result
+
+    return asyncio.run(main())
+
+def test_image_is_downloaded():
+    cdn, result = download('cat.png', files=[('cat.png', IMAGE, {'chunk_size': 64})], chunk_size=32)
+    assert result.getvalue() == IMAGE
+    assert result.tell() == 0
+
+def test_stream_over_the_byte_cap_is_rejected():
+    # No Content-Length, so the cap is enforced while reading
+    cdn, result = download('big.png', files=[('big.png', IMAGE, {'chunk_size': 64})], max_bytes=200, chunk_size=64)
+    assert isinstance(result, ImageDownloadError)
+    assert "too large" in str(result)
+
+def test_content_length_over_the_cap_is_rejected_before_the_body():
+    async def main():
+        async with FakeCDN() as cdn:
+            # The body would only arrive after a second
+            cdn.serve('big.png', IMAGE, content_length=len(IMAGE), delay=1.0)
+            started = time.monotonic()
+            with pytest.raises(ImageDownloadError, match="too large"):
+                await fetch(cdn, 'big.png', max_bytes=200)
+            return time.monotonic() - started
+
+    assert asyncio.run(main()) < 0.5
+
+def test_attachment_size_over_the_cap_is_rejected_without_a_request():
+    cdn, result = download('big.png', expected_size=10_000, files=[('big.png', IMAGE, {})], max_bytes=200)
+    assert isinstance(result, ImageDownloadError)
+    assert cdn.requests == {}
+
+def test_non_image_is_rejected_from_the_first_chunk():
+    page = b'<!DOCTYPE html>' + b'x' * 10_000
+    async def main():
+        async with FakeCDN() as cdn:
+            # The rest of the page trickles in slowly, so reading it all would take seconds
+            cdn.serve('page.png', page, chunk_size=100, chunk_delay=0.05)
+            started = time.monotonic()
+            with pytest.raises(ImageDownloadError, match="does not appear to be an image"):
+                await fetch(cdn, 'page.png', chunk_size=100)
+            return time.monotonic() - started
+
+    assert asyncio.run(main()) < 0.5
+
+def test_short_non_image_is_rejected():
+    cdn, result = download('note.png', files=[('note.png', b'hello', {})])
+    assert "does not appear to be an image" in str(result)
+
+def test_http_errors_are_reported():
+    cdn, result = download('gone.png', files=[('gone.png', b'', {'status': 404})])
+    assert isinstance(result, ImageDownloadError)
+    assert "HTTP 404" in str(result)
+
+def test_image_signatures():
+    assert looks_like_image(b'\xff\xd8\xff\xe0\x00\x10JFIF')
+    assert looks_like_image(b'RIFF\x00\x00\x00\x00WEBPVP8 ')
+    assert looks_like_image(b'GIF89a\x01\x00')
+    assert not looks_like_image(b'RIFF\x00\x00\x00\x00WAVEfmt ')
+    assert not looks_like_image(b'%PDF-1.7\n')
+
+def test_bmp_needs_a_dib_header():
+    from PIL import Image
+
+    for mode in ('RGB', 'P', '1'):
+        bmp = io.BytesIO()
+        Image.new(mode, (4, 4)).save(bmp, 'BMP')
+        assert looks_like_image(bmp.getvalue()[:18])
+    # Text and binary data that merely start with "BM"
+    assert not looks_like_image(b'BMW service history, 2019-2024')
+    assert not looks_like_image(b'BM\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xff\xff\xff\xff')
+    assert not looks_like_image(b'BM')
+
+def test_text_starting_with_bm_is_rejected():
+    cdn, result = download('notes.bmp', files=[('notes.bmp', b'BMW service history\n' * 20, {})])
+    assert "does not appear to be an image" in str(result)
+
+def test_lazy_image_downloads_on_first_read_only():
+    async def main():
+        async with FakeCDN() as cdn:
+            cdn.serve('cat.png', IMAGE, delay=0.05)
+            downloader = ImageDownloader()
+            try:
+                image = LazyImage(downloader, cdn.url('cat.png'))
+                before = dict(cdn.requests)
+                # Concurrent readers share the first download
+                first, second = await asyncio.gather(image.read(), image.read())
+                first.read()
+                later = await image.read()
+            finally:
+                await downloader.close()
+            return cdn, before, first, second, later
+
+    cdn, before, first, second, later = asyncio.run(main())
+    assert before == {}
+    assert cdn.requests == {'cat.png': 1}
+    assert first is second is later
+    # Every read starts at the beginning
+    assert later.tell() == 0
+    assert later.getvalue() == IMAGE
+
+def test_lazy_image_with_bytes_never_downloads():
+    async def main():
+        downloader = ImageDownloader()
+        image = LazyImage(downloader, 'http://127.0.0.1:9/unreachable.png', data=io.BytesIO(IMAGE))
+        data = await image.read()
+        return downloader, data
+
+    downloader, data = asyncio.run(main())
+    assert data.getvalue() == IMAGE
+    assert downloader.flights.stats["calls"] == 0
+
+def test_lazy_image_failures_reach_the_caller_and_can_be_retried():
+    async def main():
+        async with FakeCDN() as cdn:
+            cdn.serve('cat.png', b'', status=503)
+            downloader = ImageDownloader()
+            try:
+                image = LazyImage(downloader, cdn.url('cat.png'))
+                with pytest.raises(ImageDownloadError, match="HTTP 503"):
+                    await image.read()
+                # The CDN recovers, and the next read downloads again
+                cdn.serve('cat.png', IMAGE)
+                data = await image.read()
+            finally:
+                await downloader.close()
+            return cdn, data
+
+    cdn, data = asyncio.run(main())
+    assert data.getvalue() == IMAGE
+    assert cdn.requests == {'cat.png': 2}
+
+def test_lazy_image_without_a_url_reports_it_is_gone():
+    with pytest.raises(ImageDownloadError, match="no longer available"):
+        asyncio.run(LazyImage(ImageDownloader(), None).read())
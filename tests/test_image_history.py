@@ -0,0 +1,82 @@
+import asyncio
+import datetime
+
+from fake_discord import FakeAttachment, FakeChannel, incoming
+from thread_store import ImageHistory, ThreadStore
+
+def test_image_reference_is_split_off_the_parameter():
+    import bot
+
+    assert bot.parse_image_reference("#2 what changed?") == (2, "what changed?")
+    assert bot.parse_image_reference("#12") == (12, None)
+    assert bot.parse_image_reference("what is #2?") == (None, "what is #2?")
+    assert bot.parse_image_reference("#2nd car") == (None, "#2nd car")
+    assert bot.parse_image_reference(None) == (None, None)
+
+def test_images_keep_their_number_after_falling_out():
+    history = ImageHistory(max_size=2)
+    for name in ('a.png', 'b.png', 'c.png'):
+        history.add(f'https://cdn.example.com/{name}', name)
+    assert history.get(1) is None
+    assert history.get(2).filename == 'b.png'
+    assert history.latest().number == 3
+    restored = ImageHistory.from_dict(history.to_dict())
+    assert [record.number for record in restored] == [2, 3]
+    assert restored.add('https://cdn.example.com/d.png', 'd.png').number == 4
+
+def run_in_thread(monkeypatch, tmp_path, content):
+    """Send a command to a Moondream thread holding two images; return the thread, the message and the commands run"""
+    import bot
+
+    thread = FakeChannel()
+    history = ImageHistory()
+    history.add('https://cdn.example.com/cat.png', 'cat.png', content_hash='a' * 32)
+    history.add('https://cdn.example.com/dog.png', 'dog.png', content_hash='b' * 32)
+    store = ThreadStore(path=str(tmp_path / 'threads.db'))
+    store[thread.id] = {'timestamp': datetime.datetime.now(), 'history': history}
+    monkeypatch.setattr(bot, 'thread_images', store)
+    monkeypatch.setattr(bot, 'moondream_threads', {thread.id})
+
+    processed = []
+
+    async def process_image_in_thread(thread, image_bytes, filename, endpoint, parameter, **kwargs):
+        processed.append((filename, endpoint, parameter, kwargs['image_hash'], kwargs['image_number'], kwargs['alias']))
+
+    monkeypatch.setattr(bot, 'process_image_in_thread', process_image_in_thread)
+    message = incoming(thread, content)
+    asyncio.run(bot.on_message(message))
+    return thread, message, processed
+
+def test_reference_targets_an_earlier_image(monkeypatch, tmp_path):
+    thread, message, processed = run_in_thread(monkeypatch, tmp_path, "!q #1 what color is it?")
+    assert processed == [('cat.png', 'query', 'what color is it?', 'a' * 32, 1, 'q')]
+    assert message.deleted
+
+def test_command_without_reference_uses_the_latest_image(monkeypatch, tmp_path):
+    thread, message, processed = run_in_thread(monkeypatch, tmp_path, "!d cat")
+    assert processed == [('dog.png', 'detect', 'cat', 'b' * 32, None, 'd')]
+
+def test_reference_out_of_range_is_reported(monkeypatch, tmp_path):
+    thread, message, processed = run_in_thread(monkeypatch, tmp_path, "!c #5")
+    assert processed == []
+    assert [sent.content for sent in thread.messages] == [
+        "I can't find image #5 in this thread. Use `!images` to see the images I remember."
+    ]
+    assert message.deleted
+
+def test_unreadable_upload_is_reported(monkeypatch, tmp_path):
+    import io
+    import bot
+
+    async def download_image_bytes(url, expected_size=None):
+        # Passes the signature sniff, but isn't a JPEG PIL can open
+        return io.BytesIO(b'\xff\xd8\xff' + b'not really a jpeg' * 10)
+    monkeypatch.setattr(bot, 'download_image_bytes', download_image_bytes)
+    thread = FakeChannel()
+    monkeypatch.setattr(bot, 'thread_images', ThreadStore(path=str(tmp_path / 'threads.db')))
+    monkeypatch.setattr(bot, 'moondream_threads', {thread.id})
+
+    for content in ("", "!c"):
+        asyncio.run(bot.on_message(incoming(thread, content, attachments=[FakeAttachment()])))
+    assert [sent.content for sent in thread.messages] == ["Error: I couldn't read this image."] * 2
+    assert thread.id not in bot.thread_images
@@ -0,0 +1,67 @@
+import io
+
+import pytest
+from PIL import Image
+
+import bot
+
+def encoded(image, format, **params):
+    buffer = io.BytesIO()
+    image.save(buffer, format, **params)
+    buffer.seek(0)
+    return buffer
+
+def test_exif_orientation_is_applied():
+    # A landscape sensor image of a portrait photo, tagged "rotate 90° clockwise to display"
+    image = Image.new('RGB', (40, 20), 'blue')
+    image.paste((255, 0, 0), (0, 0, 20, 20))
+    exif = Image.Exif()
+    exif[0x0112] = 6
+
+    frame = bot.optimize_image_load(encoded(image, 'JPEG', exif=exif.tobytes(), quality=95))
+    assert frame.size == (20, 40)
+    assert frame.mode == 'RGB'
+    # The red left half ends up on top
+    red, green, blue = frame.getpixel((10, 5))
+    assert red > 200 and blue < 60
+
+def test_transparency_is_flattened_onto_white():
+    image = Image.new('RGBA', (10, 10), (0, 0, 0, 0))
+    image.paste((255, 0, 0, 255), (0, 0, 5, 10))
+
+    frame = bot.optimize_image_load(encoded(image, 'PNG'))
+    assert frame.mode == 'RGB'
+    assert frame.getpixel((8, 5)) == (255, 255, 255)
+    assert frame.getpixel((2, 5)) == (255, 0, 0)
+
+def test_palette_transparency_is_flattened_onto_white():
+    image = Image.new('P', (10, 10), 0)
+    image.putpalette([0, 0, 0, 255, 0, 0])
+    image.paste(1, (0, 0, 5, 10))
+
+    frame = bot.optimize_image_load(encoded(image, 'PNG', transparency=0))
+    assert frame.getpixel((8, 5)) == (255, 255, 255)
+    assert frame.getpixel((2, 5)) == (255, 0, 0)
+
+@pytest.mark.parametrize("format", ['JPEG', 'PNG'])
+def test_longest_side_is_clamped(format):
+    image = Image.new('RGB', (4000, 1000), 'green')
+
+    frame = bot.optimize_image_load(encoded(image, format), max_side=1000)
+    assert frame.size == (1000, 250)
+
+def test_small_images_keep_their_size():
+    image = Image.new('RGB', (300, 200), 'green')
+    assert bot.optimize_image_load(encoded(image, 'JPEG'), max_side=1000).size == (300, 200)
+    # 0 turns the clamp off
+    assert bot.optimize_image_load(encoded(Image.new('RGB', (4000, 1000)), 'PNG'), max_side=0).size == (4000, 1000)
+
+def test_payload_mime_type_follows_its_format(monkeypatch):
+    image = Image.new('RGB', (32, 32), 'green')
+    monkeypatch.setattr(bot, 'IMAGE_PAYLOAD_FORMAT', 'webp')
+    webp = bot.encode_image_payload(image=image)
+    monkeypatch.setattr(bot, 'IMAGE_PAYLOAD_FORMAT', 'jpeg')
+    jpeg = bot.encode_image_payload(image=image)
+
+    assert bot.prepare_payload(webp).data_url.startswith(b"data:image/webp;base64,")
+    assert bot.prepare_payload(jpeg).data_url.startswith(b"data:image/jpeg;base64,")
@@ -0,0 +1,202 @@
+import asyncio
+import math
+import random
+import re
+from collections import OrderedDict
+
+import pytest
+
+from fake_discord import FakeChannel
+from message_splitter import (
+    DISCORD_SAFE_LIMIT, FENCE_PATTERN, MARKUP_RESERVE, ZERO_WIDTH_SPACE, MessageSplitter, ProgressiveMessage, find_split, scan_markdown, split_markdown
+)
+from outbox import outbox
+
+# Literal asterisks ("2 * 3") are left out: one that lands exactly at a cut can
+# still be read as a marker, a known gap of the splitter
+WORDS = "the quick brown fox jumps over lazy dog snake_case 2 3 a.b".split()
+INLINE_MARKERS = ["**", "*", "_", "~~", "`", "||", "__"]
+LIMITS = [50, 200, 1900]
+CASES = 3000
+
+def random_words(rng, low, high):
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(low, high)))
+
+def random_markdown(rng, length):
+    """Random Markdown mixing paragraphs, code blocks, inline formatting and unbreakable runs"""
+    blocks = []
+    size = 0
+    while size < length:
+        kind = rng.random()
+        if kind < 0.05:
+            lines = "\n".join(random_words(rng, 1, 15) for _ in range(rng.randint(1, 60)))
+            block = f"\n```{rng.choice(['', 'python', 'json'])}\n{lines}\n```\n"
+        elif kind < 0.1:
+            block = "\n\n"
+        elif kind < 0.2:
+            marker = rng.choice(INLINE_MARKERS)
+            block = f"{marker}{random_words(rng, 1, 40)}{marker} "
+        elif kind < 0.25:
+            block = "x" * rng.randint(100, 3000) + " "
+        else:
+            block = random_words(rng, 1, 30) + rng.choice([". ", "! ", "\n", " "])
+        blocks.append(block)
+        size += len(block)
+    return "".join(blocks)
+
+def visible_text(text):
+    """The text once fence lines, Markdown markers and whitespace are ignored"""
+    text = "\n".join(line for line in text.split("\n") if not FENCE_PATTERN.match(line))
+    return re.sub(rf"[\s*_~|`{ZERO_WIDTH_SPACE}]", "", text)
+
+def generate_cases():
+    rng = random.Random(1)
+    cases = []
+    for _ in range(CASES):
+        limit = rng.choice(LIMITS)
+        content = random_markdown(rng, rng.randint(1, 20000 if limit == 1900 else 3000))
+        cases.append((content, limit, split_markdown(content, limit)))
+    return cases
+
+@pytest.fixture(scope="module")
+def cases():
+    return generate_cases()
+
+def test_chunks_fit_the_limit(cases):
+    for content, limit, chunks in cases:
+        assert all(len(chunk) <= limit for chunk in chunks)
+        assert all(chunk.strip() for chunk in chunks)
+
+def test_chunks_close_what_they_open(cases):
+    for content, limit, chunks in cases:
+        for chunk in chunks[:-1]:
+            assert scan_markdown(chunk) == (None, ()), chunk
+
+def test_last_chunk_ends_in_the_input_state(cases):
+    for content, limit, chunks in cases:
+        assert scan_markdown(chunks[-1]) == scan_markdown(content)
+
+def test_text_is_preserved(cases):
+    for content, limit, chunks in cases:
+        assert visible_text("\n".join(chunks)) == visible_text(content)
+
+def test_short_content_is_unchanged():
+    assert split_markdown("**hello** world", 50) == ["**hello** world"]
+
+def test_cut_prefers_paragraph_break():
+    text = "a first paragraph that is long.\n\nThen a second one. It needs a cut"
+    assert find_split(text, 0, 50) == len("a first paragraph that is long.\n\n")
+
+def test_code_fence_is_reopened_with_its_language():
+    content = "```python\n" + "\n".join(f"line_{n} = {n}" for n in range(40)) + "\n```"
+    chunks = split_markdown(content, 200)
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert chunk.startswith("```python\n")
+        assert chunk.endswith("```")
+
+def test_bold_is_closed_and_reopened():
+    content = "**" + " ".join(["bold"] * 40) + "**"
+    chunks = split_markdown(content, 60)
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert chunk.startswith("**") and chunk.endswith("**")
+
+def test_long_whitespace_still_gives_one_chunk():
+    assert split_markdown(" \n" * 1500, 200) == ["\u2026"]
+
+@pytest.fixture
+def unpaced_outbox(monkeypatch):
+    # Channel pacing is the outbox's concern; these tests are about ProgressiveMessage's own coalescing
+    monkeypatch.setattr(outbox, 'rate', 0)
+    monkeypatch.setattr(outbox, 'budgets', OrderedDict())
+
+def test_long_whitespace_is_sent_and_edited(unpaced_outbox):
+    async def main():
+        channel = FakeChannel()
+        await MessageSplitter.send_message(channel, " " * (DISCORD_SAFE_LIMIT + 1))
+        message = await channel.send("Processing...")
+        await MessageSplitter.edit_message(message, "\n" * (DISCORD_SAFE_LIMIT + 1))
+        return channel
+
+    channel = asyncio.run(main())
+    assert [message.content for message in channel.messages] == ["\u2026", "\u2026"]
+
+def test_progressive_message_coalesces_edits(unpaced_outbox):
+    async def main():
+        channel = FakeChannel()
+        message = await channel.send("Processing...")
+        view = ProgressiveMessage(message, interval=0.05)
+        text = ""
+        for word in ["a"] * 50:
+            text += word + " "
+            view.update(text)
+            await asyncio.sleep(0.002)
+        await view.finish(text + "done")
+        return channel, message
+
+    channel, message = asyncio.run(main())
+    assert message.content == ("a " * 50 + "done").strip()
+    assert len(channel.messages) == 1
+    # About 100 ms of updates at one edit per 50 ms, plus the final edit
+    assert message.edits <= 5
+
+def test_progressive_message_overflows_into_follow_ups(unpaced_outbox):
+    async def main():
+        channel = FakeChannel()
+        message = await channel.send("Processing...")
+        view = ProgressiveMessage(message, interval=0)
+        text = ""
+        for n in range(600):
+            text += f"word{n} "
+            view.update(text)
+            await asyncio.sleep(0)
+        await view.finish(text)
+        return channel, text
+
+    channel, text = asyncio.run(main())
+    assert len(channel.messages) > 1
+    assert all(len(message.content) <= DISCORD_SAFE_LIMIT for message in channel.messages)
+    assert " ".join(message.content for message in channel.messages).split() == text.split()
+
+def test_progressive_message_reopens_a_code_block(unpaced_outbox):
+    async def main():
+        channel = FakeChannel()
+        message = await channel.send("Processing...")
+        view = ProgressiveMessage(message, interval=0)
+        text = "Here is the code:\n```python\n"
+        for n in range(300):
+            text += f"x{n} = {n}\n"
+            view.update(text)
+            await asyncio.sleep(0)
+        await view.finish(text + "```\nDone.")
+        return channel
+
+    channel = asyncio.run(main())
+    assert len(channel.messages) > 1
+    assert all(len(message.content) <= DISCORD_SAFE_LIMIT for message in channel.messages)
+    # Every message renders on its own: the block is closed before a cut and re-opened after it
+    for message in channel.messages[:-1]:
+        assert message.content.endswith("```")
+        assert scan_markdown(message.content) == (None, ())
+    for message in channel.messages[1:]:
+        assert message.content.startswith("```python\n")
+    assert channel.messages[-1].content.endswith("```\nDone.")
+
+@pytest.mark.parametrize("content", [
+    "*" * 5000,
+    "_" * 1990,
+    "`" * 3000,
+    "a_" * 995,
+    "*a" * 995,
+    "~|" * 2000,
+    "".join(random.Random(0).choice("*_`~|") for _ in range(20000)),
+])
+@pytest.mark.parametrize("limit", [200, DISCORD_SAFE_LIMIT])
+def test_marker_runs_fill_whole_chunks(content, limit):
+    chunks = split_markdown(content, limit)
+    # Room kept for closing and re-opened markers costs a little per chunk, never a chunk per marker
+    assert len(chunks) <= math.ceil(len(content) / (limit - 2 * MARKUP_RESERVE)) + 1
+    assert all(len(chunk) <= limit for chunk in chunks)
+    for chunk in chunks[:-1]:
+        assert scan_markdown(chunk) == (None, ())
@@ -0,0 +1,262 @@
+import asyncio
+import base64
+import json
+import time
+
+import pytest
+
+from fake_moondream import FakeMoondreamAPI
+from moondream_client import DEADLINE_MESSAGE, UNAVAILABLE_MESSAGE, CircuitBreaker, EncodedImage, MoondreamClient, build_request_body
+
+IMAGE_URL = 'http://example.com/cat.jpg'
+
+async def call_api(api, *calls, **options):
+    """Run calls (endpoint, kwargs) one after another against the fake API and return the client and results"""
+    options.setdefault('backoff_base', 0.01)
+    client = MoondreamClient("key", base_url=api.url, **options)
+    try:
+        results = [await client.call(endpoint, IMAGE_URL, **kwargs) for endpoint, kwargs in calls]
+    finally:
+        await client.close()
+    return client, results
+
+def test_server_errors_are_retried():
+    async def main():
+        async with FakeMoondreamAPI() as api:
+            api.reply(status=503).reply(status=502)
+            client, results = await call_api(api, ('caption', {}))
+            return api, client, results
+
+    api, client, results = asyncio.run(main())
+    assert results == [{"caption": "a cat on a sofa"}]
+    assert api.calls() == 3
+    assert client.stats["retries"] == 2
+    assert client.breaker.failures == 0
+
+def test_client_errors_are_not_retried():
+    async def main():
+        async with FakeMoondreamAPI() as api:
+            api.reply(status=400, body={"error": "bad question"})
+            client, results = await call_api(api, ('query', {'additional_params': {'question': ''}}))
+            return api, client, results
+
+    api, client, results = asyncio.run(main())
+    assert "400" in results[0]["error"]
+    assert api.calls() == 1
+    assert client.stats["permanent_errors"] == 1
+    assert api.requests[0] == ('query', {"image_url": IMAGE_URL, "stream": False, "question": ""})
+
+def test_retries_give_up_after_max_attempts():
+    async def main():
+        async with FakeMoondreamAPI() as api:
+            for _ in range(3):
+                api.reply(status=500)
+            client, results = await call_api(api, ('caption', {}), max_attempts=3)
+            return api, client, results
+
+    api, client, results = asyncio.run(main())
+    assert "500" in results[0]["error"]
+    assert api.calls() == 3
+    assert client.stats["failed"] == 1
+
+def test_timeouts_are_retried():
+    async def main():
+        async with FakeMoondreamAPI() as api:
+            api.reply(delay=0.5)
+            client, results = await call_api(api, ('caption', {'timeout': 0.1}))
+            return api, results
+
+    api, results = asyncio.run(main())
+    assert results == [{"caption": "a cat on a sofa"}]
+    assert api.calls() == 2
+
+def test_deadline_cuts_the_attempt_short():
+    async def main():
+        async with FakeMoondreamAPI() as api:
+            api.reply(delay=0.5)
+            deadline = time.monotonic() + 0.1
+            client, results = await call_api(api, ('caption', {'deadline': deadline}))
+            return api, client, results
+
+    api, client, results = asyncio.run(main())
+    assert results == [{"error": DEADLINE_MESSAGE}]
+    assert api.calls() == 1
+    # Running out of our own time says nothing about the API's health
+    assert client.breaker.failures == 0
+
+def test_breaker_opens_and_fails_fast():
+    async def main():
+        async with FakeMoondreamAPI() as api:
+            for _ in range(2):
+                api.reply(status=503)
+            breaker = CircuitBreaker(failure_threshold=2, recovery_timeout=60)
+            client, results = await call_api(api, ('caption', {}), ('caption', {}), breaker=breaker, max_attempts=2)
+            return api, client, results
+
+    api, client, results = asyncio.run(main())
+    assert client.breaker.state == CircuitBreaker.OPEN
+    # The second call is rejected without reaching the API
+    assert results[1] == {"error": UNAVAILABLE_MESSAGE}
+    assert api.calls() == 2
+    assert client.stats["rejected"] == 1
+
+def test_breaker_probe_closes_the_circuit():
+    async def main():
+        async with FakeMoondreamAPI() as api:
+            api.reply(status=503)
+            breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=0.05)
+            client, results = await call_api(api, ('caption', {}), breaker=breaker, max_attempts=1)
+            assert breaker.state == CircuitBreaker.OPEN
+            await asyncio.sleep(0.06)
+            client, more = await call_api(api, ('caption', {}), breaker=breaker)
+            return breaker, results + more
+
+    breaker, results = asyncio.run(main())
+    assert results[1] == {"caption": "a cat on a sofa"}
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.stats["probes"] == 1
+
+def test_half_open_breaker_lets_one_probe_through():
+    breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=0)
+    breaker.record_failure()
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+def test_only_the_probe_gives_back_the_probe_slot():
+    breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=0)
+    # Admitted while the circuit was still closed
+    earlier = breaker.allow()
+    breaker.record_failure()
+    probe = breaker.allow()
+    assert probe
+
+    # The earlier call finishing must not open the way for a second probe
+    breaker.release(earlier)
+    assert not breaker.allow()
+    breaker.record_failure(earlier)
+    breaker.opened_at = 0.0
+    assert not breaker.allow()
+
+    breaker.record_success(probe)
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.probing is None
+    assert breaker.stats["probes"] == 1
+
+def test_cancelled_call_does_not_free_a_live_probe():
+    async def main():
+        async with FakeMoondreamAPI() as api:
+            api.reply(delay=0.2, body={"caption": "early"}).reply(delay=0.2, body={"caption": "probed"})
+            breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=0)
+            client = MoondreamClient("key", base_url=api.url, breaker=breaker, max_attempts=1)
+            try:
+                # Admitted while closed, then cancelled after the circuit went half-open
+                earlier = asyncio.create_task(client.call('caption', IMAGE_URL))
+                await asyncio.sleep(0.05)
+                breaker.record_failure()
+                probe = asyncio.create_task(client.call('caption', IMAGE_URL))
+                await asyncio.sleep(0.05)
+                earlier.cancel()
+                await asyncio.gather(earlier, return_exceptions=True)
+                second = await client.call('caption', IMAGE_URL)
+                first = await probe
+            finally:
+                await client.close()
+            return api, breaker, first, second
+
+    api, breaker, first, second = asyncio.run(main())
+    assert second == {"error": UNAVAILABLE_MESSAGE}
+    assert first == {"caption": "probed"}
+    assert api.calls() == 2
+    assert breaker.state == CircuitBreaker.CLOSED
+
+def test_streamed_text_is_reported_as_it_grows():
+    async def main():
+        async with FakeMoondreamAPI() as api:
+            api.reply(chunks=["A cat", " on", " a sofa."])
+            seen = []
+            client, results = await call_api(api, ('caption', {'on_chunk': seen.append}))
+            return api, seen, results
+
+    api, seen, results = asyncio.run(main())
+    assert seen == ["A cat", "A cat on", "A cat on a sofa."]
+    assert results == [{"caption": "A cat on a sofa."}]
+    assert api.requests[0][1]["stream"] is True
+
+def test_stream_without_completion_is_marked_incomplete():
+    async def main():
+        async with FakeMoondreamAPI() as api:
+            api.reply(chunks=["A cat", " on"], completed_event=False)
+            client, results = await call_api(api, ('caption', {'on_chunk': lambda text: None}))
+            return client, results
+
+    client, results = asyncio.run(main())
+    assert results == [{"caption": "A cat on", "incomplete": True}]
+    assert client.stats["incomplete_streams"] == 1
+
+def test_stream_falls_back_to_a_json_answer():
+    async def main():
+        async with FakeMoondreamAPI() as api:
+            api.reply(body={"answer": "Two"})
+            seen = []
+            client, results = await call_api(api, ('query', {'additional_params': {'question': 'How many?'}, 'on_chunk': seen.append}))
+            return seen, results
+
+    seen, results = asyncio.run(main())
+    assert seen == ["Two"]
+    assert results == [{"answer": "Two"}]
+
+def test_broken_stream_is_not_retried_once_text_was_shown():
+    async def main():
+        async with FakeMoondreamAPI() as api:
+            api.reply(chunks=["A cat", " on"], complete=False)
+            seen = []
+            client, results = await call_api(api, ('caption', {'on_chunk': seen.append}))
+            return api, seen, results
+
+    api, seen, results = asyncio.run(main())
+    assert seen == ["A cat", "A cat on"]
+    assert "error" in results[0]
+    assert api.calls() == 1
+
+@pytest.mark.parametrize("fields", [
+    {},
+    {"stream": False},
+    {"stream": True, "length": "normal"},
+    {"stream": False, "object": "cat"},
+    {"stream": True, "question": 'Is the "cat" on the left?\nOr \\ the 猫 on the right? \u2028'},
+])
+@pytest.mark.parametrize("mime_type", ['image/jpeg', 'image/webp'])
+def test_spliced_body_matches_json_dumps(fields, mime_type):
+    data = bytes(range(256)) * 40
+    image = EncodedImage(data, mime_type)
+    data_url = f"data:{mime_type};base64," + base64.b64encode(data).decode('ascii')
+
+    expected = json.dumps({"image_url": data_url, **fields}).encode('utf-8')
+    assert build_request_body(image, fields) == expected
+    # The data URL is encoded once and reused by later bodies
+    assert build_request_body(image, fields) == expected
+
+def test_plain_url_body_is_json_dumps():
+    assert build_request_body(IMAGE_URL, {"stream": False}) == json.dumps({"image_url": IMAGE_URL, "stream": False}).encode('utf-8')
+
+def test_api_receives_the_spliced_image():
+    data = b'\xff\xd8\xff' + bytes(range(256)) * 4
+    image = EncodedImage(data)
+
+    async def main():
+        async with FakeMoondreamAPI() as api:
+            client = MoondreamClient("key", base_url=api.url)
+            try:
+                await client.call('detect', image, {"object": "cat"})
+            finally:
+                await client.close()
+            return api
+
+    api = asyncio.run(main())
+    assert api.requests == [('detect', {
+        "image_url": "data:image/jpeg;base64," + base64.b64encode(data).decode('ascii'),
+        "stream": False,
+        "object": "cat",
+    })]
@@ -0,0 +1,128 @@
+import asyncio
+import io
+from collections import OrderedDict
+
+import pytest
+from PIL import Image
+
+from fake_discord import FakeAttachment, FakeChannel, FakeThread, FakeUser, incoming
+from fake_moondream import FakeMoondreamAPI
+from image_cache import FrameCache, ImageCache
+from moondream_client import MoondreamClient
+from outbox import outbox
+from result_cache import ResultCache
+from scheduler import RequestScheduler, SingleFlight
+from thread_store import ThreadStore
+
+def png_bytes():
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 48), 'orange').save(buffer, 'PNG')
+    buffer.seek(0)
+    return buffer
+
+class Context:
+    """Stand-in for the command context of a !moondream message with an image attached"""
+
+    def __init__(self, content='!moondream caption'):
+        self.channel = FakeChannel()
+        self.author = FakeUser()
+        self.guild = None
+        self.message = incoming(self.channel, content, author=self.author, attachments=[FakeAttachment()])
+        self.message.jump_url = f"https://discord.com/channels/@me/{self.channel.id}/{self.message.id}"
+        self.threads = []
+
+        async def create_thread(name, auto_archive_duration=None):
+            thread = FakeThread(name=name)
+            self.threads.append(thread)
+            return thread
+        self.message.create_thread = create_thread
+
+@pytest.fixture
+def bot(monkeypatch, tmp_path):
+    """The bot module with fresh caches, a busy-able scheduler and no network"""
+    import bot
+
+    monkeypatch.setattr(bot, 'result_cache', ResultCache(ttl=60, max_entries=100))
+    monkeypatch.setattr(bot, 'image_cache', ImageCache())
+    monkeypatch.setattr(bot, 'frame_cache', FrameCache())
+    monkeypatch.setattr(bot, 'request_scheduler', RequestScheduler(max_concurrency=1, notify_interval=0.01))
+    monkeypatch.setattr(bot, 'encode_flights', SingleFlight())
+    monkeypatch.setattr(bot, 'api_flights', SingleFlight())
+    monkeypatch.setattr(bot, 'stream_listeners', {})
+    monkeypatch.setattr(bot, 'thread_images', ThreadStore(path=str(tmp_path / 'threads.db'), flush_interval=60))
+    monkeypatch.setattr(bot, 'moondream_threads', set())
+    monkeypatch.setattr(bot, 'STREAM_RESPONSES', False)
+    monkeypatch.setattr(outbox, 'rate', 0)
+    monkeypatch.setattr(outbox, 'budgets', OrderedDict())
+
+    async def download_image_bytes(url, expected_size=None):
+        return png_bytes()
+    monkeypatch.setattr(bot, 'download_image_bytes', download_image_bytes)
+    return bot
+
+def test_first_command_shows_its_queue_position(bot, monkeypatch):
+    save_image_to_thread = bot.save_image_to_thread
+
+    async def slow_image_post(*args, **kwargs):
+        # The prefetched calls are all queued before the command's processing message exists
+        await asyncio.sleep(0.1)
+        return await save_image_to_thread(*args, **kwargs)
+    monkeypatch.setattr(bot, 'save_image_to_thread', slow_image_post)
+
+    async def main():
+        await bot.thread_images.load()
+        async with FakeMoondreamAPI(default={"caption": "an orange square", "answer": "Orange"}) as api:
+            client = MoondreamClient("key", base_url=api.url)
+            monkeypatch.setattr(bot, 'moondream_client', client)
+            # Someone else's call holds the only slot, so the prefetched calls queue
+            release = asyncio.Event()
+            busy = asyncio.create_task(bot.request_scheduler.run(release.wait))
+            ctx = Context()
+            command = asyncio.create_task(bot.moondream(ctx, 'caption'))
+            try:
+                # Wait long enough for the queue position to be posted, if it is
+                await asyncio.sleep(0.3)
+                queued = [message.content for thread in ctx.threads for message in thread.messages if 'in the queue' in message.content]
+                release.set()
+                await asyncio.wait_for(asyncio.gather(busy, command), 5)
+            finally:
+                await client.close()
+                await bot.thread_images.close()
+            return api, ctx, queued
+
+    api, ctx, queued = asyncio.run(main())
+    assert len(queued) == 1 and "you're #1 in the queue" in queued[0]
+    thread = ctx.threads[0]
+    assert thread.messages[-1].content.endswith("**Caption:** an orange square\n───────────────────────────────────────")
+    # The command joined the prefetched caption call instead of making its own
+    assert sorted(endpoint for endpoint, body in api.requests) == ['caption', 'query']
+    assert thread.name == "Moondream: Orange"
+
+def test_failed_thread_creation_stops_the_encode(bot, monkeypatch):
+    encode = {}
+
+    async def encode_image(**kwargs):
+        encode['started'] = True
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            encode['cancelled'] = True
+            raise
+    monkeypatch.setattr(bot, 'encode_image', encode_image)
+
+    async def main():
+        ctx = Context()
+
+        async def create_thread(name, auto_archive_duration=None):
+            # Let the encode start before the thread creation fails
+            await asyncio.sleep(0)
+            raise RuntimeError("Missing Permissions")
+        ctx.message.create_thread = create_thread
+
+        with pytest.raises(RuntimeError):
+            await bot.moondream(ctx, 'caption')
+        return [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+
+    left_running = asyncio.run(main())
+    assert encode == {'started': True, 'cancelled': True}
+    assert not left_running
@@ -0,0 +1,42 @@
+import bot
+from bot import MAX_BATCH_OBJECTS, api_requests_for, parse_object_labels
+
+def test_comma_list_is_split_and_trimmed():
+    assert parse_object_labels("cat,dog ,  person") == (["cat", "dog", "person"], 0)
+
+def test_single_object_is_one_label():
+    assert parse_object_labels("red car") == (["red car"], 0)
+
+def test_and_inside_a_name_does_not_split_it():
+    assert parse_object_labels("salt and pepper shaker") == (["salt and pepper shaker"], 0)
+    assert parse_object_labels("cat and dog") == (["cat and dog"], 0)
+
+def test_and_before_the_last_item_is_dropped():
+    assert parse_object_labels("cat, dog, and person") == (["cat", "dog", "person"], 0)
+    assert parse_object_labels("cat, AND  dog") == (["cat", "dog"], 0)
+    # Only a separate word counts
+    assert parse_object_labels("cat, android") == (["cat", "android"], 0)
+
+def test_duplicates_are_dropped_ignoring_case():
+    assert parse_object_labels("Cat, dog, cat, CAT, and dog") == (["Cat", "dog"], 0)
+
+def test_empty_labels_default_to_subject():
+    assert parse_object_labels(None) == (["subject"], 0)
+    assert parse_object_labels(" , ,") == (["subject"], 0)
+
+def test_labels_are_capped():
+    names = [f"thing{n}" for n in range(MAX_BATCH_OBJECTS + 2)]
+    labels, dropped = parse_object_labels(", ".join(names))
+    assert labels == names[:MAX_BATCH_OBJECTS]
+    assert dropped == 2
+    # Duplicates don't count towards the cap
+    labels, dropped = parse_object_labels(", ".join(["cat"] * 10 + names[:MAX_BATCH_OBJECTS - 1]))
+    assert labels == ["cat"] + names[:MAX_BATCH_OBJECTS - 1]
+    assert dropped == 0
+
+def test_one_api_call_per_label():
+    assert api_requests_for('detect', "cat, dog, and cat") == [{"object": "cat"}, {"object": "dog"}]
+    assert api_requests_for('point', None) == [{"object": "subject"}]
+    assert len(api_requests_for('detect', ", ".join(f"thing{n}" for n in range(20)))) == MAX_BATCH_OBJECTS
+    # One color per object
+    assert MAX_BATCH_OBJECTS == len(bot.LABEL_COLORS)
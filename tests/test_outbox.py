@@ -0,0 +1,95 @@
+import asyncio
+import time
+
+from fake_discord import FakeChannel, FakeMessage
+from outbox import Outbox
+from scheduler import RequestOwner, request_owner
+
+class SlowMessage(FakeMessage):
+    """A message whose edits take a while to reach Discord, logging the content of each"""
+
+    def __init__(self, channel, log, delay=0.02):
+        super().__init__(channel, "")
+        self.log = log
+        self.delay = delay
+
+    async def edit(self, **fields):
+        await asyncio.sleep(self.delay)
+        self.log.append(fields.get('content'))
+        return await super().edit(**fields)
+
+def test_writes_are_paced_per_channel():
+    async def main():
+        outbox = Outbox(rate=50, burst=2)
+        busy, quiet = FakeChannel(), FakeChannel()
+        started = time.monotonic()
+        for n in range(4):
+            await outbox.send(busy, f"busy {n}")
+        busy_elapsed = time.monotonic() - started
+
+        started = time.monotonic()
+        await outbox.send(quiet, "quiet")
+        quiet_elapsed = time.monotonic() - started
+        return outbox, busy, busy_elapsed, quiet_elapsed
+
+    outbox, busy, busy_elapsed, quiet_elapsed = asyncio.run(main())
+    assert [message.content for message in busy.messages] == ["busy 0", "busy 1", "busy 2", "busy 3"]
+    # Two writes up front, then one every 20 ms; another channel has its own budget
+    assert busy_elapsed >= 0.035
+    assert quiet_elapsed < 0.015
+    assert outbox.stats["sends"] == 5
+    assert outbox.stats["throttled"] == 2
+
+def test_waiting_edits_are_merged():
+    async def main():
+        outbox = Outbox(rate=20, burst=1)
+        channel = FakeChannel()
+        message = await outbox.send(channel, "Processing...")
+        # The budget is spent, so these edits wait together
+        results = await asyncio.gather(
+            outbox.edit(message, content="A cat"),
+            outbox.edit(message, content="A cat on"),
+            outbox.edit(message, content="A cat on a sofa.", embed=None),
+        )
+        return outbox, message, results
+
+    outbox, message, results = asyncio.run(main())
+    assert message.edits == 1
+    assert message.content == "A cat on a sofa."
+    assert message.fields == {"embed": None}
+    assert all(result is message for result in results)
+    assert outbox.stats["edits"] == 1
+    assert outbox.stats["coalesced_edits"] == 2
+
+def test_edits_land_in_order():
+    async def main():
+        outbox = Outbox(rate=0, burst=1)
+        log = []
+        message = SlowMessage(FakeChannel(), log)
+        first = asyncio.create_task(outbox.edit(message, content="first"))
+        await asyncio.sleep(0.005)
+        # The first edit is already on its way, so these queue behind it and merge
+        await asyncio.gather(first, outbox.edit(message, content="second"), outbox.edit(message, content="third"))
+        return outbox, message, log
+
+    outbox, message, log = asyncio.run(main())
+    assert log == ["first", "third"]
+    assert message.content == "third"
+    assert not outbox.pending_edits
+
+def test_calls_are_counted_on_the_command():
+    async def main():
+        outbox = Outbox(rate=0, burst=1)
+        owner = RequestOwner(1, 'a', deadline=None)
+        request_owner.set(owner)
+        channel = FakeChannel()
+        message = await outbox.send(channel, "Processing...")
+        await outbox.edit(message, content="Done")
+        await outbox.delete(message)
+        outbox.record_command(owner)
+        return outbox, owner, message
+
+    outbox, owner, message = asyncio.run(main())
+    assert owner.discord_calls == 3
+    assert message.deleted
+    assert outbox.get_stats()["calls_per_command"] == 3
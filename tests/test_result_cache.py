@@ -0,0 +1,27 @@
+from result_cache import ResultCache, normalize_params
+
+def test_object_names_ignore_case_and_whitespace():
+    assert normalize_params({'object': '  Person '}) == normalize_params({'object': 'person'})
+
+def test_questions_keep_their_case():
+    assert normalize_params({'question': 'What  does it say?'}) == normalize_params({'question': 'What does it say? '})
+    assert normalize_params({'question': 'Is this the US?'}) != normalize_params({'question': 'Is this the us?'})
+
+def test_results_are_cached_per_image_endpoint_and_params():
+    cache = ResultCache(ttl=60, max_entries=10)
+    key = cache.make_key('hash', 'detect', {'object': 'Dog'})
+    cache.put(key, {'objects': []})
+    assert cache.get(cache.make_key('hash', 'detect', {'object': 'dog'})) == {'objects': []}
+    assert cache.get(cache.make_key('other', 'detect', {'object': 'dog'})) is None
+
+def test_errors_are_not_cached():
+    cache = ResultCache(ttl=60, max_entries=10)
+    key = cache.make_key('hash', 'caption')
+    cache.put(key, {'error': 'API Error: 500'})
+    assert cache.get(key) is None
+
+def test_incomplete_answers_are_not_cached():
+    cache = ResultCache(ttl=60, max_entries=10)
+    key = cache.make_key('hash', 'caption')
+    cache.put(key, {'caption': 'A cat on', 'incomplete': True})
+    assert cache.get(key) is None
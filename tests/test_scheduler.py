@@ -0,0 +1,275 @@
+import asyncio
+import time
+
+from fake_moondream import FakeMoondreamAPI
+from moondream_client import MoondreamClient
+from scheduler import RequestOwner, RequestScheduler, TokenBucket, parse_retry_after
+
+async def hold(gate, log=None, name=None):
+    """A scheduled call that runs until the gate opens, recording the order calls started in"""
+    if log is not None:
+        log.append(name)
+    await gate.wait()
+
+async def queue_up(scheduler, owners, log):
+    """Occupy the only slot, queue one call per owner, then let everything run"""
+    gate = asyncio.Event()
+    blocker = asyncio.create_task(scheduler.run(lambda: hold(gate)))
+    await asyncio.sleep(0)
+    tasks = []
+    for name, owner in owners:
+        tasks.append(asyncio.create_task(scheduler.run(lambda name=name: hold(gate, log, name), owner)))
+        await asyncio.sleep(0)
+    gate.set()
+    await asyncio.gather(blocker, *tasks)
+
+def test_concurrency_is_bounded():
+    async def main():
+        scheduler = RequestScheduler(max_concurrency=2)
+        running = peak = 0
+
+        async def call():
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+
+        await asyncio.gather(*(scheduler.run(call) for _ in range(8)))
+        return scheduler, peak
+
+    scheduler, peak = asyncio.run(main())
+    assert peak == 2
+    assert scheduler.active == 0
+    assert scheduler.get_stats()["completed"] == 8
+
+def test_users_are_served_round_robin():
+    async def main():
+        scheduler = RequestScheduler(max_concurrency=1)
+        log = []
+        spammer = [(f"a{n}", RequestOwner(1, 'a', deadline=None)) for n in range(4)]
+        await queue_up(scheduler, spammer + [("b0", RequestOwner(1, 'b', deadline=None))], log)
+        return log
+
+    # The one call from b goes right after the spammer's first, not after all four
+    assert asyncio.run(main()) == ["a0", "b0", "a1", "a2", "a3"]
+
+def test_guilds_are_served_before_users():
+    async def main():
+        scheduler = RequestScheduler(max_concurrency=1)
+        log = []
+        owners = [
+            ("g1a", RequestOwner(1, 'a', deadline=None)),
+            ("g1b", RequestOwner(1, 'b', deadline=None)),
+            ("g1c", RequestOwner(1, 'c', deadline=None)),
+            ("g2a", RequestOwner(2, 'a', deadline=None)),
+        ]
+        await queue_up(scheduler, owners, log)
+        return log
+
+    assert asyncio.run(main()) == ["g1a", "g2a", "g1b", "g1c"]
+
+def test_queue_position_is_reported():
+    async def main():
+        scheduler = RequestScheduler(max_concurrency=1)
+        gate = asyncio.Event()
+        positions = []
+
+        async def notify(position):
+            positions.append(position)
+
+        blocker = asyncio.create_task(scheduler.run(lambda: hold(gate)))
+        await asyncio.sleep(0)
+        first = asyncio.create_task(scheduler.run(lambda: hold(gate), RequestOwner(1, 'a', deadline=None)))
+        await asyncio.sleep(0)
+        owner = RequestOwner(2, 'b', notify=notify, deadline=None)
+        second = asyncio.create_task(scheduler.run(lambda: hold(gate), owner))
+        await asyncio.sleep(0)
+        gate.set()
+        await asyncio.gather(blocker, first, second)
+        return positions
+
+    # Second in line, then 0 once the call leaves the queue
+    assert asyncio.run(main()) == [2, 0]
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def main():
+        scheduler = RequestScheduler(max_concurrency=1)
+        gate = asyncio.Event()
+        log = []
+        blocker = asyncio.create_task(scheduler.run(lambda: hold(gate)))
+        await asyncio.sleep(0)
+        cancelled = asyncio.create_task(scheduler.run(lambda: hold(gate, log, "cancelled"), RequestOwner(1, 'a', deadline=None)))
+        kept = asyncio.create_task(scheduler.run(lambda: hold(gate, log, "kept"), RequestOwner(1, 'b', deadline=None)))
+        await asyncio.sleep(0)
+        assert scheduler.waiting == 2
+
+        cancelled.cancel()
+        await asyncio.sleep(0)
+        waiting = scheduler.waiting
+        gate.set()
+        await asyncio.gather(blocker, kept)
+        return scheduler, waiting, log
+
+    scheduler, waiting, log = asyncio.run(main())
+    assert waiting == 1
+    assert log == ["kept"]
+    assert scheduler.active == 0 and scheduler.waiting == 0 and not scheduler.queues
+
+def test_slot_handed_to_a_cancelled_waiter_is_passed_on():
+    async def main():
+        scheduler = RequestScheduler(max_concurrency=1)
+        gate = asyncio.Event()
+        gate.set()
+        log = []
+        # Hold the only slot the way run() does, so it can be released at an exact moment
+        scheduler.active = 1
+        first = asyncio.create_task(scheduler.run(lambda: hold(gate, log, "first")))
+        second = asyncio.create_task(scheduler.run(lambda: hold(gate, log, "second")))
+        await asyncio.sleep(0)
+
+        # Hand the slot to the first waiter and cancel it before it wakes up
+        scheduler._release()
+        first.cancel()
+        await asyncio.gather(first, second, return_exceptions=True)
+        return scheduler, log
+
+    scheduler, log = asyncio.run(main())
+    assert log == ["second"]
+    assert scheduler.active == 0
+
+def test_waiter_cancelled_while_notified_leaves_the_queue():
+    async def main():
+        scheduler = RequestScheduler(max_concurrency=1)
+        gate = asyncio.Event()
+        notified = asyncio.Event()
+        log = []
+
+        async def notify(position):
+            # A slow Discord edit, still in flight when the request is cancelled
+            notified.set()
+            await asyncio.sleep(1)
+
+        blocker = asyncio.create_task(scheduler.run(lambda: hold(gate)))
+        await asyncio.sleep(0)
+        cancelled = asyncio.create_task(
+            scheduler.run(lambda: hold(gate, log, "cancelled"), RequestOwner(1, 'a', notify=notify, deadline=None))
+        )
+        await notified.wait()
+        cancelled.cancel()
+        await asyncio.gather(cancelled, return_exceptions=True)
+        gate.set()
+        await blocker
+        return scheduler, log
+
+    scheduler, log = asyncio.run(main())
+    assert log == []
+    assert scheduler.active == 0 and scheduler.waiting == 0 and not scheduler.queues
+
+def test_token_bucket_throttles_past_the_burst():
+    async def main():
+        bucket = TokenBucket(rate=50, burst=2)
+        started = time.monotonic()
+        for _ in range(4):
+            await bucket.acquire()
+        return bucket, time.monotonic() - started
+
+    bucket, elapsed = asyncio.run(main())
+    # Two tokens up front, then one every 20 ms
+    assert elapsed >= 0.035
+    assert bucket.stats["acquired"] == 4
+    assert bucket.stats["throttled"] == 2
+
+def test_penalize_pauses_every_caller():
+    async def main():
+        bucket = TokenBucket(rate=1000, burst=10)
+        bucket.penalize(0.1)
+        started = time.monotonic()
+        await asyncio.gather(bucket.acquire(), bucket.acquire())
+        return bucket, time.monotonic() - started
+
+    bucket, elapsed = asyncio.run(main())
+    assert elapsed >= 0.09
+    assert bucket.stats["rate_limited"] == 1
+    assert bucket.stats["throttled"] == 2
+
+def test_parse_retry_after():
+    assert parse_retry_after("2") == 2.0
+    assert parse_retry_after(None, default=1.5) == 1.5
+    assert parse_retry_after("soon", default=1.0) == 1.0
+    assert parse_retry_after("100000") == 60
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+
+def test_429_pauses_the_shared_limiter():
+    async def main():
+        async with FakeMoondreamAPI() as api:
+            api.reply(status=429, headers={"Retry-After": "0.2"})
+            bucket = TokenBucket(rate=100, burst=5)
+            client = MoondreamClient("key", base_url=api.url, rate_limiter=bucket, backoff_base=0.01)
+            try:
+                started = time.monotonic()
+                result = await client.call('caption', 'http://example.com/cat.jpg')
+                elapsed = time.monotonic() - started
+            finally:
+                await client.close()
+            return api, bucket, client, result, elapsed
+
+    api, bucket, client, result, elapsed = asyncio.run(main())
+    assert result == {"caption": "a cat on a sofa"}
+    assert api.calls('caption') == 2
+    assert elapsed >= 0.19
+    assert bucket.stats["rate_limited"] == 1
+    # A 429 means the API is up, so it doesn't count against the circuit breaker
+    assert client.breaker.failures == 0
+
+def test_queue_positions_follow_the_queue():
+    async def main():
+        scheduler = RequestScheduler(max_concurrency=1, notify_interval=0)
+        positions = {}
+        gates = {}
+        tasks = []
+
+        def owner(name, guild_id):
+            async def notify(position):
+                positions[name].append(position)
+            positions[name] = []
+            return RequestOwner(guild_id, name, notify=notify, deadline=None)
+
+        gates["blocker"] = asyncio.Event()
+        tasks.append(asyncio.create_task(scheduler.run(lambda: hold(gates["blocker"]))))
+        await asyncio.sleep(0)
+        for guild_id, name in enumerate(["a", "b", "c"], 1):
+            gates[name] = asyncio.Event()
+            tasks.append(asyncio.create_task(scheduler.run(lambda name=name: hold(gates[name]), owner(name, guild_id))))
+            await asyncio.sleep(0)
+
+        # Let the calls finish one at a time, giving the position refresh a moment after each
+        for name in ["blocker", "a", "b", "c"]:
+            gates[name].set()
+            await asyncio.sleep(0.01)
+        await asyncio.gather(*tasks)
+        return positions
+
+    assert asyncio.run(main()) == {"a": [1, 0], "b": [2, 1, 0], "c": [3, 2, 1, 0]}
+
+def test_queue_position_updates_are_batched():
+    async def main():
+        scheduler = RequestScheduler(max_concurrency=1, notify_interval=0.05)
+        gate = asyncio.Event()
+        positions = []
+
+        async def notify(position):
+            positions.append(position)
+
+        blocker = asyncio.create_task(scheduler.run(lambda: hold(gate)))
+        await asyncio.sleep(0)
+        ahead = [asyncio.create_task(scheduler.run(lambda: hold(gate), RequestOwner(n, 'a', deadline=None))) for n in range(3)]
+        await asyncio.sleep(0)
+        last = asyncio.create_task(scheduler.run(lambda: asyncio.sleep(0), RequestOwner(9, 'b', notify=notify, deadline=None)))
+        await asyncio.sleep(0)
+        # Everything ahead finishes within one interval, so the moves are never shown one by one
+        gate.set()
+        await asyncio.gather(blocker, *ahead, last)
+        return positions
+
+    assert asyncio.run(main()) == [4, 0]
@@ -0,0 +1,284 @@
+import asyncio
+import datetime
+
+import thread_store
+from thread_store import ImageHistory, ThreadStore
+
+class Clock:
+    """Stand-in for the time module, so last activity and expiry can be stepped by hand"""
+
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+def new_session():
+    history = ImageHistory()
+    history.add('https://cdn.example.com/cat.png', 'cat.png', content_hash='a' * 32, width=640, height=480)
+    return {'timestamp': datetime.datetime.now(), 'history': history}
+
+def open_store(tmp_path):
+    return ThreadStore(path=str(tmp_path / 'threads.db'), flush_interval=60)
+
+def test_sessions_expire_in_order_of_last_activity(tmp_path, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(thread_store, 'time', clock)
+
+    async def main():
+        store = open_store(tmp_path)
+        await store.load()
+        for thread_id in (1, 2, 3):
+            store[thread_id] = new_session()
+            clock.now += 10
+        # Using thread 1 again moves it to the back of the line
+        store.touch(1)
+        clock.now += 5
+
+        expired = await store.expire(max_age=20)
+        remaining = sorted(store)
+        delay = store.next_expiry(max_age=20)
+        await store.close()
+        return expired, remaining, delay
+
+    expired, remaining, delay = asyncio.run(main())
+    assert expired == [2]
+    assert remaining == [1, 3]
+    # Thread 3 was last active 15 s ago
+    assert delay == 5
+
+def test_expired_sessions_are_deleted_from_disk(tmp_path, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(thread_store, 'time', clock)
+
+    async def main():
+        store = open_store(tmp_path)
+        await store.load()
+        store[1] = new_session()
+        clock.now += 100
+        await store.expire(max_age=50)
+        await store.close()
+
+        reopened = open_store(tmp_path)
+        count = await reopened.load()
+        await reopened.close()
+        return count
+
+    assert asyncio.run(main()) == 0
+
+def test_sessions_only_on_disk_expire(tmp_path, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(thread_store, 'time', clock)
+
+    async def main():
+        store = open_store(tmp_path)
+        await store.load()
+        store[1] = new_session()
+        store[2] = new_session()
+        assert await store.unload(1)
+        clock.now += 100
+        store.touch(2)
+
+        expired = await store.expire(max_age=50)
+        restored = await store.restore(1)
+        await store.close()
+        return store, expired, restored
+
+    store, expired, restored = asyncio.run(main())
+    assert expired == [1]
+    assert not restored
+    assert not store.unloaded
+    assert list(store) == [2]
+
+def test_unloaded_session_is_restored(tmp_path):
+    async def main():
+        store = open_store(tmp_path)
+        await store.load()
+        store[1] = new_session()
+        assert await store.unload(1)
+        unloaded = (1 in store, set(store.unloaded))
+
+        assert await store.restore(1)
+        await store.close()
+        return store, unloaded
+
+    store, unloaded = asyncio.run(main())
+    assert unloaded == (False, {1})
+    assert not store.unloaded
+    history = store[1]['history']
+    assert history.latest().filename == 'cat.png'
+    assert history.latest().content_hash == 'a' * 32
+    assert history.next_number == 2
+
+def test_session_replaced_while_unloaded_is_kept(tmp_path):
+    async def main():
+        store = open_store(tmp_path)
+        await store.load()
+        store[1] = new_session()
+        await store.unload(1)
+        # A new image arrives before the archived session is read back
+        replacement = new_session()
+        replacement['history'].add('https://cdn.example.com/dog.png', 'dog.png')
+        store[1] = replacement
+        restored = await store.restore(1)
+        await store.close()
+        return store, replacement, restored
+
+    store, replacement, restored = asyncio.run(main())
+    assert restored
+    assert store[1] is replacement
+
+def test_forget_removes_sessions_in_memory_and_on_disk(tmp_path):
+    async def main():
+        store = open_store(tmp_path)
+        await store.load()
+        store[1] = new_session()
+        store[2] = new_session()
+        await store.unload(2)
+        store.forget(1)
+        store.forget(2)
+        # Unknown threads are ignored
+        store.forget(3)
+        await store.close()
+
+        reopened = open_store(tmp_path)
+        count = await reopened.load()
+        await reopened.close()
+        return store, count
+
+    store, count = asyncio.run(main())
+    assert len(store) == 0 and not store.unloaded
+    assert count == 0
+
+def test_archived_thread_round_trip(tmp_path, monkeypatch):
+    import bot
+
+    class Thread:
+        def __init__(self, thread_id):
+            self.id = thread_id
+
+    store = open_store(tmp_path)
+    monkeypatch.setattr(bot, 'thread_images', store)
+    monkeypatch.setattr(bot, 'moondream_threads', set())
+    # The bot's own user, as it would be once logged in
+    monkeypatch.setattr(bot.bot._connection, 'user', Thread(99))
+
+    async def main():
+        await store.load()
+        store[1] = new_session()
+        bot.moondream_threads.add(1)
+
+        await bot.track_moondream_thread(1, owner_id=None, archived=True)
+        archived = (1 in bot.moondream_threads, 1 in store)
+        # A message in the reopened thread still finds it before the unarchive event arrives
+        recognized = bot.is_moondream_thread(Thread(1))
+
+        await bot.track_moondream_thread(1, owner_id=None, archived=False)
+        await store.close()
+        return archived, recognized
+
+    archived, recognized = asyncio.run(main())
+    assert archived == (False, False)
+    assert recognized
+    assert 1 in bot.moondream_threads
+    assert store[1]['history'].latest().filename == 'cat.png'
+
+def test_cleanup_task_expires_stale_sessions(tmp_path, monkeypatch):
+    import bot
+
+    clock = Clock()
+    monkeypatch.setattr(thread_store, 'time', clock)
+    store = open_store(tmp_path)
+    monkeypatch.setattr(bot, 'thread_images', store)
+    monkeypatch.setattr(bot, 'THREAD_RETENTION_DAYS', 1)
+
+    async def main():
+        await store.load()
+        store[1] = new_session()
+        clock.now += 60 * 60
+        store[2] = new_session()
+        clock.now += 23.5 * 60 * 60
+        await bot.cleanup_old_threads.coro()
+        await store.close()
+
+    asyncio.run(main())
+    assert list(store) == [2]
+    # The next run is when thread 2 falls due, half an hour from now
+    assert bot.cleanup_old_threads.seconds == 1800
+
+def test_writes_to_one_thread_are_coalesced(tmp_path):
+    async def main():
+        store = open_store(tmp_path)
+        await store.load()
+        batches = []
+        write = store._write
+        store._write = lambda upserts, deletes: (batches.append((len(upserts), len(deletes))), write(upserts, deletes))
+
+        session = new_session()
+        store[1] = session
+        session['history'].add('https://cdn.example.com/dog.png', 'dog.png')
+        store.touch(1)
+        store.touch(1)
+        store[2] = new_session()
+        del store[2]
+        written = await store.flush()
+        # Nothing is queued, so nothing is written
+        again = await store.flush()
+        await store.close()
+        return batches, written, again
+
+    batches, written, again = asyncio.run(main())
+    # One upsert for thread 1 and one delete for thread 2, in a single transaction
+    assert batches == [(1, 1)]
+    assert written == 2
+    assert again == 0
+
+def test_close_flushes_queued_writes(tmp_path):
+    async def main():
+        store = open_store(tmp_path)
+        await store.load()
+        store.start()
+        store[1] = new_session()
+        # Closed long before the background flush would have run
+        await store.close()
+
+        reopened = open_store(tmp_path)
+        count = await reopened.load()
+        await reopened.close()
+        return store, count
+
+    store, count = asyncio.run(main())
+    assert count == 1
+    assert not store.pending
+
+def test_sessions_survive_a_restart(tmp_path, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(thread_store, 'time', clock)
+
+    async def main():
+        store = open_store(tmp_path)
+        await store.load()
+        session = new_session()
+        session['history'].add('https://cdn.example.com/dog.png', 'dog.png', message_id=42, channel_id=7)
+        session['owner'] = 'someone'
+        store[1] = session
+        await store.close()
+
+        clock.now += 30
+        reopened = open_store(tmp_path)
+        # Sessions created before the load finishes are kept
+        reopened[2] = new_session()
+        count = await reopened.load()
+        await reopened.close()
+        return session, reopened, count
+
+    session, reopened, count = asyncio.run(main())
+    assert count == 1
+    assert sorted(reopened) == [1, 2]
+    restored = reopened[1]
+    assert restored['owner'] == 'someone'
+    assert restored['timestamp'] == session['timestamp']
+    assert [record.to_list() for record in restored['history']] == [record.to_list() for record in session['history']]
+    assert restored['history'].next_number == 3
+    # Last activity is the stored one, not the time of the load
+    assert reopened.last_activity[1] == 1_000_000.0
@@ -0,0 +1,107 @@
+import asyncio
+import datetime
+
+import pytest
+
+from fake_discord import FakeGuild, FakeThread, FakeThreadPayload, FakeUser
+from thread_store import ImageHistory, ThreadStore
+
+def new_session():
+    history = ImageHistory()
+    history.add('https://cdn.example.com/cat.png', 'cat.png', content_hash='a' * 32)
+    return {'timestamp': datetime.datetime.now(), 'history': history}
+
+@pytest.fixture
+def bot(monkeypatch, tmp_path):
+    """The bot module logged in as a fake user, with an empty thread set and a fresh store"""
+    import bot
+
+    user = FakeUser(bot=True)
+    monkeypatch.setattr(bot.bot._connection, 'user', user)
+    monkeypatch.setattr(bot.bot._connection, '_guilds', {})
+    monkeypatch.setattr(bot, 'moondream_threads', set())
+    monkeypatch.setattr(bot, 'thread_images', ThreadStore(path=str(tmp_path / 'threads.db')))
+    return bot
+
+def add_guild(bot, monkeypatch, threads):
+    guild = FakeGuild(threads)
+    bot.bot._connection._guilds[guild.id] = guild
+    return guild
+
+def test_threads_are_restored_on_startup(bot, monkeypatch):
+    own = FakeThread(owner_id=bot.bot.user.id)
+    with_session = FakeThread(owner_id=FakeUser().id)
+    unrelated = FakeThread(owner_id=FakeUser().id)
+    archived_id = 987654
+
+    async def main():
+        await bot.thread_images.load()
+        bot.thread_images[with_session.id] = new_session()
+        bot.thread_images[archived_id] = new_session()
+        add_guild(bot, monkeypatch, [own, with_session, unrelated])
+        await bot.restore_moondream_threads()
+        await bot.thread_images.close()
+
+    asyncio.run(main())
+    # Threads the bot started and active threads with a session are tracked
+    assert bot.moondream_threads == {own.id, with_session.id}
+    assert not bot.is_moondream_thread(unrelated)
+    # The session of a thread that isn't active was moved to disk
+    assert archived_id not in bot.thread_images
+    assert bot.thread_images.unloaded == {archived_id}
+
+def test_archived_thread_is_dropped_and_comes_back_when_reopened(bot):
+    thread = FakeThread(owner_id=FakeUser().id)
+
+    async def main():
+        await bot.thread_images.load()
+        bot.thread_images[thread.id] = new_session()
+        bot.moondream_threads.add(thread.id)
+
+        await bot.on_raw_thread_update(FakeThreadPayload(thread.id, thread.owner_id, archived=True))
+        archived = (thread.id in bot.moondream_threads, thread.id in bot.thread_images)
+
+        await bot.on_raw_thread_update(FakeThreadPayload(thread.id, thread.owner_id, archived=False))
+        await bot.thread_images.close()
+        return archived
+
+    archived = asyncio.run(main())
+    assert archived == (False, False)
+    assert thread.id in bot.moondream_threads
+    assert bot.thread_images[thread.id]['history'].latest().filename == 'cat.png'
+
+def test_reopened_thread_reported_as_a_join_is_tracked(bot):
+    # After a restart discord.py reports a reopened thread it hadn't cached as thread_join
+    own = FakeThread(owner_id=bot.bot.user.id)
+    other = FakeThread(owner_id=FakeUser().id)
+
+    asyncio.run(bot.on_thread_join(own))
+    asyncio.run(bot.on_thread_join(other))
+    assert bot.moondream_threads == {own.id}
+
+def test_renamed_thread_stays_tracked(bot):
+    thread = FakeThread(owner_id=bot.bot.user.id)
+    bot.moondream_threads.add(thread.id)
+    # A rename is an update that leaves the thread open
+    asyncio.run(bot.on_raw_thread_update(FakeThreadPayload(thread.id, thread.owner_id)))
+    assert bot.is_moondream_thread(thread)
+
+def test_deleted_thread_is_forgotten(bot):
+    thread = FakeThread(owner_id=bot.bot.user.id)
+    archived = FakeThread(owner_id=bot.bot.user.id)
+
+    async def main():
+        await bot.thread_images.load()
+        for each in (thread, archived):
+            bot.thread_images[each.id] = new_session()
+            bot.moondream_threads.add(each.id)
+        await bot.on_raw_thread_update(FakeThreadPayload(archived.id, archived.owner_id, archived=True))
+
+        await bot.on_raw_thread_delete(FakeThreadPayload(thread.id))
+        await bot.on_raw_thread_delete(FakeThreadPayload(archived.id))
+        await bot.thread_images.close()
+
+    asyncio.run(main())
+    assert not bot.moondream_threads
+    assert len(bot.thread_images) == 0 and not bot.thread_images.unloaded
+    assert not bot.is_moondream_thread(thread) and not bot.is_moondream_thread(archived)
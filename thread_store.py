@@ -0,0 +1,404 @@
+import asyncio
+import datetime
+import heapq
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import deque
+from collections.abc import MutableMapping
+
+# Thread session store configuration
+THREAD_DB_PATH = os.getenv('THREAD_DB_PATH', os.path.join('data', 'threads.db'))  # SQLite database file
+THREAD_FLUSH_INTERVAL = float(os.getenv('THREAD_FLUSH_INTERVAL', '2'))  # Seconds between write-behind flushes
+THREAD_HISTORY_SIZE = int(os.getenv('THREAD_HISTORY_SIZE', '10'))  # Images remembered per thread
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS threads (
+    thread_id INTEGER PRIMARY KEY,
+    data TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    last_activity REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_threads_last_activity ON threads (last_activity);
+"""
+
+class ImageRecord:
+    """One image posted in a thread"""
+    __slots__ = ('number', 'url', 'filename', 'content_hash', 'width', 'height', 'message_id', 'channel_id')
+
+    def __init__(self, number, url, filename, content_hash=None, width=None, height=None, message_id=None, channel_id=None):
+        self.number = number
+        self.url = url
+        self.filename = filename
+        self.content_hash = content_hash
+        self.width = width
+        self.height = height
+        self.message_id = message_id
+        # Channel holding message_id when it isn't the thread itself (e.g. the message a thread was started from)
+        self.channel_id = channel_id
+
+    def to_list(self):
+        return [self.number, self.url, self.filename, self.content_hash, self.width, self.height, self.message_id, self.channel_id]
+
+    @classmethod
+    def from_list(cls, values):
+        return cls(*values)
+
+class ImageHistory:
+    """
+    Bounded ring of the images posted in a thread.
+
+    Images are numbered in upload order (#1, #2, ...) and keep their number
+    after older images fall out of the ring, so references stay stable.
+    """
+    __slots__ = ('records', 'next_number')
+
+    def __init__(self, max_size=THREAD_HISTORY_SIZE, records=(), next_number=1):
+        self.records = deque(records, maxlen=max_size)
+        self.next_number = next_number
+
+    def add(self, url, filename, content_hash=None, width=None, height=None, message_id=None, channel_id=None):
+        """Append an image and return its record"""
+        record = ImageRecord(self.next_number, url, filename, content_hash, width, height, message_id, channel_id)
+        self.next_number += 1
+        self.records.append(record)
+        return record
+
+    def latest(self):
+        return self.records[-1] if self.records else None
+
+    def get(self, number):
+        """Return the record for image #number, or None if it isn't remembered"""
+        for record in self.records:
+            if record.number == number:
+                return record
+        return None
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def to_dict(self):
+        return {'next_number': self.next_number, 'records': [record.to_list() for record in self.records]}
+
+    @classmethod
+    def from_dict(cls, data):
+        records = [ImageRecord.from_list(values) for values in data.get('records', [])]
+        return cls(records=records, next_number=data.get('next_number', len(records) + 1))
+
+class ThreadStore(MutableMapping):
+    """
+    Thread session store backed by SQLite.
+
+    Behaves like the plain dict it replaces (thread id -> session dict), so
+    reads are served from memory and never touch disk. Writes are queued and
+    applied in batches by a background task, so Discord handlers never block
+    on SQLite. Sessions must be replaced as a whole (store[id] = {...}) or
+    followed by touch() for changes to be persisted.
+
+    Only sessions of live threads are kept in memory: an archived thread's
+    session can be unloaded to disk and restored when the thread is used
+    again. Expiry pops in-memory sessions off a min-heap ordered by last
+    activity, so each removal is O(log n) and nothing is scanned; sessions
+    that are only on disk are expired with a range query on the
+    last_activity index.
+    """
+
+    def __init__(self, path=THREAD_DB_PATH, flush_interval=THREAD_FLUSH_INTERVAL):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.sessions = {}  # thread id -> session dict
+        self.last_activity = {}  # thread id -> epoch seconds
+        self.pending = {}  # thread id -> True (upsert) or None (delete)
+        self.expiry = []  # min-heap of (last_activity, thread id); entries outdated by later activity are skipped
+        self.unloaded = set()  # ids of sessions kept only on disk (archived threads)
+        self.loaded = False
+        self._conn = None
+        self._lock = threading.Lock()
+        self._flush_task = None
+        # Created lazily so it binds to the bot's running event loop
+        self._flush_lock = None
+
+    # Mapping interface (in-memory, never blocks)
+
+    def __getitem__(self, thread_id):
+        return self.sessions[thread_id]
+
+    def __setitem__(self, thread_id, session):
+        self.sessions[thread_id] = session
+        self.unloaded.discard(thread_id)
+        self._schedule(thread_id, time.time())
+        self.pending[thread_id] = True
+
+    def __delitem__(self, thread_id):
+        del self.sessions[thread_id]
+        self.last_activity.pop(thread_id, None)
+        self.pending[thread_id] = None
+
+    def __contains__(self, thread_id):
+        return thread_id in self.sessions
+
+    def __iter__(self):
+        return iter(self.sessions)
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def touch(self, thread_id):
+        """Record activity in a thread so it isn't expired"""
+        if thread_id in self.sessions:
+            self._schedule(thread_id, time.time())
+            self.pending[thread_id] = True
+
+    def forget(self, thread_id):
+        """Delete a session whether it is in memory or only on disk (e.g. its thread was deleted)"""
+        if thread_id in self.sessions:
+            del self[thread_id]
+        elif thread_id in self.unloaded:
+            self.unloaded.discard(thread_id)
+            self.pending[thread_id] = None
+
+    def _schedule(self, thread_id, last_activity):
+        self.last_activity[thread_id] = last_activity
+        heapq.heappush(self.expiry, (last_activity, thread_id))
+        # Rebuild once outdated entries outnumber live ones, keeping the heap O(sessions)
+        if len(self.expiry) > 2 * len(self.sessions) + 64:
+            self.expiry = [(stamp, session_id) for session_id, stamp in self.last_activity.items()]
+            heapq.heapify(self.expiry)
+
+    # Persistence (SQLite calls run in a worker thread)
+
+    def _connect(self):
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    def _read_all(self):
+        with self._lock:
+            return self._connect().execute(
+                "SELECT thread_id, data, created_at, last_activity FROM threads"
+            ).fetchall()
+
+    def _read_one(self, thread_id):
+        with self._lock:
+            return self._connect().execute(
+                "SELECT thread_id, data, created_at, last_activity FROM threads WHERE thread_id = ?",
+                (thread_id,)
+            ).fetchone()
+
+    def _decode(self, row):
+        """Put a database row back in memory as a session"""
+        thread_id, data, created_at, last_activity = row
+        session = json.loads(data)
+        session['timestamp'] = datetime.datetime.fromtimestamp(created_at)
+        if 'history' in session:
+            session['history'] = ImageHistory.from_dict(session['history'])
+        self.sessions[thread_id] = session
+        self._schedule(thread_id, last_activity)
+
+    async def load(self):
+        """Load stored sessions, keeping any created in memory before the load finished"""
+        rows = await asyncio.to_thread(self._read_all)
+        for row in rows:
+            thread_id = row[0]
+            if thread_id in self.sessions or self.pending.get(thread_id, False) is None:
+                continue
+            self._decode(row)
+        self.loaded = True
+        return len(rows)
+
+    async def unload(self, thread_id):
+        """
+        Drop a session from memory, keeping it on disk until restore() (e.g. its thread was archived).
+        
+        Returns True if the session was unloaded.
+        """
+        if thread_id not in self.sessions:
+            return False
+        if thread_id in self.pending:
+            await self.flush()
+        # Keep it if it was used again (or removed) while the flush ran
+        if thread_id not in self.sessions or thread_id in self.pending:
+            return False
+        del self.sessions[thread_id]
+        del self.last_activity[thread_id]
+        self.unloaded.add(thread_id)
+        return True
+
+    async def restore(self, thread_id):
+        """Bring an unloaded session back into memory; returns True if the thread has a session"""
+        if thread_id in self.unloaded:
+            row = await asyncio.to_thread(self._read_one, thread_id)
+            # Skip if the session was replaced or forgotten while the row was read
+            if thread_id in self.unloaded:
+                self.unloaded.discard(thread_id)
+                if row is not None:
+                    self._decode(row)
+        return thread_id in self.sessions
+
+    def _encode(self, thread_id):
+        """Serialize a session into a database row"""
+        session = dict(self.sessions[thread_id])
+        timestamp = session.pop('timestamp', None)
+        if 'history' in session:
+            session['history'] = session['history'].to_dict()
+        created_at = timestamp.timestamp() if timestamp else time.time()
+        return (thread_id, json.dumps(session), created_at, self.last_activity[thread_id])
+
+    def _write(self, upserts, deletes):
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                if upserts:
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO threads (thread_id, data, created_at, last_activity) VALUES (?, ?, ?, ?)",
+                        upserts
+                    )
+                if deletes:
+                    conn.executemany("DELETE FROM threads WHERE thread_id = ?", [(thread_id,) for thread_id in deletes])
+
+    def _take_pending(self):
+        """Snapshot queued writes on the event loop so the worker never sees a half-updated dict"""
+        pending, self.pending = self.pending, {}
+        upserts = [self._encode(thread_id) for thread_id, op in pending.items() if op and thread_id in self.sessions]
+        deletes = [thread_id for thread_id, op in pending.items() if op is None]
+        return pending, upserts, deletes
+
+    async def flush(self):
+        """Apply all queued writes in a single transaction"""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        # Serialize flushes so batches reach the database in the order they were queued
+        async with self._flush_lock:
+            if not self.pending:
+                return 0
+            pending, upserts, deletes = self._take_pending()
+            try:
+                await asyncio.to_thread(self._write, upserts, deletes)
+            except Exception:
+                # Re-queue the batch unless a newer write for the same thread was queued meanwhile
+                for thread_id, op in pending.items():
+                    self.pending.setdefault(thread_id, op)
+                raise
+            return len(upserts) + len(deletes)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"[THREAD STORE] Flush failed: {e}")
+
+    def start(self):
+        """Start the background write-behind task"""
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        """Stop the background task, write everything still queued and close the database"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        if self.loaded:
+            await self.flush()
+        await asyncio.to_thread(self._close_connection)
+
+    def _close_connection(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    # Expiry
+
+    def _expired_ids(self, cutoff, limit):
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT thread_id FROM threads WHERE last_activity < ? ORDER BY last_activity LIMIT ?",
+                (cutoff, limit)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    async def expire(self, max_age, limit=500):
+        """
+        Remove up to `limit` sessions inactive for longer than max_age seconds.
+
+        Returns the removed thread ids.
+        """
+        cutoff = time.time() - max_age
+        removed = []
+
+        # Sessions in memory come off the heap in order of last activity
+        while self.expiry and self.expiry[0][0] < cutoff and len(removed) < limit:
+            last_activity, thread_id = heapq.heappop(self.expiry)
+            if self.last_activity.get(thread_id) == last_activity:
+                del self[thread_id]
+                removed.append(thread_id)
+
+        # Sessions only on disk are found through the last_activity index
+        if self.unloaded and len(removed) < limit:
+            candidates = await asyncio.to_thread(self._expired_ids, cutoff, limit - len(removed))
+            for thread_id in candidates:
+                # Sessions in memory are the heap's business (the disk copy may be behind)
+                if thread_id in self.unloaded:
+                    self.unloaded.discard(thread_id)
+                    self.pending[thread_id] = None
+                    removed.append(thread_id)
+
+        if removed:
+            await self.flush()
+        return removed
+
+    def next_expiry(self, max_age):
+        """Seconds until the next in-memory session is due to expire, or None if there are none"""
+        # Drop outdated entries from the top so the answer is exact
+        while self.expiry and self.last_activity.get(self.expiry[0][1]) != self.expiry[0][0]:
+            heapq.heappop(self.expiry)
+        if not self.expiry:
+            return None
+        return max(0.0, self.expiry[0][0] + max_age - time.time())
+
+    # Statistics
+
+    def memory_usage(self):
+        """Bytes held in memory by the sessions and their bookkeeping (follows references, not an estimate from str())"""
+        seen = set()
+        total = deep_sizeof(self.sessions, seen) + deep_sizeof(self.last_activity, seen)
+        total += deep_sizeof(self.expiry, seen) + deep_sizeof(self.unloaded, seen) + deep_sizeof(self.pending, seen)
+        return total
+
+    def disk_usage(self):
+        """Bytes used by the database file and its write-ahead log"""
+        total = 0
+        for path in (self.path, self.path + '-wal', self.path + '-shm'):
+            try:
+                total += os.path.getsize(path)
+            except OSError:
+                pass
+        return total
+
+def deep_sizeof(obj, seen):
+    """Size of an object and everything it references, counting shared objects once"""
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(key, seen) + deep_sizeof(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+        size += sum(deep_sizeof(item, seen) for item in obj)
+    elif hasattr(obj, '__slots__'):
+        size += sum(deep_sizeof(getattr(obj, name), seen) for name in obj.__slots__ if hasattr(obj, name))
+    return size